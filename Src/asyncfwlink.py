@@ -0,0 +1,299 @@
+import asyncio
+import os
+import serial
+import termios
+
+from fwframer import Fw_Framer
+from fwlink import Fw_Link, _BlockPipeline, _calibratedTimeout, _encodeRequests
+from fwpacket import *
+
+#-------------------------------------------------------------------------------
+class AsyncFwLink():
+  """ Communicate with firmware through a serial port from an asyncio event loop.
+
+  The serial port is opened in non-blocking mode and its file descriptor is
+  watched by the event loop, so several links can share one thread. Only
+  available on platforms where serial ports have a file descriptor (POSIX).
+  After an acknowledged sync() read timeouts are derived from the round trip
+  time like those of Fw_Link. Received data goes through the same Fw_Framer,
+  so stray bytes only cost the reply they hit. A read error of the port is
+  kept and raised by every later read.
+  """
+
+  _kDefaultPipelineDepth = Fw_Link._kDefaultPipelineDepth
+  _kSyncRequest = Fw_Link._kSyncRequest
+  _kSyncTimeout = Fw_Link._kSyncTimeout
+  _kReadChunkSize = 4096
+
+  def __init__(self):
+    self.ser = None
+    self.readTimeout = None
+    self.rtt = None
+    self.acknowledgedSync = False
+    self._syncToken = 0
+    self._fd = None
+    self._framer = Fw_Framer()
+    self._rxWaiter = None
+    self._error = None
+    self._txBuffer = bytearray(Fw_Packet._HEADER_LENGTH)
+    self.setPipelineDepth(self._kDefaultPipelineDepth)
+
+  async def open(self, port, readtimeout):
+    """ Open a serial port for communication with the firmware.
+    :param port: The name of the serial port e.g. /dev/ttyS0.
+    :param readtimeout: Time in seconds to wait for a reply.
+    :return: True if port was opened
+    :rtype: bool """
+    retv = False
+
+    if port is not None:
+      try:
+        self.ser = serial.Serial(port, timeout=0, write_timeout=0)
+        self.ser.baudrate = 921600
+        self.ser.flushInput()
+        self.ser.flushOutput()
+        self.attach(self.ser.fileno(), readtimeout)
+        retv = True
+      except serial.SerialException as e:
+        print("Serial error: (", e.errno, "):", e.strerror)
+
+    return retv
+
+  def attach(self, fd, readtimeout):
+    """ Use an already opened non-blocking file descriptor, e.g. a pty.
+    :param fd: File descriptor.
+    :param readtimeout: Time in seconds to wait for a reply. """
+    self._detach()
+    os.set_blocking(fd, False)
+    self._fd = fd
+    self.readTimeout = readtimeout
+    self._framer.reset()
+    self._error = None
+    asyncio.get_running_loop().add_reader(fd, self._onReadable)
+
+  def close(self):
+    """
+    Close serial port.
+    """
+    self._detach()
+    if self.ser is not None:
+      self.ser.close()
+      self.ser = None
+
+  def setAcknowledgedSync(self, enabled):
+    """ See Fw_Link.setAcknowledgedSync """
+    self.acknowledgedSync = bool(enabled)
+    if not self.acknowledgedSync:
+      self.rtt = None
+
+  def setPipelineDepth(self, depth):
+    """ Set the maximum number of READ_BLOCK requests in flight.
+    :param depth: Window depth. 1 disables pipelining. """
+    self.pipelineDepth = max(1, int(depth))
+
+  def flushInput(self):
+    """ Discard received data that has not been read yet """
+    self._framer.reset()
+    if self._fd is not None:
+      try:
+        termios.tcflush(self._fd, termios.TCIFLUSH)
+      except (termios.error, OSError):
+        pass
+
+  async def transceive(self, request_packet):
+    """ Transmit request packet
+    :type request_packet: Fw_Packet
+    :return: Reply packet or None if the checksum was wrong
+    :rtype: Fw_Packet """
+    await self._writePacket(request_packet)
+
+    frame = await self._receive(request_packet.cmd, request_packet.replyLength)
+    if frame is None:
+      self._raiseMissing()
+    reply = decodeFwPacket(frame)
+    if reply is not None:
+      # The frame is a view into the receive buffer, which the next read reuses
+      reply.setData(bytes(reply.getData()))
+    return reply
+
+  async def transceiveBatch(self, requests):
+    """ Transmit several requests with one write, see Fw_Link.transceiveBatch.
+    :return: Reply packets in request order. None if a reply failed the
+      checksum or does not match its request.
+    :rtype: list """
+    if not requests:
+      return []
+    await self._writePackets(requests)
+
+    replies = []
+    for request in requests:
+      frame = await self._receive(request.cmd, request.replyLength)
+      if frame is None:
+        if replies:
+          raise IOError('Did not receive all reply packets')
+        self._raiseMissing()
+
+      reply = decodeFwPacket(frame)
+      if reply is None or reply.address != request.address:
+        reply = None
+      else:
+        reply.setData(bytes(reply.getData()))
+      replies.append(reply)
+    return replies
+
+  async def readBlocks(self, address, length, count, window = None, stats = None, callback = None, partial = False):
+    """ Read consecutive blocks of memory while keeping a window of
+    READ_BLOCK requests outstanding. See Fw_Link.readBlocks.
+    :param partial: If True a timeout or short reply ends the transfer instead of
+      raising IOError, and every block without a valid reply is returned as None.
+    :return: Reply packets in address order. None if a reply failed the checksum.
+    :rtype: list """
+    if window is None:
+      window = self.pipelineDepth
+    pipeline = _BlockPipeline(address, length, count, window, stats, callback)
+
+    try:
+      while not pipeline.done():
+        requests = pipeline.nextRequests()
+        if requests:
+          await self._writePackets(requests)
+
+        frame = await self._receive(Fw_Command.READ_BLOCK, length)
+        if frame is None:
+          self._raiseMissing()
+        pipeline.receive(frame)
+    except IOError:
+      if not partial:
+        raise
+
+    return pipeline.getReplies()
+
+  async def sync(self, timeout = None):
+    """ Reset the firmware interpreter and, with acknowledgedSync, wait for
+    the acknowledging NOP reply, see Fw_Link.sync.
+    :return: False if the sync was not acknowledged
+    :rtype: bool """
+    loop = asyncio.get_running_loop()
+    self._framer.reset()
+    await self._write(self._kSyncRequest)
+    if not self.acknowledgedSync:
+      return True
+
+    self._syncToken = (self._syncToken + 1) & 0xFFFF
+    request = Fw_Packet(Fw_Command.NOP, address=self._syncToken)
+    start = loop.time()
+    await self._writePacket(request)
+
+    deadline = start + (timeout if timeout is not None else self._kSyncTimeout)
+    while True:
+      frame = await self._receive(Fw_Command.NOP, 0, deadline)
+      if frame is None:
+        return False
+      reply = decodeFwPacket(frame)
+      if reply is not None and reply.address == request.address:
+        self.rtt = loop.time() - start
+        return True
+
+  async def _writePacket(self, packet):
+    await self._writePackets((packet,))
+
+  async def _writePackets(self, packets):
+    """ Write packets back to back with a single write """
+    length = _encodeRequests(self, packets)
+    await self._write(memoryview(self._txBuffer)[:length])
+
+  async def _write(self, data):
+    """ Write all data, waiting for the port to become writable when its buffer is full. """
+    if self._fd is None:
+      raise IOError('Serial port is not open')
+
+    loop = asyncio.get_running_loop()
+    view = memoryview(data)
+    while len(view):
+      try:
+        written = os.write(self._fd, view)
+        view = view[written:]
+      except BlockingIOError:
+        writable = loop.create_future()
+        loop.add_writer(self._fd, writable.set_result, None)
+        try:
+          await writable
+        finally:
+          loop.remove_writer(self._fd)
+
+  async def _receive(self, cmd, length = None, deadline = None):
+    """ Receive the next reply frame of a command, see Fw_Link._receive.
+    :param deadline: Event loop time. By default the read timeout.
+    :return: Frame as a view into the receive buffer, valid until the next
+      await, or None if it did not arrive in time
+    :rtype: memoryview """
+    if deadline is None:
+      timeout = _calibratedTimeout(self, Fw_Packet._HEADER_LENGTH + (length or 0))
+      deadline = None if timeout is None else asyncio.get_running_loop().time() + timeout
+
+    frame = self._framer.nextFrame(cmd, length)
+    while frame is None:
+      if not await self._waitForData(deadline):
+        break
+      frame = self._framer.nextFrame(cmd, length)
+    return frame
+
+  def _raiseMissing(self):
+    """ Raise the IOError of a reply that did not arrive in time """
+    if self._framer.getLength() == 0:
+      raise IOError('Did not receive reply packet')
+    raise IOError('Did not receive full reply packet')
+
+  async def _waitForData(self, deadline):
+    """ Wait until more data is received
+    :param deadline: Event loop time, or None to wait forever.
+    :return: False if the deadline passed
+    :rtype: bool """
+    if self._error is not None:
+      raise self._error
+    loop = asyncio.get_running_loop()
+    remaining = None if deadline is None else deadline - loop.time()
+    if remaining is not None and remaining <= 0:
+      return False
+    self._rxWaiter = loop.create_future()
+    try:
+      await asyncio.wait_for(self._rxWaiter, remaining)
+    except asyncio.TimeoutError:
+      return False
+    finally:
+      self._rxWaiter = None
+    return True
+
+  def _onReadable(self):
+    try:
+      chunk = os.read(self._fd, self._kReadChunkSize)
+    except BlockingIOError:
+      return
+    except OSError as e:
+      self._fail(IOError(e.errno, e.strerror))
+      return
+
+    if not chunk:
+      self._fail(IOError('Serial port closed'))
+      return
+
+    if not self._framer.feed(chunk):
+      self._fail(IOError('Receive buffer overflow'))
+      return
+    if self._rxWaiter is not None and not self._rxWaiter.done():
+      self._rxWaiter.set_result(None)
+
+  def _fail(self, error):
+    """ Keep the error for the next read and wake up a pending one """
+    self._error = error
+    if self._rxWaiter is not None and not self._rxWaiter.done():
+      self._rxWaiter.set_exception(error)
+    self._detach()
+
+  def _detach(self):
+    if self._fd is not None:
+      try:
+        asyncio.get_running_loop().remove_reader(self._fd)
+      except RuntimeError:
+        pass
+      self._fd = None
@@ -0,0 +1,164 @@
+""" Bankswitching method detection
+
+Detection runs in two steps before a dump:
+  1. The code in the cartridge window below the hotspots is scanned for
+     absolute mode instructions (LDA $1FF8, BIT $1FE3, STA $1FF9,X, ...)
+     that access a hotspot of a registered scheme. The scan is vectorized
+     with NumPy.
+  2. Every scheme with hits is probed on the cartridge: each of its
+     hotspots is touched and a sample of the window or slice it switches
+     is read. A scheme fits if every hotspot shows different data. Of the
+     fitting schemes, the one with the most windows wins, so an F6 cart is
+     not mistaken for F8 and an E0 cart not for E7.
+Carts without hits, or without a fitting scheme, are NONE. Requires NumPy,
+which is imported on the first scan, so importing this module does not.
+"""
+
+from bankswitch import *
+
+# Absolute mode opcodes that read or write memory, including the indexed
+# forms used for bank switching through a table
+_kAbsoluteOpcodes = (
+  0x0C,  # NOP abs
+  0x2C,  # BIT abs
+  0x8C,  # STY abs
+  0x8D,  # STA abs
+  0x8E,  # STX abs
+  0x99,  # STA abs,Y
+  0x9D,  # STA abs,X
+  0xAC,  # LDY abs
+  0xAD,  # LDA abs
+  0xAE,  # LDX abs
+  0xB9,  # LDA abs,Y
+  0xBD,  # LDA abs,X
+  0xCC,  # CPY abs
+  0xCD,  # CMP abs
+  0xEC,  # CPX abs
+)
+
+_kWindowBase = 0x1000
+_kWindowSize = 0x1000
+
+#///////////////////////////////////////////////////////////////////////////////
+# Functions
+#///////////////////////////////////////////////////////////////////////////////
+def findHotspotAccesses(code):
+  """ Count absolute mode accesses per cartridge address. The cartridge only
+  decodes A0-A12, so $1FF8, $3FF8 and $FFF8 all count as $1FF8.
+  :param code: Bytes-like machine code.
+  :return: Array of counts indexed by address - 0x1000
+  :rtype: numpy.ndarray
+  :raises ImportError: if NumPy is not installed """
+  import numpy
+
+  data = numpy.frombuffer(bytes(code), dtype=numpy.uint8)
+  if len(data) < 3:
+    return numpy.zeros(_kWindowSize, dtype=numpy.intp)
+
+  isAccess = numpy.isin(data[:-2], numpy.array(_kAbsoluteOpcodes, dtype=numpy.uint8))
+  operand = data[1:-1].astype(numpy.uint16) | (data[2:].astype(numpy.uint16) << 8)
+  selected = isAccess & ((operand & 0x1000) != 0)
+  return numpy.bincount(operand[selected] & 0x0FFF, minlength=_kWindowSize)
+
+
+def getSchemeHotspots(scheme):
+  """ :return: Addresses of the hotspots that select ROM banks
+  :rtype: list """
+  if isinstance(scheme, FlatScheme):
+    return list(scheme.hotspots)
+  if isinstance(scheme, SlicedScheme):
+    return sorted(scheme.hotspots.values())
+  return []
+
+#///////////////////////////////////////////////////////////////////////////////
+# Classes
+#///////////////////////////////////////////////////////////////////////////////
+class BankSwitchDetector():
+  """ Detect the bankswitching method of the cartridge in a reader
+
+  Attributes:
+    _kSampleLength  Length of each sample block in bytes.
+  """
+  _kSampleLength = 64
+
+  def __init__(self, read, touch, debugLog = None, sample = None):
+    """
+    :param read: Called as read(address, length), returns the bytes.
+    :param touch: Called as touch(address) to access a hotspot.
+    :param sample: Optional faster replacement of touch and read, called as
+      sample(windows, length) with a list of (hotspot, sample addresses).
+      Returns the joined samples of every window.
+    """
+    self.read = read
+    self.touch = touch
+    self.sample = sample or self._sample
+    self.debugLog = debugLog or (lambda message: None)
+
+  def detect(self):
+    """ Scan and probe the cartridge
+    :return: Bankswitching method
+    :rtype: int """
+    schemes = [(method, scheme) for method, scheme in getBankSchemes()
+               if getSchemeHotspots(scheme)]
+    scanEnd = _kWindowBase + _kWindowSize
+    if schemes:
+      scanEnd = min(min(getSchemeHotspots(scheme)) for _, scheme in schemes)
+    scores = self.score(self.read(_kWindowBase, scanEnd - _kWindowBase), schemes)
+
+    best = BankSwitchMethod.NONE
+    bestWindows = 1
+    for method, scheme in schemes:
+      if not scores[method]:
+        continue
+      windows = self._probe(scheme)
+      self.debugLog('Scheme ' + str(method) + ': ' + str(scores[method]) + ' hotspot accesses, ' +
+                    (str(windows) + ' windows' if windows else 'does not fit'))
+      if windows > bestWindows:
+        best = method
+        bestWindows = windows
+    return best
+
+  def score(self, code, schemes):
+    """ :return: Dictionary of method to the number of hotspot accesses in code
+    :rtype: dict """
+    counts = findHotspotAccesses(code)
+    return dict((method, int(counts[[a - _kWindowBase for a in getSchemeHotspots(scheme)]].sum()))
+                for method, scheme in schemes)
+
+  def _probe(self, scheme):
+    """ Touch every hotspot of a scheme and sample what it switches
+    :return: Number of windows if every hotspot shows different data, otherwise 0
+    :rtype: int """
+    windows = self._windows(scheme)
+    samples = {}
+    for (hotspot, addresses), sample in zip(windows, self.sample(windows, self._kSampleLength)):
+      samples.setdefault(addresses, []).append(sample)
+
+    windows = 0
+    for seen in samples.values():
+      if len(set(seen)) != len(seen):
+        return 0
+      windows += len(seen)
+    return windows
+
+  def _sample(self, windows, length):
+    """ Touch every hotspot and read its sample blocks
+    :return: Joined samples of every window
+    :rtype: list """
+    samples = []
+    for hotspot, addresses in windows:
+      self.touch(hotspot)
+      samples.append(b''.join(self.read(address, length) for address in addresses))
+    return samples
+
+  def _windows(self, scheme):
+    """ :return: (hotspot, sample addresses) for every hotspot of a scheme
+    :rtype: list """
+    if isinstance(scheme, SlicedScheme):
+      windows = []
+      for (sliceIndex, bank), hotspot in sorted(scheme.hotspots.items()):
+        base = scheme.slices[sliceIndex]
+        windows.append((hotspot, (base + scheme.bankSize // 4, base + 3 * scheme.bankSize // 4)))
+      return windows
+    addresses = (_kWindowBase + _kWindowSize // 4, _kWindowBase + 3 * _kWindowSize // 4)
+    return [(hotspot, addresses) for hotspot in scheme.hotspots]
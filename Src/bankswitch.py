@@ -0,0 +1,376 @@
+""" Bankswitching address generators
+
+Every bankswitching scheme produces a read plan: an ordered list of hotspot
+accesses and block reads that together cover the whole ROM image. Block reads
+never touch a hotspot, so they can be as large as the firmware allows.
+
+Hotspot accesses are READ_SINGLE requests. The byte returned by a hotspot
+access is taken from the bank that was selected before the access, after
+which the cartridge switches to the bank belonging to the hotspot.
+"""
+
+import abc
+
+#///////////////////////////////////////////////////////////////////////////////
+# Classes
+#///////////////////////////////////////////////////////////////////////////////
+class BankSwitchMethod():
+  """ Bankswitching types enum
+  Special thanks to Kevin "Kevtris" Horton for these descriptions
+
+  Attributes:
+    NONE  No bankswitching.
+    F6    FF6/FF7/FF8/FF9 bankswitching
+    F8    FF8/FF9 bankswitching
+    FA    FF8/FF9/FFA bankswitching (aka CBS' RAM Plus)
+    E0    FE0-FF7 bankswitching (aka Parker Bros.)
+    E7    FE0-FE7 bankswitching found on M-Network carts
+    FE    01FE/11FE bankswitching (aka Activision Robot Tank)
+    USER  User defined bankswitching
+    AUTO  Detect the bankswitching method before dumping, see bankdetect.py
+  """
+  NONE = 0
+  F6 = 1
+  F8 = 2
+  FA = 3
+  E0 = 4
+  E7 = 5
+  FE = 6
+  USER = 7
+  AUTO = 8
+
+
+class HotspotAccess():
+  """ Read from a hotspot address to switch banks
+
+  Attributes:
+    address   Hotspot address.
+    offset    Image offset of the byte that is read, or None if the byte is of no use.
+    length    Always 1.
+    reselect  Hotspot that selects the bank the byte is read from. A failed
+              access is retried by touching this hotspot first. None if the
+              byte does not depend on the selected bank.
+  """
+  def __init__(self, address, offset = None, reselect = None):
+    self.address = address
+    self.offset = offset
+    self.length = 1
+    self.reselect = reselect
+
+
+class BlockRead():
+  """ Read a contiguous range of memory that contains no hotspots
+
+  Attributes:
+    address Start address.
+    length  Length in bytes.
+    offset  Image offset of the first byte.
+  """
+  def __init__(self, address, length, offset):
+    self.address = address
+    self.length = length
+    self.offset = offset
+
+
+class ReadPlan():
+  """ Ordered list of steps that read a complete ROM image
+
+  Attributes:
+    size  Size of the ROM image in bytes.
+    steps HotspotAccess and BlockRead steps in execution order.
+  """
+  def __init__(self, size):
+    self.size = size
+    self.steps = []
+
+  def getHotspotAccessCount(self):
+    return sum(1 for s in self.steps if isinstance(s, HotspotAccess))
+
+  def getBlockReads(self):
+    return [s for s in self.steps if isinstance(s, BlockRead)]
+
+
+class BankScheme(abc.ABC):
+  """ Base class of bankswitching address generators. Subclasses implement
+  createPlan.
+
+  Attributes:
+    size        Size of the ROM image in bytes.
+    mirrorSizes Smaller ROM sizes that are mirrored to fill size, largest first.
+  """
+  _kWindowBase = 0x1000
+  _kWindowSize = 0x1000
+
+  def __init__(self, size, mirrorSizes = ()):
+    self.size = size
+    self.mirrorSizes = sorted(mirrorSizes, reverse=True)
+
+  @abc.abstractmethod
+  def createPlan(self, size = None):
+    """ Create a read plan for this scheme
+    :param size: One of mirrorSizes to read only the unique part of a mirrored ROM.
+    :rtype: ReadPlan """
+
+  def getMirrorProbes(self, size, count):
+    """ Address pairs that hold the same data if the ROM is size bytes and mirrored
+    :param count: Number of pairs, spread over the ROM. The last pair covers
+      the end of the ROM, where the reset vector is.
+    :return: List of (address, mirrorAddress, length) tuples. Empty for
+      schemes that are never mirrored.
+    :rtype: list """
+    return []
+
+
+class FlatScheme(BankScheme):
+  """ Banks that each fill the whole 4K cartridge window, selected by
+  hotspots inside that window (F8, F6, FA).
+
+  Every (bank, hotspot) byte can only be read by touching the hotspot while
+  the bank is selected. The plan walks an Eulerian circuit over the banks so
+  each hotspot byte is read exactly once, and the block reads of a bank are
+  done the first time the circuit enters it.
+  """
+
+  _kProbeLength = 64
+
+  def __init__(self, hotspots = (), unreadable = (), mirrorSizes = ()):
+    """
+    :param hotspots: Hotspot address for each bank.
+    :param unreadable: (start, end) address ranges that do not contain ROM data, e.g. cartridge RAM.
+    :param mirrorSizes: ROM sizes smaller than the window that are mirrored.
+      Only possible without hotspots.
+    """
+    BankScheme.__init__(self, max(1, len(hotspots)) * self._kWindowSize,
+                        mirrorSizes if not hotspots else ())
+    self.hotspots = list(hotspots)
+    self.unreadable = list(unreadable)
+
+  def createPlan(self, size = None):
+    plan = ReadPlan(size or self.size)
+    banks = max(1, len(self.hotspots))
+
+    if not self.hotspots:
+      blocks = _contiguousRanges(self._kWindowBase, self._kWindowBase + plan.size, (), self.unreadable)
+      _appendBlocks(plan, blocks, 0)
+      return plan
+
+    blocks = _contiguousRanges(self._kWindowBase, self._kWindowBase + self._kWindowSize,
+                               self.hotspots, self.unreadable)
+
+    # The selected bank is unknown at start, select bank 0 first.
+    plan.steps.append(HotspotAccess(self.hotspots[0]))
+
+    visited = set()
+    bank = 0
+    for nextBank in _eulerianCircuit(banks):
+      if bank not in visited:
+        visited.add(bank)
+        _appendBlocks(plan, blocks, bank * self._kWindowSize)
+      address = self.hotspots[nextBank]
+      plan.steps.append(HotspotAccess(address, bank * self._kWindowSize + address - self._kWindowBase,
+                                      reselect=self.hotspots[bank]))
+      bank = nextBank
+
+    return plan
+
+  def getMirrorProbes(self, size, count):
+    length = min(self._kProbeLength, size)
+    last = max(1, count - 1)
+    probes = []
+    for i in range(count):
+      address = self._kWindowBase + (size - length) * i // last
+      probes.append((address, address + size, length))
+    return probes
+
+
+class SlicedScheme(BankScheme):
+  """ Banks that are mapped into slices of the cartridge window, with the
+  last slice fixed and holding the hotspots (E0, E7).
+
+  Because the hotspots live in the fixed slice, the byte read from any
+  hotspot is known. Every hotspot is touched exactly once: the plan fills as
+  many switchable slices as possible before each block read, so contiguous
+  slices are read as one block.
+  """
+
+  def __init__(self, bankSize, slices, hotspots, fixedBank, fixedBase, unreadable = (), extraHotspots = ()):
+    """
+    :param bankSize: Size of a bank and of a slice in bytes.
+    :param slices: Base address of each switchable slice, in ascending order.
+    :param hotspots: Dictionary that maps (slice, bank) to a hotspot address.
+    :param fixedBank: Bank that is always mapped into the fixed slice.
+    :param fixedBase: Address that the start of fixedBank is mapped to.
+    :param unreadable: (start, end) address ranges that do not contain ROM data.
+    :param extraHotspots: Hotspots that do not select a ROM bank, touched after all ROM reads.
+    """
+    BankScheme.__init__(self, (fixedBank + 1) * bankSize)
+    self.bankSize = bankSize
+    self.slices = list(slices)
+    self.hotspots = dict(hotspots)
+    self.fixedBank = fixedBank
+    self.fixedBase = fixedBase
+    self.unreadable = list(unreadable)
+    self.extraHotspots = list(extraHotspots)
+
+  def _fixedOffset(self, address):
+    return self.fixedBank * self.bankSize + address - self.fixedBase
+
+  def createPlan(self, size = None):
+    plan = ReadPlan(self.size)
+    allHotspots = sorted(list(self.hotspots.values()) + self.extraHotspots)
+    touched = set()
+
+    # Fixed slice first, it never moves
+    fixedEnd = self._kWindowBase + self._kWindowSize
+    for start, end in _contiguousRanges(self.fixedBase, fixedEnd, allHotspots, self.unreadable):
+      plan.steps.append(BlockRead(start, end - start, self._fixedOffset(start)))
+
+    banks = list(range(self.fixedBank))
+    while banks:
+      group = banks[:len(self.slices)]
+      banks = banks[len(self.slices):]
+      for sliceIndex, bank in enumerate(group):
+        address = self.hotspots[(sliceIndex, bank)]
+        plan.steps.append(HotspotAccess(address, self._fixedOffset(address)))
+        touched.add(address)
+      # Adjacent slices holding consecutive banks are merged into one block read
+      for sliceIndex, bank in enumerate(group):
+        plan.steps.append(BlockRead(self.slices[sliceIndex], self.bankSize, bank * self.bankSize))
+      _mergeBlockReads(plan)
+
+    for address in allHotspots:
+      if address not in touched:
+        plan.steps.append(HotspotAccess(address, self._fixedOffset(address)))
+
+    return plan
+
+
+#///////////////////////////////////////////////////////////////////////////////
+# Scheme registry
+#///////////////////////////////////////////////////////////////////////////////
+_schemes = {}
+
+def registerBankScheme(method, scheme):
+  """ Register an address generator for a bankswitching method.
+  Use this to plug in BankSwitchMethod.USER schemes.
+  :type scheme: BankScheme """
+  _schemes[method] = scheme
+
+
+def getBankScheme(method):
+  """ Get the address generator of a bankswitching method
+  :return: Scheme or None if the method is not supported
+  :rtype: BankScheme """
+  return _schemes.get(method)
+
+
+def getBankSwitchMethodName(method):
+  """ :return: Name of a BankSwitchMethod value, e.g. 'F8'
+  :rtype: str """
+  for name, value in vars(BankSwitchMethod).items():
+    if value == method and not name.startswith('_'):
+      return name
+  return str(method)
+
+
+def getBankSchemes():
+  """ :return: (method, scheme) of every registered scheme, ordered by method
+  :rtype: list """
+  return sorted(_schemes.items())
+
+
+def createReadPlan(method, size = None):
+  """ Create a read plan for a bankswitching method
+  :param size: Size of a mirrored ROM, see BankScheme.mirrorSizes.
+  :return: Read plan or None if the method is not supported
+  :rtype: ReadPlan """
+  scheme = getBankScheme(method)
+  if scheme is None:
+    return None
+  return scheme.createPlan(size)
+
+
+# 2K ROMs are mirrored at 1800-1FFF
+registerBankScheme(BankSwitchMethod.NONE, FlatScheme(mirrorSizes=(0x800,)))
+registerBankScheme(BankSwitchMethod.F8, FlatScheme(hotspots=(0x1FF8, 0x1FF9)))
+registerBankScheme(BankSwitchMethod.F6, FlatScheme(hotspots=(0x1FF6, 0x1FF7, 0x1FF8, 0x1FF9)))
+# 256 bytes of RAM: write port at 1000-10FF, read port at 1100-11FF
+registerBankScheme(BankSwitchMethod.FA, FlatScheme(hotspots=(0x1FF8, 0x1FF9, 0x1FFA),
+                                                   unreadable=((0x1000, 0x1200),)))
+# Eight 1K banks, three switchable slices, bank 7 fixed at 1C00-1FFF
+registerBankScheme(BankSwitchMethod.E0, SlicedScheme(
+  bankSize=0x400,
+  slices=(0x1000, 0x1400, 0x1800),
+  hotspots=dict(((s, b), 0x1FE0 + 8 * s + b) for s in range(3) for b in range(8)),
+  fixedBank=7,
+  fixedBase=0x1C00))
+# Eight 2K banks, one switchable slice. 1800-19FF is RAM, 1A00-1FFF is the top of bank 7.
+# 1FE7 maps RAM into the switchable slice and 1FE8-1FEB select the RAM bank.
+registerBankScheme(BankSwitchMethod.E7, SlicedScheme(
+  bankSize=0x800,
+  slices=(0x1000,),
+  hotspots=dict(((0, b), 0x1FE0 + b) for b in range(7)),
+  fixedBank=7,
+  fixedBase=0x1800,
+  unreadable=((0x1800, 0x1A00),),
+  extraHotspots=(0x1FE7, 0x1FE8, 0x1FE9, 0x1FEA, 0x1FEB)))
+
+
+#///////////////////////////////////////////////////////////////////////////////
+# Private functions
+#///////////////////////////////////////////////////////////////////////////////
+def _contiguousRanges(start, end, hotspots, unreadable):
+  """ Split [start, end) into the largest ranges that avoid hotspots and unreadable ranges
+  :return: List of (start, end) tuples
+  :rtype: list """
+  excluded = set(hotspots)
+  for first, last in unreadable:
+    excluded.update(range(first, last))
+
+  ranges = []
+  rangeStart = None
+  for address in range(start, end):
+    if address in excluded:
+      if rangeStart is not None:
+        ranges.append((rangeStart, address))
+        rangeStart = None
+    elif rangeStart is None:
+      rangeStart = address
+  if rangeStart is not None:
+    ranges.append((rangeStart, end))
+  return ranges
+
+
+def _appendBlocks(plan, ranges, offset):
+  for start, end in ranges:
+    plan.steps.append(BlockRead(start, end - start, offset + start - BankScheme._kWindowBase))
+
+
+def _mergeBlockReads(plan):
+  """ Merge trailing block reads that are contiguous in both address and image offset """
+  while len(plan.steps) >= 2:
+    a, b = plan.steps[-2], plan.steps[-1]
+    if not (isinstance(a, BlockRead) and isinstance(b, BlockRead)):
+      break
+    if a.address + a.length != b.address or a.offset + a.length != b.offset:
+      break
+    a.length += b.length
+    plan.steps.pop()
+
+
+def _eulerianCircuit(n):
+  """ Eulerian circuit over the complete directed graph with self loops on n
+  nodes, starting and ending at node 0 (Hierholzer's algorithm).
+  :return: Nodes visited after node 0, one per edge
+  :rtype: list """
+  remaining = [list(range(n - 1, -1, -1)) for _ in range(n)]
+  stack = [0]
+  circuit = []
+  while stack:
+    node = stack[-1]
+    if remaining[node]:
+      stack.append(remaining[node].pop())
+    else:
+      circuit.append(stack.pop())
+  circuit.reverse()
+  return circuit[1:]
@@ -0,0 +1,236 @@
+""" Benchmarks for the packet codec, the firmware link, complete dumps and
+start up.
+
+Runs against the firmware simulator, so no reader is needed. The start up
+benchmark runs the GUI with the offscreen Qt platform if PyQt5 is installed. Results are
+written as JSON. Pass an earlier result file with --compare to report the
+difference and fail on regressions.
+
+  python benchmark.py --output bench.json
+  python benchmark.py --compare bench.json
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from romclient import *
+from fwsim import *
+
+_kFormatVersion = 1
+# (image size, bankswitching method). There is no 32K scheme yet, add one
+# here once F4 is supported by bankswitch.py.
+_kImages = (
+  (2048, BankSwitchMethod.NONE),
+  (4096, BankSwitchMethod.NONE),
+  (8192, BankSwitchMethod.F8),
+  (8192, BankSwitchMethod.E0),
+  (12288, BankSwitchMethod.FA),
+  (16384, BankSwitchMethod.F6),
+  (16384, BankSwitchMethod.E7),
+)
+_kBlockLengths = (64, 256, 1024)
+_kStartupRuns = 3
+# GET_INFO reply of the simulated reader
+_kReaderInfo = b'fw=1.0;block=1024;depth=8;cmds=rRdDIn;batch=16'
+_kSourceDirectory = os.path.dirname(os.path.abspath(__file__))
+
+#///////////////////////////////////////////////////////////////////////////////
+# Helpers
+#///////////////////////////////////////////////////////////////////////////////
+def _measure(func, minTime):
+  """ Call func until minTime has passed.
+  :return: Seconds per call
+  :rtype: float """
+  calls = 0
+  start = time.perf_counter()
+  elapsed = 0.0
+  while elapsed < minTime or calls == 0:
+    func()
+    calls += 1
+    elapsed = time.perf_counter() - start
+  return elapsed / calls
+
+
+def _result(value, unit, higherIsBetter):
+  return {'value': value, 'unit': unit, 'higherIsBetter': higherIsBetter}
+
+
+def _runProcess(args, minTime, env = None):
+  """ Run a Python process until minTime has passed, at least _kStartupRuns times.
+  :return: Average wall time per run and average of the float the process printed last
+  :rtype: tuple """
+  runs = []
+  start = time.perf_counter()
+  while len(runs) < _kStartupRuns or time.perf_counter() - start < minTime:
+    t = time.perf_counter()
+    output = subprocess.check_output([sys.executable] + args, cwd=_kSourceDirectory,
+                                     env=env, stderr=subprocess.DEVNULL)
+    runs.append((time.perf_counter() - t, float(output.split()[-1])))
+  return (sum(r[0] for r in runs) / len(runs), sum(r[1] for r in runs) / len(runs))
+
+
+def _createClient(rom, method, args):
+  sim = SimSerial(FirmwareSimulator(SimCartridge(rom, method), _kReaderInfo),
+                  latency=args.latency, bandwidth=args.bandwidth)
+  rc = RomClient(None, lambda message: None, lambda message: None)
+  rc.fw.attach(sim, 1)
+  rc.negotiate()
+  rc.setBankSwitchMethod(method)
+  return rc
+
+#///////////////////////////////////////////////////////////////////////////////
+# Benchmarks
+#///////////////////////////////////////////////////////////////////////////////
+def benchCodec(args, results):
+  request = Fw_Packet(Fw_Command.READ_BLOCK, address=0x1000, length=256)
+  reply = Fw_Packet(Fw_Command.READ_BLOCK, address=0x1000, data=os.urandom(256))
+  reply.replyLength = 256
+  encoded_reply = bytes(reply._encode())
+
+  t = _measure(request._encode, args.min_time)
+  results['codec.encode_request'] = _result(1 / t, 'packets/s', True)
+  t = _measure(lambda: decodeFwPacket(encoded_reply), args.min_time)
+  results['codec.decode_reply_256'] = _result(1 / t, 'packets/s', True)
+  results['codec.decode_reply_256_throughput'] = _result(256 / t, 'bytes/s', True)
+
+  packets = [Fw_Packet(Fw_Command.READ_BLOCK, address=0x1000 + 256 * i, length=256) for i in range(16)]
+  t = _measure(lambda: encodeFwPackets(packets), args.min_time)
+  results['codec.encode_batch_16'] = _result(16 / t, 'packets/s', True)
+
+
+def benchLink(args, results):
+  rom = os.urandom(4096)
+  for length in _kBlockLengths:
+    rc = _createClient(rom, BankSwitchMethod.NONE, args)
+    request = Fw_Packet(Fw_Command.READ_BLOCK, address=0x1000, length=length)
+    t = _measure(lambda: rc.fw.transceive(request), args.min_time)
+    results['link.transceive_' + str(length)] = _result(t, 's/block', False)
+
+  rc = _createClient(rom, BankSwitchMethod.NONE, args)
+  requests = [Fw_Packet(Fw_Command.READ_SINGLE, address=0x1000 + i, length=1) for i in range(16)]
+  t = _measure(lambda: rc.fw.transceiveBatch(requests), args.min_time)
+  results['link.transceive_batch_16'] = _result(t / 16, 's/request', False)
+
+
+def benchDump(args, results, directory):
+  for size, method in _kImages:
+    rom = os.urandom(size)
+    for length in _kBlockLengths:
+      rc = _createClient(rom, method, args)
+      rc.setTemporaryFilePath(os.path.join(directory, 'tmp.a26'))
+      rc.setBlockLength(length)
+      path = os.path.join(directory, 'dump.a26')
+
+      t = _measure(lambda: rc.dumpToFile(path), args.min_time)
+      with open(path, 'rb') as f:
+        if len(f.read()) != size:
+          raise RuntimeError('Dump of ' + str(size) + ' bytes has the wrong size')
+
+      name = 'dump.{}k_scheme{}_block{}'.format(size // 1024, method, length)
+      results[name] = _result(t, 's', False)
+      results[name + '_throughput'] = _result(size / t, 'bytes/s', True)
+
+
+def benchStartup(args, results):
+  measureImport = ('import time; t = time.perf_counter(); import {}; '
+                   'print(time.perf_counter() - t)')
+  _, t = _runProcess(['-c', measureImport.format('romclient')], args.min_time)
+  results['startup.import_romclient'] = _result(t, 's', False)
+
+  if importlib.util.find_spec('PyQt5') is None:
+    print('PyQt5 is not installed, skipping the GUI start up benchmark', file=sys.stderr)
+    return
+  env = dict(os.environ, QT_QPA_PLATFORM='offscreen')
+  wall, ready = _runProcess(['romclient_gui.py', '--startup-time'], args.min_time, env)
+  results['startup.gui_ready'] = _result(ready, 's', False)
+  results['startup.gui_process'] = _result(wall, 's', False)
+
+
+def compare(baseline, current, threshold):
+  """ Print the relative change of every result.
+  :return: Names of results that regressed by more than threshold
+  :rtype: list """
+  regressions = []
+  for name in sorted(current):
+    if name not in baseline:
+      print('{:50} {:>14.6g} (new)'.format(name, current[name]['value']))
+      continue
+    old = baseline[name]['value']
+    new = current[name]['value']
+    change = (new - old) / old if old else 0.0
+    worse = -change if current[name]['higherIsBetter'] else change
+    marker = ' REGRESSION' if worse > threshold else ''
+    print('{:50} {:>14.6g} -> {:<14.6g} {:+7.1%}{}'.format(name, old, new, change, marker))
+    if marker:
+      regressions.append(name)
+  return regressions
+
+#///////////////////////////////////////////////////////////////////////////////
+# Main
+#///////////////////////////////////////////////////////////////////////////////
+def main(argv = None):
+  parser = argparse.ArgumentParser(description='Benchmark the ROM client against the firmware simulator.')
+  parser.add_argument('--output', help='Write results to this JSON file.')
+  parser.add_argument('--compare', help='Compare with an earlier JSON result file.')
+  parser.add_argument('--threshold', type=float, default=0.1,
+                      help='Relative change that counts as a regression (default 0.1).')
+  parser.add_argument('--min-time', type=float, default=0.2,
+                      help='Minimum time in seconds per measurement (default 0.2).')
+  parser.add_argument('--latency', type=float, default=0.0,
+                      help='Simulated latency per transaction in seconds (default 0).')
+  parser.add_argument('--bandwidth', type=float, default=None,
+                      help='Simulated link bandwidth in bytes/s (default unlimited).')
+  parser.add_argument('--only', choices=('codec', 'link', 'dump', 'startup'), action='append',
+                      help='Only run these benchmarks. Can be given more than once.')
+  args = parser.parse_args(argv)
+
+  only = args.only or ('codec', 'link', 'dump', 'startup')
+  results = {}
+  directory = tempfile.mkdtemp(prefix='romclient-bench-')
+  try:
+    if 'codec' in only:
+      benchCodec(args, results)
+    if 'link' in only:
+      benchLink(args, results)
+    if 'dump' in only:
+      benchDump(args, results, directory)
+    if 'startup' in only:
+      benchStartup(args, results)
+  finally:
+    shutil.rmtree(directory, ignore_errors=True)
+
+  report = {
+    'version': _kFormatVersion,
+    'python': platform.python_version(),
+    'platform': platform.platform(),
+    'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    'settings': {'latency': args.latency, 'bandwidth': args.bandwidth, 'minTime': args.min_time},
+    'results': results,
+  }
+
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump(report, f, indent=2, sort_keys=True)
+
+  if args.compare:
+    with open(args.compare) as f:
+      baseline = json.load(f)
+    if compare(baseline['results'], results, args.threshold):
+      return 1
+  elif not args.output:
+    json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    print()
+
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,125 @@
+""" Adaptive READ_BLOCK length tuning """
+
+import time
+
+from romcache import *
+
+#///////////////////////////////////////////////////////////////////////////////
+# Classes
+#///////////////////////////////////////////////////////////////////////////////
+class BlockSizeResult():
+  """ Measurement of one READ_BLOCK length
+
+  Attributes:
+    length    Block length in bytes.
+    blocks    Number of blocks requested.
+    errors    Number of blocks that failed the checksum or timed out.
+    elapsed   Time in seconds for all blocks.
+  """
+  def __init__(self, length, blocks, errors, elapsed):
+    self.length = length
+    self.blocks = blocks
+    self.errors = errors
+    self.elapsed = elapsed
+
+  def getLatency(self):
+    """ :return: Average time per block in seconds
+    :rtype: float """
+    return self.elapsed / self.blocks if self.blocks else 0.0
+
+  def getErrorRate(self):
+    return self.errors / self.blocks if self.blocks else 1.0
+
+  def getThroughput(self):
+    """ Throughput of valid data only
+    :return: Bytes per second
+    :rtype: float """
+    if self.elapsed <= 0:
+      return 0.0
+    return (self.blocks - self.errors) * self.length / self.elapsed
+
+
+class BlockSizeTuner():
+  """ Find the READ_BLOCK length with the best throughput for a reader.
+
+  Every candidate length reads the same probe range, 1A00-1DFF. It is ROM
+  in every registered bankswitching scheme: above the RAM of FA (1000-11FF)
+  and E7 (1800-19FF, and 1000-17FF once RAM is mapped into the slice), and
+  below the hotspots of all schemes (1FE0 and up). So probing never
+  switches banks or writes cartridge RAM. Lengths with too many errors are
+  rejected. Results are cached per reader and firmware.
+
+  Attributes:
+    _kProbeAddress  Start of the probe range.
+    _kProbeLength   Length of the probe range in bytes.
+    _kMaxErrorRate  Lengths with a higher error rate are never picked.
+  """
+  _kProbeAddress = 0x1A00
+  _kProbeLength = 0x400
+  _kCandidates = (64, 128, 256, 512, 1024)
+  _kMaxErrorRate = 0.05
+  _kCacheName = 'blocksize.json'
+
+  def __init__(self, fw, cache = None, debugLog = None):
+    """
+    :param fw: Firmware link to probe with.
+    :type fw: Fw_Link
+    :param cache: Cache of tuned lengths. Defaults to the blocksize cache file.
+    :type cache: JsonCache
+    """
+    self.fw = fw
+    self.cache = cache if cache is not None else JsonCache(getCachePath(self._kCacheName))
+    self.debugLog = debugLog if debugLog is not None else (lambda message: None)
+    self.results = []
+
+  def getCachedLength(self, key):
+    """ :return: Cached block length or None
+    :rtype: int """
+    return self.cache.get(key)
+
+  def tune(self, key = None, candidates = None, maxLength = None):
+    """ Measure all candidate lengths and pick the best one.
+    :param key: Cache key, e.g. reader and firmware version. None to not cache the result.
+    :param candidates: Block lengths to try.
+    :param maxLength: Largest length the firmware supports. Longer candidates are skipped.
+    :return: Best block length or None if every candidate failed
+    :rtype: int """
+    if candidates is None:
+      candidates = self._kCandidates
+    if maxLength is not None:
+      candidates = [length for length in candidates if length <= maxLength] or [maxLength]
+
+    self.results = [self.measure(length) for length in candidates]
+    usable = [r for r in self.results if r.getErrorRate() <= self._kMaxErrorRate]
+    if not usable:
+      return None
+
+    best = max(usable, key=lambda r: r.getThroughput())
+    if key is not None:
+      self.cache.set(key, best.length)
+    return best.length
+
+  def measure(self, length):
+    """ Read the probe range with blocks of one length.
+    :rtype: BlockSizeResult """
+    length = max(1, min(length, self._kProbeLength))
+    blocks = self._kProbeLength // length
+    errors = 0
+
+    start = time.perf_counter()
+    try:
+      replies = self.fw.readBlocks(self._kProbeAddress, length, blocks)
+      errors = sum(1 for r in replies if r is None)
+    except IOError as e:
+      # A timeout leaves replies in flight, resynchronize before the next candidate
+      self.debugLog('Block length ' + str(length) + ' failed: ' + str(e))
+      errors = blocks
+      self.fw.sync()
+      self.fw.flushInput()
+    elapsed = time.perf_counter() - start
+
+    result = BlockSizeResult(length, blocks, errors, elapsed)
+    self.debugLog('Block length ' + str(length) + ': ' +
+                  str(int(result.getThroughput())) + ' bytes/s, ' +
+                  str(errors) + ' errors')
+    return result
@@ -0,0 +1,128 @@
+""" Calibration of the firmware read delay """
+
+from romcache import *
+from romjournal import fingerprint
+
+#///////////////////////////////////////////////////////////////////////////////
+# Classes
+#///////////////////////////////////////////////////////////////////////////////
+class ReadDelayTuner():
+  """ Find the smallest read delay at which a cartridge reads reliably.
+
+  The probe range is read at the largest delay as reference. A binary
+  search then looks for the smallest delay at which every one of repeated
+  reads of the probe range equals the reference. The probe range is the
+  one of BlockSizeTuner, so probing never switches banks. Results are
+  cached per reader and cartridge, which is recognized by a fingerprint of
+  the probe range read at the largest delay.
+
+  Attributes:
+    _kProbeAddress  Start of the probe range.
+    _kProbeLength   Length of the probe range in bytes.
+    _kReads         Number of reads that must match the reference.
+    _kMaxDelay      Largest delay that is tried.
+  """
+  _kProbeAddress = 0x1A00
+  _kProbeLength = 0x400
+  _kBlockLength = 256
+  _kReads = 4
+  _kMaxDelay = 64
+  _kCacheName = 'readdelay.json'
+
+  def __init__(self, fw, cache = None, debugLog = None):
+    """
+    :param fw: Firmware link to probe with.
+    :type fw: Fw_Link
+    :param cache: Cache of calibrated delays. Defaults to the read delay cache file.
+    :type cache: JsonCache
+    """
+    self.fw = fw
+    self.cache = cache if cache is not None else JsonCache(getCachePath(self._kCacheName))
+    self.debugLog = debugLog if debugLog is not None else (lambda message: None)
+
+  def getCachedDelay(self, key):
+    """ :return: Cached read delay or None
+    :rtype: int """
+    return self.cache.get(key)
+
+  def readFingerprint(self, maxDelay = None):
+    """ Select the largest delay and fingerprint the probe range, to tell
+    cartridges apart in the cache. Reads at the largest delay are stable
+    even on slow ROMs, so the fingerprint does not depend on the delay
+    that was selected before.
+    :param maxDelay: Largest delay to try.
+    :return: Fingerprint or None if the probe range failed the checksum
+    :rtype: str """
+    self._select(maxDelay if maxDelay is not None else self._kMaxDelay)
+    data = self.read()
+    return fingerprint(data) if data is not None else None
+
+  def tune(self, key = None, maxDelay = None):
+    """ Search the smallest stable read delay and select it in the firmware.
+    :param key: Cache key, e.g. reader and cartridge fingerprint. None to not cache the result.
+    :param maxDelay: Largest delay to try.
+    :return: Read delay or None if the cartridge does not even read stable
+      at maxDelay. The delay of the firmware is restored then.
+    :rtype: int """
+    if maxDelay is None:
+      maxDelay = self._kMaxDelay
+    original = self.fw.getReadDelay()
+
+    self._select(maxDelay)
+    reference = self.read()
+    if reference is None or not self.isStable(maxDelay, reference):
+      self.debugLog('Reads are not stable at read delay ' + str(maxDelay))
+      if original is not None:
+        self._select(original)
+      return None
+
+    low = 0
+    high = maxDelay
+    while low < high:
+      delay = (low + high) // 2
+      if self.isStable(delay, reference):
+        high = delay
+      else:
+        low = delay + 1
+
+    self._select(high)
+    if key is not None:
+      self.cache.set(key, high)
+    return high
+
+  def isStable(self, delay, reference):
+    """ Read the probe range repeatedly at a delay
+    :return: True if every read equals the reference
+    :rtype: bool """
+    self._select(delay)
+    for _ in range(self._kReads):
+      try:
+        if self.read() != reference:
+          self.debugLog('Read delay ' + str(delay) + ': unstable')
+          return False
+      except IOError as e:
+        # A timeout leaves replies in flight, resynchronize before the next delay
+        self.debugLog('Read delay ' + str(delay) + ' failed: ' + str(e))
+        self.fw.sync()
+        self.fw.flushInput()
+        return False
+    self.debugLog('Read delay ' + str(delay) + ': stable')
+    return True
+
+  def read(self):
+    """ Read the probe range
+    :return: Data or None if a block failed the checksum
+    :rtype: bytearray """
+    data = bytearray(self._kProbeLength)
+    def store(reply):
+      start = reply.address - self._kProbeAddress
+      data[start:start + len(reply.getData())] = reply.getData()
+    replies = self.fw.readBlocks(self._kProbeAddress, self._kBlockLength,
+                                 self._kProbeLength // self._kBlockLength, callback=store)
+    if None in replies:
+      return None
+    return data
+
+  def _select(self, delay):
+    if not self.fw.setReadDelay(delay):
+      raise IOError('Read delay ' + str(delay) + ' was not acknowledged')
@@ -0,0 +1,90 @@
+""" Qt worker that runs ROM dumps outside of the GUI thread """
+
+import time
+from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot
+
+#//////////////////////////////////////////////////////////////////////////////
+# Classes
+#//////////////////////////////////////////////////////////////////////////////
+class DumpWorker(QObject):
+  """ Drives a RomClient from a QThread.
+
+  Move the worker to a QThread and emit dumpRequested (or call dump through a
+  queued connection) to start a dump. Progress signals are coalesced so the
+  GUI thread receives at most one update per progress interval. Opening a
+  port talks to the reader, so it is also done in the worker thread, emit
+  portRequested to select one.
+
+  Signals:
+    portRequested  Port to open and its Fw_Info, or None to ask the reader.
+    started     A dump has begun.
+    progress    bytesDone, bytesTotal, throughput in bytes per second.
+    finished    True if the ROM was dumped succesfully.
+    logMessage  Message for the log window.
+    debugMessage Message for the debug log.
+  """
+  portRequested = pyqtSignal(object, object)
+  started = pyqtSignal()
+  progress = pyqtSignal(int, int, float)
+  finished = pyqtSignal(bool)
+  logMessage = pyqtSignal(str)
+  debugMessage = pyqtSignal(str)
+
+  _kProgressInterval = 0.1 # s
+
+  def __init__(self, parent = None):
+    QObject.__init__(self, parent)
+    self.rc = None
+    self._lastProgress = 0.0
+    self._startTime = 0.0
+    self.portRequested.connect(self.selectPort)
+
+  def setRomClient(self, rc):
+    """ Set the RomClient to drive. Its callbacks must not touch widgets,
+    use log and debugLog of this worker instead. """
+    self.rc = rc
+    rc.setProgressCallback(self._progress)
+
+  def log(self, message):
+    """ Thread safe log callback for RomClient """
+    self.logMessage.emit(message)
+
+  def debugLog(self, message):
+    """ Thread safe debug log callback for RomClient """
+    self.debugMessage.emit(message)
+
+  @pyqtSlot(object, object)
+  def selectPort(self, port, info):
+    """ Open the port of a reader. Runs in the thread the worker lives in.
+    :param info: Fw_Info from discovery, or None to ask the reader. """
+    if self.rc is not None and not self.rc.isBusy():
+      self.rc.setSerialPort(port, info)
+
+  @pyqtSlot()
+  def dump(self):
+    """ Run one ROM dump. Runs in the thread the worker lives in. """
+    if self.rc is None or self.rc.isBusy():
+      return
+
+    self._startTime = time.perf_counter()
+    self._lastProgress = 0.0
+    self.started.emit()
+
+    success = False
+    try:
+      success = self.rc.runDump()
+    except IOError as e:
+      self.log('ROM dump failed: ' + str(e))
+      self.rc.abortDump()
+
+    self.finished.emit(success)
+
+  def _progress(self, bytesDone, bytesTotal):
+    now = time.perf_counter()
+    if bytesDone < bytesTotal and now - self._lastProgress < self._kProgressInterval:
+      return
+
+    self._lastProgress = now
+    elapsed = now - self._startTime
+    throughput = bytesDone / elapsed if elapsed > 0 else 0.0
+    self.progress.emit(bytesDone, bytesTotal, throughput)
@@ -0,0 +1,160 @@
+""" Reader auto-discovery
+
+Every candidate serial port is probed at the same time with SYNC and
+GET_INFO under a short read timeout. Only a reader answers GET_INFO with a
+valid packet. Positive results are cached on disk by the USB VID, PID and
+serial number of the port, so a known reader is recognized again without
+probing, also after it was plugged into another port. The cached info
+includes the capabilities the firmware reported, see Fw_Info.
+"""
+
+import concurrent.futures
+
+from fwlink import *
+from romcache import *
+
+#///////////////////////////////////////////////////////////////////////////////
+# Classes
+#///////////////////////////////////////////////////////////////////////////////
+class ReaderInfo():
+  """ Cartridge reader found on a serial port
+
+  Attributes:
+    port    Serial port, e.g. /dev/ttyACM0.
+    usbKey  'VID:PID:serial' of the USB device, or None for other ports.
+    info    Firmware and hardware info.
+    cached  True if the reader was recognized from the cache without probing.
+  """
+  def __init__(self, port, usbKey, info, cached = False):
+    self.port = port
+    self.usbKey = usbKey
+    self.info = info
+    self.cached = cached
+
+  def toDict(self):
+    return {'port': self.port, 'usbKey': self.usbKey, 'info': self.info.toDict(), 'cached': self.cached}
+
+
+class ReaderDiscovery():
+  """ Find cartridge readers among the serial ports
+
+  Attributes:
+    _kProbeTimeout  Read timeout in seconds while probing a port.
+  """
+  _kProbeTimeout = 0.2 # s
+  _kCacheName = 'readers.json'
+
+  def __init__(self, cache = None, timeout = None, debugLog = None):
+    """
+    :type cache: JsonCache
+    :param timeout: Read timeout per probe in seconds.
+    """
+    self.cache = cache if cache is not None else JsonCache(getCachePath(self._kCacheName))
+    self.timeout = timeout if timeout is not None else self._kProbeTimeout
+    self.debugLog = debugLog or (lambda message: None)
+
+  def discover(self, ports = None, force = False):
+    """ Find all readers
+    :param ports: Ports to consider. By default every serial port of the system.
+    :param force: Probe cached readers again.
+    :return: Readers in port order
+    :rtype: list """
+    candidates = self._listPorts(ports)
+    readers = []
+    toProbe = []
+    for port, usbKey in candidates:
+      values = self.cache.get(usbKey) if usbKey and not force else None
+      if values is not None:
+        readers.append(ReaderInfo(port, usbKey, Fw_Info(values), cached=True))
+      else:
+        toProbe.append((port, usbKey))
+
+    if toProbe:
+      with concurrent.futures.ThreadPoolExecutor(max_workers=len(toProbe)) as executor:
+        infos = list(executor.map(lambda candidate: self.probe(candidate[0]), toProbe))
+      for (port, usbKey), info in zip(toProbe, infos):
+        if info is None:
+          continue
+        readers.append(ReaderInfo(port, usbKey, info))
+        if usbKey:
+          self.cache.set(usbKey, info.toDict(), save=False)
+      self.cache.save()
+
+    readers.sort(key=lambda reader: reader.port)
+    for reader in readers:
+      self.debugLog('Reader on ' + reader.port + ': ' + str(reader.info))
+    return readers
+
+  def findReader(self, ports = None):
+    """ :return: The first reader or None
+    :rtype: ReaderInfo """
+    readers = self.discover(ports)
+    return readers[0] if readers else None
+
+  def identify(self, link, force = False):
+    """ Get the info of the reader on an open link. A cached reader is
+    recognized without asking it. Firmware that does not answer GET_INFO
+    gets an empty Fw_Info, which is not cached.
+    :type link: Fw_Link
+    :param force: Ask the reader even if it is cached, e.g. after a firmware update.
+    :return: Reader or None if nothing answers on the link
+    :rtype: ReaderInfo """
+    port, usbKey = self._listPorts([link.port])[0]
+    values = self.cache.get(usbKey) if usbKey and not force else None
+    if values is not None:
+      return ReaderInfo(port, usbKey, Fw_Info(values), cached=True)
+
+    if not link.sync(self.timeout):
+      return None
+    try:
+      info = link.getInfo()
+    except (IOError, OSError) as e:
+      self.debugLog('No GET_INFO reply on ' + str(port) + ': ' + str(e))
+      link.flushInput()
+      return ReaderInfo(port, usbKey, Fw_Info())
+
+    if info is None:
+      return ReaderInfo(port, usbKey, Fw_Info())
+    if usbKey:
+      self.cache.set(usbKey, info.toDict())
+    return ReaderInfo(port, usbKey, info)
+
+  def getUsbKey(self, port):
+    """ :return: 'VID:PID:serial' of the USB device behind a port, or None
+    :rtype: str """
+    return self._listPorts([port])[0][1]
+
+  def forget(self, usbKey):
+    """ Remove a reader from the cache, e.g. after it failed to answer """
+    self.cache.remove(usbKey)
+
+  def probe(self, port):
+    """ Check for a reader on a port
+    :return: Info of the reader or None
+    :rtype: Fw_Info """
+    link = Fw_Link()
+    if not link.open(port, self.timeout):
+      return None
+    try:
+      if not link.sync(self.timeout):
+        return None
+      return link.getInfo()
+    except (IOError, OSError) as e:
+      self.debugLog('No reader on ' + port + ': ' + str(e))
+      return None
+    finally:
+      link.close()
+
+  def _listPorts(self, ports):
+    """ :return: (port, usbKey) of every candidate port
+    :rtype: list """
+    import serial.tools.list_ports
+    usbKeys = {}
+    for p in serial.tools.list_ports.comports():
+      if p.vid is not None:
+        usbKeys[p.device] = '{:04X}:{:04X}:{}'.format(p.vid, p.pid, p.serial_number or '')
+      else:
+        usbKeys[p.device] = None
+    if ports is None:
+      ports = sorted(usbKeys)
+    return [(port, usbKeys.get(port)) for port in ports]
@@ -0,0 +1,149 @@
+""" Receive side framing of the firmware byte stream
+
+Replies are read from the serial port with readinto() into one preallocated
+buffer. Every read takes everything that is waiting, so a burst of
+pipelined replies costs one read instead of one per packet. Data that an
+event loop has read already is appended with feed(). Frames are returned
+as memoryviews into the buffer and decoded without copying.
+
+A frame is recognized by a header with the command and reply length the
+caller expects. Bytes that do not start such a header are skipped, so a
+stray or lost byte only costs the reply it hit instead of every later one.
+A frame with a plausible header but a wrong checksum is still returned as
+a frame; decodeFwPacket rejects it, so it counts as a checksum failure of
+its request like before.
+"""
+
+from fwpacket import *
+
+#-------------------------------------------------------------------------------
+class Fw_Framer():
+  """ Splits the received byte stream into reply frames
+
+  Data is appended at the write position and frames are taken from the
+  read position of one linear buffer. When the space behind the write
+  position runs out, the bytes that were not taken yet are moved to the
+  front in place, so a frame is always contiguous and can be decoded from a
+  view. Views returned by nextFrame() are only valid until the next fill().
+
+  Attributes:
+    discarded  Number of bytes skipped while resynchronizing.
+  """
+  _kDefaultSize = 0x10000
+
+  def __init__(self, size = None):
+    self._buffer = bytearray(size or self._kDefaultSize)
+    self._view = memoryview(self._buffer)
+    self._start = 0
+    self._end = 0
+    self._missing = Fw_Packet._HEADER_LENGTH
+    self.discarded = 0
+
+  def reset(self):
+    """ Discard all buffered data """
+    self._start = 0
+    self._end = 0
+    self._missing = Fw_Packet._HEADER_LENGTH
+
+  def getLength(self):
+    """ :return: Number of buffered bytes that were not taken yet
+    :rtype: int """
+    return self._end - self._start
+
+  def getMissing(self):
+    """ :return: Number of bytes the frame at the read position still needs,
+      as far as known from the last nextFrame()
+    :rtype: int """
+    return self._missing
+
+  def fill(self, ser, minimum):
+    """ Read everything that is waiting, but at least minimum bytes unless
+    the read times out first.
+    :param ser: Serial port with readinto() and in_waiting.
+    :return: Number of bytes read
+    :rtype: int """
+    if self._start == self._end:
+      self._start = 0
+      self._end = 0
+    length = max(minimum, ser.in_waiting)
+    if self._end + minimum > len(self._buffer):
+      self._compact()
+    length = min(length, len(self._buffer) - self._end)
+    if length <= 0:
+      return 0
+
+    received = ser.readinto(self._view[self._end:self._end + length]) or 0
+    self._end += received
+    return received
+
+  def feed(self, data):
+    """ Append data that was read elsewhere, e.g. by an event loop callback.
+    Like fill() it invalidates views returned by nextFrame().
+    :return: False if the data does not fit in the buffer
+    :rtype: bool """
+    if self._start == self._end:
+      self._start = 0
+      self._end = 0
+    length = len(data)
+    if self._end + length > len(self._buffer):
+      self._compact()
+      if self._end + length > len(self._buffer):
+        return False
+    self._buffer[self._end:self._end + length] = data
+    self._end += length
+    return True
+
+  def nextFrame(self, cmd, length = None):
+    """ Take the next frame of a reply from the buffer, skipping bytes that
+    do not start a plausible header.
+    :param cmd: Command of the expected reply.
+    :param length: Payload length of the expected reply. None accepts any
+      length that fits in the buffer.
+    :return: Frame or None if it has not been received completely
+    :rtype: memoryview """
+    headerLength = Fw_Packet._HEADER_LENGTH
+    maxLength = len(self._buffer) - headerLength
+    while True:
+      start = self._buffer.find(cmd, self._start, self._end)
+      if start < 0:
+        self._skip(self._end)
+        self._missing = headerLength
+        return None
+      self._skip(start)
+
+      if self._end - start < headerLength:
+        self._missing = headerLength - (self._end - start)
+        return None
+
+      replyLength = decodeFwHeader(self._view[start:start + headerLength])[3]
+      if replyLength != length and (length is not None or replyLength > maxLength):
+        self._skip(start + 1)
+        continue
+
+      end = start + headerLength + replyLength
+      if end > self._end:
+        self._missing = end - self._end
+        return None
+
+      self._start = end
+      self._missing = headerLength
+      return self._view[start:end]
+
+  def _skip(self, position):
+    """ Drop the bytes before position """
+    self.discarded += position - self._start
+    self._start = position
+
+  def _compact(self):
+    """ Move the bytes that were not taken yet to the front of the buffer.
+    bytearray slice assignment copies with memcpy, so the data is moved in
+    parts that do not overlap their destination. """
+    length = self._end - self._start
+    step = self._start
+    if step == 0:
+      return
+    for moved in range(0, length, step):
+      part = min(step, length - moved)
+      self._buffer[moved:moved + part] = self._view[self._start + moved:self._start + moved + part]
+    self._start = 0
+    self._end = length
@@ -0,0 +1,81 @@
+""" Firmware and hardware information from GET_INFO """
+
+#-------------------------------------------------------------------------------
+class Fw_Info():
+  """ Parsed GET_INFO reply
+
+  The payload is ASCII text of key=value pairs, separated by semicolons or
+  newlines, e.g. "fw=1.2;hw=3;block=1024;depth=8;cmds=rRIndD;batch=16".
+  Firmware that replies with text without any '=' only reports its
+  firmware version. Capabilities that are not reported are None, the
+  client then uses defaults that every firmware supports.
+
+  Attributes:
+    firmware        Firmware version or None.
+    hardware        Hardware version or None.
+    maxBlockLength  Largest READ_BLOCK length in bytes (block).
+    pipelineDepth   Number of requests the firmware can queue (depth).
+    commands        Set of supported Fw_Command values (cmds, one
+                    character per command).
+    maxBatch        Number of requests that may be sent in one batch
+                    (batch). 0 means no batches.
+    values          All key/value pairs as strings, including unknown keys.
+  """
+  _kFirmwareKey = 'fw'
+  _kHardwareKey = 'hw'
+  _kBlockKey = 'block'
+  _kDepthKey = 'depth'
+  _kCommandsKey = 'cmds'
+  _kBatchKey = 'batch'
+
+  def __init__(self, values = None):
+    self.values = dict(values or {})
+    self.firmware = self.values.get(self._kFirmwareKey)
+    self.hardware = self.values.get(self._kHardwareKey)
+    self.maxBlockLength = self._getInt(self._kBlockKey, 1)
+    self.pipelineDepth = self._getInt(self._kDepthKey, 1)
+    self.maxBatch = self._getInt(self._kBatchKey, 0)
+    self.commands = None
+    if self._kCommandsKey in self.values:
+      self.commands = set(ord(c) for c in self.values[self._kCommandsKey])
+
+  @classmethod
+  def fromPayload(cls, payload):
+    """ :type payload: bytes-like
+    :rtype: Fw_Info """
+    text = bytes(payload).decode('ascii', 'replace').strip('\x00 \r\n')
+    values = {}
+    if text and '=' not in text:
+      values[cls._kFirmwareKey] = text
+    for item in text.replace('\n', ';').split(';'):
+      key, separator, value = item.partition('=')
+      if separator:
+        values[key.strip()] = value.strip()
+    return cls(values)
+
+  def supports(self, cmd):
+    """ :return: True if the firmware reports the command, or does not
+      report its commands at all like older firmware
+    :rtype: bool """
+    return self.commands is None or cmd in self.commands
+
+  def reports(self, cmd):
+    """ :return: True only if the firmware lists the command. Needed for
+      commands that older firmware ignores without a reply, like NOP.
+    :rtype: bool """
+    return self.commands is not None and cmd in self.commands
+
+  def toDict(self):
+    return dict(self.values)
+
+  def _getInt(self, key, minimum):
+    """ :return: Value of a numeric key or None if it is missing or invalid
+    :rtype: int """
+    try:
+      value = int(self.values[key])
+    except (KeyError, TypeError, ValueError):
+      return None
+    return value if value >= minimum else None
+
+  def __str__(self):
+    return 'firmware ' + str(self.firmware) + ', hardware ' + str(self.hardware)
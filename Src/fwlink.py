@@ -1,12 +1,152 @@
 import serial
+import time
+from collections import deque
 
+from fwframer import *
+from fwinfo import *
+from fwmetrics import *
 from fwpacket import *
 
+#-------------------------------------------------------------------------------
+class Fw_WindowStats():
+  """ Throughput statistics of one window of pipelined requests
+
+  Attributes:
+    depth     Number of requests that were in flight.
+    length    Number of payload bytes received in this window.
+    elapsed   Time in seconds between the first request and the last reply.
+  """
+
+  def __init__(self, depth, length, elapsed):
+    self.depth = depth
+    self.length = length
+    self.elapsed = elapsed
+
+  def getThroughput(self):
+    """ Get throughput of this window.
+    :return: Throughput in bytes per second
+    :rtype: float """
+    if self.elapsed <= 0:
+      return 0.0
+    return self.length / self.elapsed
+
+#-------------------------------------------------------------------------------
+class _BlockPipeline():
+  """ Bookkeeping for a window of READ_BLOCK requests in flight. Shared by
+  the blocking and the asyncio firmware links. """
+
+  def __init__(self, address, length, count, window, stats = None, callback = None):
+    self.length = length
+    self.count = count
+    self.window = max(1, min(window, count))
+    self.stats = stats
+    self.callback = callback
+    self.expectedLength = length + Fw_Packet._HEADER_LENGTH
+
+    self._addresses = [address + i * length for i in range(count)]
+    self._replies = {}
+    self._pending = deque()
+    self._nextRequest = 0
+    self._windowStart = time.perf_counter()
+    self._windowLength = 0
+    self._windowReplies = 0
+    self.checksumFailures = 0
+
+  def done(self):
+    return len(self._replies) == self.count
+
+  def nextRequests(self):
+    """ Requests that fit in the window. They are counted as in flight once returned.
+    :rtype: list """
+    requests = []
+    while self._nextRequest < self.count and len(self._pending) < self.window:
+      address = self._addresses[self._nextRequest]
+      requests.append(Fw_Packet(Fw_Command.READ_BLOCK, address=address, length=self.length))
+      self._pending.append(address)
+      self._nextRequest += 1
+    return requests
+
+  def receive(self, encoded_reply):
+    """ Match an encoded reply to the request it answers """
+    if len(encoded_reply) == 0:
+      raise IOError('Did not receive reply packet')
+    elif len(encoded_reply) < self.expectedLength:
+      raise IOError('Did not receive full reply packet')
+
+    reply = decodeFwPacket(encoded_reply)
+    if reply is None:
+      # The firmware answers in order, so a corrupted reply belongs to the oldest request
+      self._replies[self._pending.popleft()] = None
+      self.checksumFailures += 1
+    elif reply.address in self._pending:
+      self._pending.remove(reply.address)
+      self._replies[reply.address] = reply
+      self._windowLength += len(reply.getData())
+      # The payload is a view into the receive buffer, which the next read
+      # reuses. It is only copied when there is no callback to store it.
+      if self.callback is not None:
+        self.callback(reply)
+        reply.setData(None)
+      else:
+        reply.setData(bytes(reply.getData()))
+    else:
+      raise IOError('Unexpected reply address ' + hex(reply.address))
+
+    self._windowReplies += 1
+    if self._windowReplies == self.window or self.done():
+      now = time.perf_counter()
+      if self.stats is not None:
+        self.stats.append(Fw_WindowStats(self.window, self._windowLength, now - self._windowStart))
+      self._windowStart = now
+      self._windowLength = 0
+      self._windowReplies = 0
+
+  def getReplies(self):
+    """ :return: Reply packets in address order. None if a reply failed the
+      checksum or did not arrive.
+    :rtype: list """
+    return [self._replies.get(a) for a in self._addresses]
+
 #-------------------------------------------------------------------------------
 class Fw_Link():
-  """ Communicate with firmware through serial port """
+  """ Communicate with firmware through serial port
+
+  After an acknowledged sync() the read timeout of every transfer is derived
+  from the measured round trip time and the transfer length, limited by the
+  read timeout the port was opened with. Older firmware does not acknowledge
+  the sync, so it is only awaited once the reader reported NOP support, see
+  setAcknowledgedSync(). Until then every read waits up to the read timeout.
+
+  Attributes:
+    rtt             Round trip time in seconds measured by the last sync, or None.
+    acknowledgedSync  True if sync() waits for the reader to acknowledge.
+    _kSyncTimeout   Time in seconds to wait for the acknowledgement of a sync.
+    _kRttFactor     Multiple of the round trip time that a reply may take.
+    _kMinBandwidth  Slowest expected transfer speed in bytes per second.
+    _kTimeoutMargin Time in seconds added to every calibrated timeout.
+  """
+
+  # Readers that do not report their capabilities get one request at a time
+  _kDefaultPipelineDepth = 1
+  _kDefaultMaxBatch = 1
+  _kSyncRequest = bytes([Fw_Command.SYNC]) * 13 + b'\x00'
+  _kSyncTimeout = 0.5 # s
+  _kRttFactor = 4
+  _kMinBandwidth = 10000 # bytes/s
+  _kTimeoutMargin = 0.05 # s
 
   def __init__(self, port = None):
+    self.ser = None
+    self.port = None
+    self.rtt = None
+    self.readTimeout = None
+    self.acknowledgedSync = False
+    self._syncToken = 0
+    self._txBuffer = bytearray(Fw_Packet._HEADER_LENGTH)
+    self._framer = Fw_Framer()
+    self.metrics = Fw_Metrics()
+    self.setPipelineDepth(self._kDefaultPipelineDepth)
+    self.setMaxBatch(self._kDefaultMaxBatch)
     self.open(port, 0)
     
 
@@ -21,12 +161,16 @@ class Fw_Link():
       try:
         self.ser = serial.Serial(port)
         self.ser.timeout = readtimeout
+        self.readTimeout = readtimeout
+        self.rtt = None
+        self._framer.reset()
         # Use common baud rate (Almost 1 MB/s)
         # When using USB CDC (virtual COM port) any baud rate can be used.
         # The limit is about 1 MB/s with fast firmware
         self.ser.baudrate = 921600
         self.ser.flushInput()
         self.ser.flushOutput()
+        self.port = port
 
         retv = True  
       except serial.SerialException as e:
@@ -35,6 +179,19 @@ class Fw_Link():
     return retv
 
 
+  def attach(self, ser, readtimeout, port = None):
+    """ Use an already opened serial port, or any object with the same
+    interface such as fwsim.SimSerial.
+    :param ser: Serial port.
+    :param readtimeout: Read timeout in seconds.
+    :param port: Name of the port. Defaults to ser.port. """
+    self.ser = ser
+    self.ser.timeout = readtimeout
+    self.readTimeout = readtimeout
+    self.rtt = None
+    self._framer.reset()
+    self.port = port if port is not None else getattr(ser, 'port', None)
+
   def close(self):
     """
     Close serial port.
@@ -42,39 +199,219 @@ class Fw_Link():
     if self.ser is not None:
       self.ser.close()
 
+  def flushInput(self):
+    """ Discard received data that has not been read yet. """
+    self._framer.reset()
+    if self.ser is not None:
+      try:
+        self.ser.flushInput()
+      except serial.SerialException:
+        pass
+
   def transceive(self, request_packet):
     """ Transmit request packet
     :type firmware_command: Fw_Packet  
     :return: Reply packet
     :rtype: Fw_Packet """
 
-    encoded_request = request_packet._encode()
-    success,_ = self._write(encoded_request)
+    success,_ = self._writePacket(request_packet)
     
     reply = None
     if success:
-      expectedLength = request_packet.getReplyPacketLength()
-      success,encoded_reply = self._read(expectedLength)
-      
-      if success:
-        actualLength = len(encoded_reply)
-        if actualLength == 0:
-          raise IOError('Did not receive reply packet')
-        elif actualLength < expectedLength:
-          raise IOError('Did not receive full reply packet')
-
-        reply = decodeFwPacket(encoded_reply)
+      frame = self._receive(request_packet.cmd, request_packet.replyLength)
+      if frame is None:
+        self._raiseMissing()
+
+      reply = decodeFwPacket(frame)
+      if reply is None:
+        self.metrics.increment('checksum_failures')
+      else:
+        reply.setData(bytes(reply.getData()))
 
       return reply
 
-  def sync(self):
-    """ Synchronize communication with firmware
+  def setAcknowledgedSync(self, enabled):
+    """ Select whether sync() waits for an acknowledgement. Only enable it
+    for readers that reported NOP support with GET_INFO.
+    :type enabled: bool """
+    self.acknowledgedSync = bool(enabled)
+    if not self.acknowledgedSync:
+      self.rtt = None
+
+  def setMaxBatch(self, count):
+    """ Set the maximum number of requests that transceiveBatch sends
+    before it waits for their replies.
+    :param count: Number of requests. 1 disables batching. """
+    self.maxBatch = max(1, int(count))
+
+  def transceiveBatch(self, requests):
+    """ Transmit several requests with one write and receive all replies
+    with one read. The firmware answers in order, so the replies are split
+    by the reply lengths of the requests. Batches longer than maxBatch are
+    sent in parts.
+    :param requests: Request packets.
+    :type requests: list
+    :return: Reply packets in request order. None if a reply failed the
+      checksum or does not match its request.
+    :rtype: list """
+    replies = []
+    for first in range(0, len(requests), self.maxBatch):
+      replies += self._transceiveBatch(requests[first:first + self.maxBatch], bool(replies))
+    return replies
+
+  def _transceiveBatch(self, requests, partial):
+    """ Transmit one part of a batch
+    :param partial: True if earlier parts of the batch were received. """
+    success, errorstr = self._writePackets(requests)
+    if not success:
+      raise IOError('Could not send requests: ' + errorstr)
+
+    pending = sum(request.getReplyPacketLength() for request in requests)
+    replies = []
+    for request in requests:
+      frame = self._receive(request.cmd, request.replyLength, pending)
+      if frame is None:
+        if replies or partial:
+          raise IOError('Did not receive all reply packets')
+        self._raiseMissing()
+      pending -= len(frame)
+
+      reply = decodeFwPacket(frame)
+      if reply is None or reply.address != request.address:
+        self.metrics.increment('checksum_failures')
+        reply = None
+      else:
+        # Later reads of the batch can move the receive buffer
+        reply.setData(bytes(reply.getData()))
+      replies.append(reply)
+    return replies
+
+  def getInfo(self):
+    """ Request the firmware and hardware version with GET_INFO
+    :return: Info or None if the reply failed the checksum
+    :rtype: Fw_Info """
+    success,_ = self._writePacket(Fw_Packet(Fw_Command.GET_INFO))
+    if not success:
+      return None
+
+    reply = self._readVariableReply()
+    if reply is None:
+      return None
+    return Fw_Info.fromPayload(reply.getData())
+
+  def setReadDelay(self, delay):
+    """ Set the delay of the firmware between memory reads with SET_READ_DELAY
+    :param delay: Delay in firmware units, 0 to 0xFFFF.
+    :return: True if the firmware acknowledged the delay
     :rtype: bool """
-    SYNC = b'S' #TODO Define these in Fw_Command
-    NULL = b'\x00'
-    request = SYNC * 13 + NULL #TODO wait for acknowledgement (Also TODO firmware send ack after sync)
-    success, errorstr = self._write(request)
-    return success
+    request = Fw_Packet(Fw_Command.SET_READ_DELAY, address=delay)
+    reply = self.transceive(request)
+    return reply is not None and reply.address == delay
+
+  def getReadDelay(self):
+    """ Get the delay of the firmware between memory reads with GET_READ_DELAY
+    :return: Delay or None if the reply failed the checksum
+    :rtype: int """
+    reply = self.transceive(Fw_Packet(Fw_Command.GET_READ_DELAY))
+    return reply.address if reply is not None else None
+
+  def setPipelineDepth(self, depth):
+    """ Set the maximum number of READ_BLOCK requests in flight.
+    :param depth: Window depth. 1 disables pipelining. """
+    self.pipelineDepth = max(1, int(depth))
+
+  def readBlocks(self, address, length, count, window = None, stats = None, callback = None, partial = False):
+    """ Read consecutive blocks of memory while keeping a window of
+    READ_BLOCK requests outstanding. Replies are matched by address.
+    :param address: Address of the first block.
+    :param length: Length of each block in bytes.
+    :param count: Number of blocks to read.
+    :param window: Maximum number of requests in flight. Defaults to the pipeline depth.
+    :param stats: Optional list. A Fw_WindowStats is appended for every window.
+    :param callback: Optional function that is called with every valid reply as it arrives.
+      Its payload is a view into the receive buffer that is only valid during
+      the call, copy it to keep it.
+    :param partial: If True a timeout or short reply ends the transfer instead of
+      raising IOError, and every block without a valid reply is returned as None.
+    :return: Reply packets in address order, with their own copy of the
+      payload. With a callback the payload is not kept and the data of the
+      replies is None. None if a reply failed the checksum.
+    :rtype: list """
+    if window is None:
+      window = self.pipelineDepth
+    pipeline = _BlockPipeline(address, length, count, window, stats, callback)
+
+    try:
+      while not pipeline.done():
+        # Top up the window before waiting for the oldest reply
+        requests = pipeline.nextRequests()
+        if requests:
+          success, errorstr = self._writePackets(requests)
+          if not success:
+            raise IOError('Could not send request: ' + errorstr)
+
+        frame = self._receive(Fw_Command.READ_BLOCK, length)
+        if frame is None:
+          self._raiseMissing()
+        pipeline.receive(frame)
+    except IOError:
+      if not partial:
+        raise
+    finally:
+      self.metrics.increment('checksum_failures', pipeline.checksumFailures)
+
+    return pipeline.getReplies()
+
+  def sync(self, timeout = None):
+    """ Reset the firmware interpreter.
+    With acknowledgedSync a NOP with a new token as address follows the sync
+    sequence. Its reply acknowledges the reset and measures the round trip
+    time, anything received before it is discarded. Otherwise the sequence
+    is only sent, like older firmware expects, and reads wait up to the
+    read timeout.
+    :param timeout: Time in seconds to wait for the acknowledgement.
+    :return: False if the sequence could not be sent or was not acknowledged
+    :rtype: bool """
+    self._framer.reset()
+    success, errorstr = self._write(self._kSyncRequest)
+    if not success:
+      return False
+    if not self.acknowledgedSync:
+      return True
+
+    self._syncToken = (self._syncToken + 1) & 0xFFFF
+    request = Fw_Packet(Fw_Command.NOP, address=self._syncToken)
+    start = time.perf_counter()
+    success, errorstr = self._writePacket(request)
+    if not success:
+      return False
+
+    deadline = start + (timeout if timeout is not None else self._kSyncTimeout)
+    while True:
+      frame = self._receive(Fw_Command.NOP, 0, deadline=deadline)
+      if frame is None:
+        return False
+      reply = decodeFwPacket(frame)
+      if reply is not None and reply.address == request.address:
+        break
+
+    self.rtt = time.perf_counter() - start
+    self.metrics.observe('rtt_seconds', self.rtt)
+    return True
+
+  def _writePacket(self, packet):
+    """ Encode a packet into the reusable transmit buffer and write it.
+    :return: success, errorstr
+    :rtype: bool, str """
+    return self._writePackets((packet,))
+
+  def _writePackets(self, packets):
+    """ Encode packets back to back into the reusable transmit buffer and
+    write them with a single write and flush.
+    :return: success, errorstr
+    :rtype: bool, str """
+    length = _encodeRequests(self, packets)
+    return self._write(memoryview(self._txBuffer)[:length])
 
   def _write(self, data):
     """ Write data to the firmware.
@@ -87,8 +424,12 @@ class Fw_Link():
 
     if self.ser is not None:
       try:
+        start = time.perf_counter()
         self.ser.write(data)
         self.ser.flush()
+        self.metrics.observe('write_seconds', time.perf_counter() - start)
+        self.metrics.increment('writes')
+        self.metrics.increment('bytes_written', len(data))
         success = True
       except serial.SerialException as e:
         errorstr = e.strerror
@@ -98,19 +439,108 @@ class Fw_Link():
     return success, errorstr
 
 
-  def _read(self, len):
-    """ Read data from the firmware.
-    :param len: Data length.
-    :return: success, data Can be less bytes than requested if a timeout occured.
-    :rtype: boolean, bytes """
-    data = b''
-    success = False
+  def _readVariableReply(self):
+    """ Read a reply whose length is only known from its header
+    :return: Reply packet or None if it failed the checksum
+    :rtype: Fw_Packet """
+    frame = self._receive(Fw_Command.GET_INFO)
+    if frame is None:
+      self._raiseMissing()
 
-    if self.ser is not None:
-      try:
-        data = self.ser.read(len)
-        success = True
-      except serial.SerialException as e:
-        pass
+    reply = decodeFwPacket(frame)
+    if reply is None:
+      self.metrics.increment('checksum_failures')
+    return reply
+
+  def _receive(self, cmd, length = None, pending = None, deadline = None):
+    """ Receive the next reply frame of a command. Garbage before it is skipped.
+    :param cmd: Command of the reply.
+    :param length: Payload length of the reply, None if only the header tells.
+    :param pending: Number of bytes expected in total, including later replies
+      of a batch, so they are read in one go.
+    :param deadline: time.perf_counter() value. By default the read timeout.
+    :return: Frame as a view into the receive buffer, valid until the next
+      read, or None if it did not arrive in time
+    :rtype: memoryview """
+    if self.ser is None:
+      return None
+    if pending is None:
+      pending = Fw_Packet._HEADER_LENGTH + (length or 0)
+
+    start = time.perf_counter()
+    if deadline is None:
+      timeout = _calibratedTimeout(self, pending)
+      deadline = None if timeout is None else start + timeout
+    firstByte = self._framer.getLength() > 0
+    received = 0
+
+    try:
+      frame = self._framer.nextFrame(cmd, length)
+      while frame is None:
+        remaining = None
+        if deadline is not None:
+          remaining = deadline - time.perf_counter()
+          if remaining <= 0:
+            break
+        self.ser.timeout = remaining
+
+        if firstByte:
+          minimum = max(self._framer.getMissing(), pending - self._framer.getLength())
+        else:
+          # Wait for the first byte separately to measure the time to first byte
+          minimum = 1
+        count = self._framer.fill(self.ser, minimum)
+        if count == 0:
+          break
+        if not firstByte:
+          firstByte = True
+          self.metrics.observe('first_byte_seconds', time.perf_counter() - start)
+        received += count
+        frame = self._framer.nextFrame(cmd, length)
+    except serial.SerialException:
+      frame = None
+
+    self.metrics.observe('read_seconds', time.perf_counter() - start)
+    self.metrics.increment('transactions')
+    self.metrics.increment('bytes_read', received)
+    if self._framer.discarded:
+      self.metrics.increment('bytes_discarded', self._framer.discarded)
+      self._framer.discarded = 0
+    if frame is None:
+      self.metrics.increment('timeouts')
+    return frame
+
+  def _raiseMissing(self):
+    """ Raise the IOError of a reply that did not arrive in time """
+    if self._framer.getLength() == 0:
+      raise IOError('Did not receive reply packet')
+    raise IOError('Did not receive full reply packet')
+
+
+def _calibratedTimeout(link, length):
+  """ Read timeout of a link for a transfer of length bytes: a margin, a
+  multiple of the round trip time and the transfer time at the slowest
+  expected speed, limited by the read timeout the link was opened with.
+  Links that have not measured a round trip time use the read timeout.
+  :rtype: float """
+  if link.rtt is None:
+    return link.readTimeout
+  timeout = (Fw_Link._kTimeoutMargin + Fw_Link._kRttFactor * link.rtt +
+             length / Fw_Link._kMinBandwidth)
+  if link.readTimeout is not None:
+    timeout = min(timeout, link.readTimeout)
+  return timeout
+
+
+def _encodeRequests(link, packets):
+  """ Encode packets back to back into the transmit buffer of a link
+  :return: Encoded length in bytes
+  :rtype: int """
+  length = sum(packet.getRequestPacketLength() for packet in packets)
+  if len(link._txBuffer) < length:
+    link._txBuffer = bytearray(length)
+  offset = 0
+  for packet in packets:
+    offset += packet._encodeInto(link._txBuffer, offset)
+  return length
 
-    return success, data
@@ -0,0 +1,188 @@
+""" Transaction metrics with JSON and Prometheus textfile export """
+
+import bisect
+import json
+import os
+import tempfile
+import threading
+
+#-------------------------------------------------------------------------------
+class Fw_Histogram():
+  """ Histogram with fixed bucket bounds
+
+  Attributes:
+    bounds  Upper bounds of the buckets, ascending. Values above the last
+            bound are only counted in count and sum.
+    counts  Number of values per bucket (not cumulative).
+    count   Number of values.
+    sum     Sum of all values.
+  """
+
+  # Seconds, from 10 us to 10 s in 1-2-5 steps
+  _kDefaultBounds = tuple(m * 10.0 ** e for e in range(-5, 1) for m in (1, 2, 5)) + (10.0,)
+
+  def __init__(self, bounds = None):
+    self.bounds = tuple(bounds) if bounds is not None else self._kDefaultBounds
+    self.reset()
+
+  def reset(self):
+    self.counts = [0] * len(self.bounds)
+    self.count = 0
+    self.sum = 0.0
+    self.min = None
+    self.max = None
+
+  def observe(self, value):
+    i = bisect.bisect_left(self.bounds, value)
+    if i < len(self.counts):
+      self.counts[i] += 1
+    self.count += 1
+    self.sum += value
+    if self.min is None or value < self.min:
+      self.min = value
+    if self.max is None or value > self.max:
+      self.max = value
+
+  def getMean(self):
+    return self.sum / self.count if self.count else 0.0
+
+  def getQuantile(self, q):
+    """ Estimate a quantile from the buckets
+    :param q: Quantile between 0 and 1.
+    :return: Upper bound of the bucket that holds the quantile
+    :rtype: float """
+    if not self.count:
+      return 0.0
+    rank = q * self.count
+    seen = 0
+    for bound, n in zip(self.bounds, self.counts):
+      seen += n
+      if seen >= rank:
+        return bound
+    return self.max
+
+  def toDict(self):
+    return {
+      'count': self.count,
+      'sum': self.sum,
+      'min': self.min,
+      'max': self.max,
+      'mean': self.getMean(),
+      'p50': self.getQuantile(0.5),
+      'p99': self.getQuantile(0.99),
+      'buckets': dict(zip(('{:g}'.format(b) for b in self.bounds), self.counts)),
+    }
+
+
+class Fw_Metrics():
+  """ Counters and histograms of firmware transactions.
+
+  Histograms (seconds):
+    write_seconds             Time to write and flush a request.
+    first_byte_seconds        Time from the start of a read to the first reply byte.
+    read_seconds              Time from the start of a read until it completed.
+    dump_seconds              Duration of complete ROM dumps.
+    rtt_seconds               Round trip time measured by acknowledged syncs.
+  Counters:
+    transactions, writes, bytes_written, bytes_read, bytes_discarded,
+    retries, checksum_failures, timeouts, dumps, dump_failures
+
+  Updates and exports take the same lock, so metrics can be exported from
+  another thread while a dump is running.
+  """
+
+  _kHistograms = ('write_seconds', 'first_byte_seconds', 'read_seconds', 'dump_seconds',
+                  'rtt_seconds')
+  _kCounters = ('transactions', 'writes', 'bytes_written', 'bytes_read', 'bytes_discarded', 'retries',
+                'checksum_failures', 'timeouts', 'dumps', 'dump_failures')
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.histograms = dict((name, Fw_Histogram()) for name in self._kHistograms)
+    self.counters = dict((name, 0) for name in self._kCounters)
+
+  def observe(self, name, value):
+    with self._lock:
+      self.histograms[name].observe(value)
+
+  def increment(self, name, n = 1):
+    with self._lock:
+      self.counters[name] += n
+
+  def reset(self):
+    with self._lock:
+      for histogram in self.histograms.values():
+        histogram.reset()
+      for name in self.counters:
+        self.counters[name] = 0
+
+  def toDict(self):
+    with self._lock:
+      return {
+        'counters': dict(self.counters),
+        'histograms': dict((name, h.toDict()) for name, h in self.histograms.items()),
+      }
+
+  def toJson(self):
+    return json.dumps(self.toDict(), indent=2, sort_keys=True)
+
+  def writeJson(self, path):
+    """ Write all metrics to a JSON file """
+    _writeAtomic(path, self.toJson() + '\n')
+
+  def toPrometheus(self, labels = None, prefix = 'romclient_'):
+    """ Format metrics in the Prometheus text exposition format
+    :param labels: Dictionary of labels added to every sample, e.g. {'port': '/dev/ttyACM0'}.
+    :rtype: str """
+    labelText = _formatLabels(labels or {})
+    lines = []
+    with self._lock:
+      for name in sorted(self.counters):
+        metric = prefix + name + '_total'
+        lines.append('# TYPE ' + metric + ' counter')
+        lines.append(metric + labelText + ' ' + str(self.counters[name]))
+
+      for name in sorted(self.histograms):
+        h = self.histograms[name]
+        metric = prefix + name
+        lines.append('# TYPE ' + metric + ' histogram')
+        cumulative = 0
+        for bound, n in zip(h.bounds, h.counts):
+          cumulative += n
+          bucketLabels = dict(labels or {}, le='{:g}'.format(bound))
+          lines.append(metric + '_bucket' + _formatLabels(bucketLabels) + ' ' + str(cumulative))
+        infLabels = dict(labels or {}, le='+Inf')
+        lines.append(metric + '_bucket' + _formatLabels(infLabels) + ' ' + str(h.count))
+        lines.append(metric + '_sum' + labelText + ' ' + repr(h.sum))
+        lines.append(metric + '_count' + labelText + ' ' + str(h.count))
+    return '\n'.join(lines) + '\n'
+
+  def writePrometheus(self, path, labels = None):
+    """ Write metrics for the Prometheus node exporter textfile collector.
+    The file is replaced atomically so the collector never sees a partial file. """
+    _writeAtomic(path, self.toPrometheus(labels))
+
+
+def _formatLabels(labels):
+  if not labels:
+    return ''
+  pairs = []
+  for key in sorted(labels):
+    value = str(labels[key]).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    pairs.append(key + '="' + value + '"')
+  return '{' + ','.join(pairs) + '}'
+
+
+def _writeAtomic(path, text):
+  """ Replace a file with text through a unique temporary file, so
+  concurrent writers of the same path do not collide """
+  fd, tmpPath = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp',
+                                 dir=os.path.dirname(os.path.abspath(path)))
+  try:
+    with os.fdopen(fd, 'w') as f:
+      f.write(text)
+    os.replace(tmpPath, path)
+  except Exception:
+    if os.path.exists(tmpPath):
+      os.remove(tmpPath)
+    raise
@@ -1,5 +1,10 @@
 import struct
 
+# Header layout: cmd, status, requestLength, replyLength, address, checksum
+_HEADER_STRUCT = struct.Struct('<B B H H H H')
+_CHECKSUM_OFFSET = 8
+_CHECKSUM_MASK = 0xFFFF
+
 class Fw_Command:
   """
   Firmware command
@@ -11,8 +16,8 @@ class Fw_Command:
     READ_BLOCK	 	Read a block of memory
     WRITE_BLOCK	 	Write a block of memory TODO implement
     EMULATE_BLOCK	Emulate reading from a block of memory TODO implement
-    SET_READ_DELAY	Set the delay between reads in ms TODO implement
-    GET_READ_DELAY	Get the delay between reads in ms TODO implement
+    SET_READ_DELAY	Set the delay between reads. The delay is sent in the address field.
+    GET_READ_DELAY	Get the delay between reads. The reply carries it in the address field.
     GET_INFO	 	Get firmware/hardware version info
     SYNC	 		Synchronizes soft and firmware by resetting the interpreter. Synchronization character, not an actual command.
   """
@@ -72,6 +77,10 @@ class Fw_Packet:
     elif self.cmd == Fw_Command.READ_BLOCK:
       self.replyLength = self._length
 
+  def getRequestPacketLength(self):
+    """ Get length of the encoded request packet in bytes """
+    return self._HEADER_LENGTH + len(self.data)
+
   def getReplyPacketLength(self):
     """ Get length of request and reply 
     :return: requestLength, replyLength
@@ -92,75 +101,117 @@ class Fw_Packet:
       print('data :', ' '.join(format(x, '02x') for x in self.data))
 
 
-  def __encode(self):
-    # Two passes: First pack and calculate checksum, then pack with correct checksum
-    checksum = 0
-    for _ in range(2):
-      header = (
-        self.cmd,
-        self.status,
-        self.requestLength,
-        self.replyLength,
-        self.address,
-        checksum,
-      )
-
-      fmt = '<B B H H H H'
-      packet = header
-      if len(self.data):
-        packet += (self.data,)
-        fmt += ' p'
-
-      s = struct.Struct(fmt)
-      encoded_packet = s.pack(*packet)
-      checksum = sum(encoded_packet)
-
-    return encoded_packet, checksum
+  def _headerChecksum(self):
+    """ Sum of the header bytes without packing them """
+    return (self.cmd + self.status
+      + (self.requestLength & 0xFF) + (self.requestLength >> 8)
+      + (self.replyLength & 0xFF) + (self.replyLength >> 8)
+      + (self.address & 0xFF) + (self.address >> 8))
+
+  def _encodeInto(self, buffer, offset = 0):
+    """ Encode packet into a preallocated buffer
+    :param buffer: Writable buffer with room for getRequestPacketLength() bytes.
+    :param offset: Position in buffer to encode the packet at.
+    :return: Number of bytes written
+    :rtype: int """
+    checksum = self._headerChecksum()
+    end = offset + self._HEADER_LENGTH
+    if len(self.data):
+      checksum += sum(self.data)
+      end += len(self.data)
+      buffer[offset + self._HEADER_LENGTH:end] = self.data
+
+    _HEADER_STRUCT.pack_into(buffer, offset,
+      self.cmd,
+      self.status,
+      self.requestLength,
+      self.replyLength,
+      self.address,
+      checksum & _CHECKSUM_MASK)
+
+    return end - offset
 
   def _encode(self):
     """ Encode package
     :return: Encoded packet
-    :rtype: bytes """
-    
-    encoded_packet,_ = self.__encode()
-
+    :rtype: bytearray """
+    encoded_packet = bytearray(self.getRequestPacketLength())
+    self._encodeInto(encoded_packet)
     return encoded_packet
 
   def _getChecksum(self):
-    _, checksum = self.__encode()
-    return checksum
+    checksum = self._headerChecksum()
+    if len(self.data):
+      checksum += sum(self.data)
+    return checksum & _CHECKSUM_MASK
 
 
 def decodeFwPacket(encoded_packet):
-    """ Create packet from encoded data """
-
-    if len(encoded_packet) < Fw_Packet._HEADER_LENGTH:
-      return None #TODO length exception?
-
-    # TODO clean up code and make more readable
-    fmt = '<B B H H H H'
-    verifyChecksum = sum(encoded_packet[0:8])
-    data = bytes()
-    if len(encoded_packet) > Fw_Packet._HEADER_LENGTH:
-      data = encoded_packet[10:]
-      verifyChecksum += sum(data)
-
-    verifyChecksum &= 0x00FFFF
-    packet = struct.unpack(fmt, encoded_packet[0:10])
-
-    cmd = packet[0]
-    status = packet[1]
-    requestLength = packet[2]
-    replyLength = packet[3]
-    address = packet[4]
-    checksum = packet[5]
-
-    if verifyChecksum != checksum:
-      return None #TODO checksum exception?
-
-    p = Fw_Packet(\
-      cmd = cmd, status = status, requestLength = requestLength, \
-      replyLength = replyLength, address = address, \
-      data = data)
-    return p
-
+  """ Create packet from encoded data. The payload of the packet is a
+  memoryview into encoded_packet, so the data is not copied.
+  :param encoded_packet: Encoded packet.
+  :type encoded_packet: bytes-like
+  :return: Decoded packet or None if the packet is too short or the checksum is wrong
+  :rtype: Fw_Packet """
+  view = memoryview(encoded_packet)
+  if len(view) < Fw_Packet._HEADER_LENGTH:
+    return None #TODO length exception?
+
+  cmd, status, requestLength, replyLength, address, checksum = _HEADER_STRUCT.unpack_from(view)
+  data = view[Fw_Packet._HEADER_LENGTH:]
+
+  if (sum(view[:_CHECKSUM_OFFSET]) + sum(data)) & _CHECKSUM_MASK != checksum:
+    return None #TODO checksum exception?
+
+  p = Fw_Packet(\
+    cmd = cmd, status = status, requestLength = requestLength, \
+    replyLength = replyLength, address = address, \
+    data = data)
+  return p
+
+
+def decodeFwHeader(encoded_header):
+  """ Unpack the header fields without checking the checksum
+  :return: cmd, status, requestLength, replyLength, address, checksum
+  :rtype: tuple """
+  return _HEADER_STRUCT.unpack_from(encoded_header)
+
+
+def encodeFwPackets(packets):
+  """ Encode a list of packets into one contiguous buffer
+  :param packets: Packets to encode.
+  :type packets: list
+  :return: Encoded packets
+  :rtype: bytearray """
+  encoded_packets = bytearray(sum(p.getRequestPacketLength() for p in packets))
+  offset = 0
+  for p in packets:
+    offset += p._encodeInto(encoded_packets, offset)
+  return encoded_packets
+
+
+def decodeFwPackets(encoded_packets, lengths = None):
+  """ Decode consecutive packets from one buffer without copying payloads.
+  :param encoded_packets: Buffer with encoded packets back to back.
+  :param lengths: Optional list of payload lengths. By default the replyLength
+    field of each header is used.
+  :return: Decoded packets. None for packets that failed the checksum.
+  :rtype: list """
+  view = memoryview(encoded_packets)
+  packets = []
+  offset = 0
+  i = 0
+  while offset + Fw_Packet._HEADER_LENGTH <= len(view):
+    if lengths is not None:
+      if i == len(lengths):
+        break
+      length = lengths[i]
+    else:
+      length = _HEADER_STRUCT.unpack_from(view, offset)[3]
+    end = offset + Fw_Packet._HEADER_LENGTH + length
+    if end > len(view):
+      break
+    packets.append(decodeFwPacket(view[offset:end]))
+    offset = end
+    i += 1
+  return packets
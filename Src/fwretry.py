@@ -0,0 +1,30 @@
+""" Retry policy for firmware transactions """
+
+#-------------------------------------------------------------------------------
+class RetryPolicy():
+  """ How often and how patiently a failed block is read again
+
+  Attributes:
+    attempts    Number of retries per block after the first failure.
+    resync      Resynchronize with the firmware before every retry.
+    backoff     Delay in seconds before the first retry.
+    factor      The delay is multiplied by this factor after every retry.
+    maxBackoff  Upper bound of the delay in seconds.
+  """
+
+  def __init__(self, attempts = 3, resync = True, backoff = 0.01, factor = 2.0, maxBackoff = 0.5):
+    self.attempts = attempts
+    self.resync = resync
+    self.backoff = backoff
+    self.factor = factor
+    self.maxBackoff = maxBackoff
+
+  def delays(self):
+    """ Delay before each retry
+    :rtype: list """
+    delays = []
+    delay = self.backoff
+    for _ in range(self.attempts):
+      delays.append(min(delay, self.maxBackoff))
+      delay *= self.factor
+    return delays
@@ -0,0 +1,347 @@
+""" In-process firmware simulator
+
+Simulates a cartridge reader so transfers can be measured and tuned without
+hardware. FirmwareSimulator implements the Fw_Command protocol on top of a
+SimCartridge. SimSerial wraps it in an object that behaves like
+serial.Serial, with a model of per transaction latency, link bandwidth and
+injected corruption. PtySimulator serves the simulator on a pseudo terminal,
+so any code that opens a serial port by name can use it.
+"""
+
+import os
+import random
+import struct
+import threading
+import time
+
+from bankswitch import *
+from fwpacket import *
+
+#///////////////////////////////////////////////////////////////////////////////
+# Classes
+#///////////////////////////////////////////////////////////////////////////////
+class SimCartridge():
+  """ ROM image behind the cartridge port, including bankswitching hotspots.
+
+  The hotspots are taken from the registered bankswitching schemes. Reading
+  a hotspot returns the byte of the bank that was selected before the
+  access, then switches. Reads from cartridge RAM return _kOpenBus.
+  Images smaller than the 4K window are mirrored.
+
+  Attributes:
+    minReadDelay  Smallest firmware read delay at which the ROM answers
+                  reliably. Faster reads return flipped bits now and then,
+                  like a slow mask ROM.
+  """
+  _kOpenBus = 0xFF
+  _kWindowBase = 0x1000
+  _kWindowSize = 0x1000
+
+  def __init__(self, rom, method = BankSwitchMethod.NONE, minReadDelay = 0):
+    self.rom = bytes(rom)
+    self.minReadDelay = minReadDelay
+    self.method = method
+    self.scheme = getBankScheme(method)
+    self.reset()
+
+  def reset(self):
+    """ Power-on state: every switchable slice shows bank 0 """
+    self.banks = [0] * 4
+
+  def read(self, address):
+    """ Read one byte as the 6507 would
+    :rtype: int """
+    address = self._kWindowBase | (address & 0x0FFF)
+    scheme = self.scheme
+
+    if isinstance(scheme, SlicedScheme):
+      value = self._readSliced(scheme, address)
+    elif isinstance(scheme, FlatScheme) and scheme.hotspots:
+      value = self._readFlat(scheme, address)
+    else:
+      value = self.rom[(address - self._kWindowBase) % len(self.rom)]
+
+    return value
+
+  def _unreadable(self, scheme, address):
+    return any(first <= address < last for first, last in scheme.unreadable)
+
+  def _readFlat(self, scheme, address):
+    value = self._kOpenBus
+    if not self._unreadable(scheme, address):
+      value = self.rom[(self.banks[0] * self._kWindowSize + address - self._kWindowBase) % len(self.rom)]
+    if address in scheme.hotspots:
+      self.banks[0] = scheme.hotspots.index(address)
+    return value
+
+  def _readSliced(self, scheme, address):
+    value = self._kOpenBus
+    if address >= scheme.fixedBase:
+      if not self._unreadable(scheme, address):
+        value = self.rom[scheme.fixedBank * scheme.bankSize + address - scheme.fixedBase]
+    else:
+      sliceIndex = (address - scheme.slices[0]) // scheme.bankSize
+      bank = self.banks[sliceIndex]
+      if bank is not None:
+        value = self.rom[bank * scheme.bankSize + (address - scheme.slices[0]) % scheme.bankSize]
+
+    for (sliceIndex, bank), hotspot in scheme.hotspots.items():
+      if hotspot == address:
+        self.banks[sliceIndex] = bank
+    if address in scheme.extraHotspots and address == min(scheme.extraHotspots):
+      # E7: the first extra hotspot maps RAM into the switchable slice
+      self.banks[0] = None
+    return value
+
+
+class FirmwareSimulator():
+  """ Interpreter of the firmware protocol.
+
+  Bytes written by the host are fed in with feed(), which returns the
+  encoded replies. Packets with a bad checksum are dropped without a reply,
+  like a firmware that lost sync. A SYNC character at the start of a packet
+  starts a sync sequence that lasts until the next NUL.
+
+  Attributes:
+    commands      Commands that are answered, None for all. Older firmware
+                  ignores NOP and GET_INFO.
+    readDelay     Delay between reads set by SET_READ_DELAY.
+    unstableRate  Probability that a byte read faster than the cartridge
+                  allows has a flipped bit.
+  """
+
+  def __init__(self, cartridge, info = b'', commands = None):
+    """
+    :type cartridge: SimCartridge
+    :param info: Payload of the GET_INFO reply.
+    :param commands: Commands that are answered, None for all.
+    """
+    self.cartridge = cartridge
+    self.info = bytes(info)
+    self.commands = set(commands) if commands is not None else None
+    self.readDelay = 0
+    self.unstableRate = 0.05
+    self._random = random.Random()
+    self._buffer = bytearray()
+    self._syncing = False
+
+  def reset(self):
+    """ Reset the interpreter """
+    self._buffer = bytearray()
+    self._syncing = False
+
+  def feed(self, data):
+    """ Process bytes from the host
+    :return: Encoded replies, one per executed request
+    :rtype: list """
+    replies = []
+    for byte in bytes(data):
+      if self._syncing:
+        if byte == 0:
+          self.reset()
+        continue
+      if not self._buffer and byte == Fw_Command.SYNC:
+        self._syncing = True
+        continue
+
+      self._buffer.append(byte)
+      if len(self._buffer) < Fw_Packet._HEADER_LENGTH:
+        continue
+      requestLength = struct.unpack_from('<H', self._buffer, 2)[0]
+      if len(self._buffer) < Fw_Packet._HEADER_LENGTH + requestLength:
+        continue
+
+      request = decodeFwPacket(bytes(self._buffer))
+      self._buffer = bytearray()
+      if request is not None:
+        reply = self.execute(request)
+        if reply is not None:
+          replies.append(reply._encode())
+    return replies
+
+  def execute(self, request):
+    """ Execute one request
+    :rtype: Fw_Packet """
+    cmd = request.cmd
+    data = b''
+    if self.commands is not None and cmd not in self.commands:
+      return None
+    if cmd == Fw_Command.READ_SINGLE:
+      data = bytes([self.cartridge.read(request.address)])
+    elif cmd == Fw_Command.READ_BLOCK:
+      data = bytes(self.cartridge.read(request.address + i) for i in range(request.replyLength))
+    elif cmd == Fw_Command.GET_INFO:
+      data = self.info
+    elif cmd == Fw_Command.SET_READ_DELAY:
+      self.readDelay = request.address
+    elif cmd == Fw_Command.GET_READ_DELAY:
+      return Fw_Packet(cmd, address=self.readDelay)
+    elif cmd != Fw_Command.NOP:
+      return None
+
+    if data and self.readDelay < self.cartridge.minReadDelay:
+      data = self._unstable(data)
+
+    reply = Fw_Packet(cmd, address=request.address, data=data)
+    reply.replyLength = len(data)
+    return reply
+
+
+  def _unstable(self, data):
+    """ Flip bits like a ROM that is read too fast """
+    data = bytearray(data)
+    for i in range(len(data)):
+      if self._random.random() < self.unstableRate:
+        data[i] ^= 1 << self._random.randrange(8)
+    return bytes(data)
+
+
+class SimSerial():
+  """ Drop-in replacement for serial.Serial that talks to a FirmwareSimulator.
+
+  Replies become readable after a delay that models the link:
+    latency + len(request) / bandwidth + len(reply) / bandwidth
+  Transactions are serialized, so a reply never arrives before the
+  previous one has been transferred.
+
+  Attributes:
+    latency         Time in seconds per transaction.
+    bandwidth       Link speed in bytes per second. None for unlimited.
+    corruptionRate  Probability that one bit of a reply is flipped.
+    dropRate        Probability that a reply is lost.
+  """
+
+  def __init__(self, simulator, latency = 0.0, bandwidth = None,
+               corruptionRate = 0.0, dropRate = 0.0, seed = None, port = 'sim://'):
+    self.simulator = simulator
+    self.latency = latency
+    self.bandwidth = bandwidth
+    self.corruptionRate = corruptionRate
+    self.dropRate = dropRate
+    self.port = port
+    self.timeout = None
+    self.baudrate = 921600
+    self.is_open = True
+
+    self._random = random.Random(seed)
+    self._pending = []     # (time when readable, data)
+    self._rxBuffer = bytearray()
+    self._linkFree = 0.0
+    self._lock = threading.Lock()
+
+  def write(self, data):
+    now = time.monotonic()
+    data = bytes(data)
+    with self._lock:
+      # The request occupies the link before the firmware can answer
+      self._linkFree = max(self._linkFree, now) + self._transferTime(len(data))
+      for reply in self.simulator.feed(data):
+        self._linkFree += self.latency + self._transferTime(len(reply))
+        if self._random.random() < self.dropRate:
+          continue
+        reply = bytearray(reply)
+        if self._random.random() < self.corruptionRate:
+          bit = self._random.randrange(len(reply) * 8)
+          reply[bit // 8] ^= 1 << (bit % 8)
+        self._pending.append((self._linkFree, bytes(reply)))
+    return len(data)
+
+  def read(self, size = 1):
+    deadline = None if self.timeout is None else time.monotonic() + self.timeout
+    while True:
+      with self._lock:
+        self._collect()
+        if len(self._rxBuffer) >= size or (deadline is not None and time.monotonic() >= deadline):
+          data = bytes(self._rxBuffer[:size])
+          del self._rxBuffer[:size]
+          return data
+        wake = self._pending[0][0] if self._pending else None
+
+      now = time.monotonic()
+      limit = deadline if wake is None else (wake if deadline is None else min(wake, deadline))
+      if limit is None:
+        raise IOError('SimSerial.read would block forever')
+      time.sleep(max(0.0, limit - now))
+
+  def readinto(self, buffer):
+    data = self.read(len(buffer))
+    buffer[:len(data)] = data
+    return len(data)
+
+  @property
+  def in_waiting(self):
+    with self._lock:
+      self._collect()
+      return len(self._rxBuffer)
+
+  def flush(self):
+    pass
+
+  def flushInput(self):
+    with self._lock:
+      self._collect()
+      self._rxBuffer = bytearray()
+
+  def flushOutput(self):
+    pass
+
+  reset_input_buffer = flushInput
+  reset_output_buffer = flushOutput
+
+  def close(self):
+    self.is_open = False
+
+  def _transferTime(self, length):
+    if not self.bandwidth:
+      return 0.0
+    return length / self.bandwidth
+
+  def _collect(self):
+    """ Move replies that have arrived into the receive buffer """
+    now = time.monotonic()
+    while self._pending and self._pending[0][0] <= now:
+      self._rxBuffer.extend(self._pending.pop(0)[1])
+
+
+class PtySimulator():
+  """ Serve a SimSerial on a pseudo terminal (POSIX only).
+
+  getPort() returns the device name of the terminal, which can be passed
+  to Fw_Link.open or AsyncFwLink.open like a real reader.
+  """
+  _kPollInterval = 0.001 # s
+
+  def __init__(self, sim):
+    """ :type sim: SimSerial """
+    import pty
+    import tty
+    self.sim = sim
+    self._master, self._slave = pty.openpty()
+    tty.setraw(self._master)
+    tty.setraw(self._slave)
+    self._running = True
+    self._thread = threading.Thread(target=self._serve, daemon=True)
+    self._thread.start()
+
+  def getPort(self):
+    return os.ttyname(self._slave)
+
+  def close(self):
+    self._running = False
+    self._thread.join()
+    os.close(self._master)
+    os.close(self._slave)
+
+  def _serve(self):
+    import select
+    self.sim.timeout = 0
+    while self._running:
+      readable, _, _ = select.select([self._master], [], [], self._kPollInterval)
+      if readable:
+        try:
+          self.sim.write(os.read(self._master, 4096))
+        except OSError:
+          return
+      data = self.sim.read(1 << 16)
+      if data:
+        os.write(self._master, data)
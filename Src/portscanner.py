@@ -0,0 +1,48 @@
+""" Serial port enumeration and reader discovery outside of the GUI thread """
+
+import threading
+from PyQt5.QtCore import QObject, pyqtSignal
+
+#//////////////////////////////////////////////////////////////////////////////
+# Classes
+#//////////////////////////////////////////////////////////////////////////////
+class PortScanner(QObject):
+  """ Lists the serial ports and looks for a reader among them in a
+  background thread, so a slow enumeration never blocks the window.
+
+  The signal is emitted from the scan thread. Connected slots of objects
+  that live in the GUI thread are called through a queued connection.
+
+  Signals:
+    finished  List of port device names, port of the reader or '' if no
+              reader was found, and its Fw_Info or None.
+  """
+  finished = pyqtSignal(list, str, object)
+
+  def __init__(self, parent = None):
+    QObject.__init__(self, parent)
+    self._thread = None
+
+  def isScanning(self):
+    return self._thread is not None and self._thread.is_alive()
+
+  def scan(self):
+    """ Start a scan and return immediately
+    :return: False if a scan is already running
+    :rtype: bool """
+    if self.isScanning():
+      return False
+    self._thread = threading.Thread(target=self._scan, daemon=True)
+    self._thread.start()
+    return True
+
+  def _scan(self):
+    # Imported here, list_ports loads platform modules that are slow to import
+    import serial.tools.list_ports
+    from fwdiscovery import ReaderDiscovery
+    ports = [port.device for port in serial.tools.list_ports.comports()]
+    reader = ReaderDiscovery().findReader(ports)
+    if reader is None:
+      self.finished.emit(ports, '', None)
+    else:
+      self.finished.emit(ports, reader.port, reader.info)
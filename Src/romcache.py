@@ -0,0 +1,105 @@
+""" Small persistent caches for per reader settings """
+
+import json
+import os
+import tempfile
+import threading
+
+_kCacheDirectory = os.path.join(os.path.expanduser('~'), '.romclient')
+_kRemoved = object()
+
+# One lock per cache file, shared by every JsonCache of that file
+_pathLocks = {}
+_pathLocksLock = threading.Lock()
+
+
+def getCachePath(name):
+  """ Get the path of a cache file in the romclient cache directory.
+  The directory can be moved with the ROMCLIENT_CACHE_DIR environment variable.
+  :param name: File name.
+  :rtype: str """
+  directory = os.environ.get('ROMCLIENT_CACHE_DIR', _kCacheDirectory)
+  return os.path.join(directory, name)
+
+
+def _getPathLock(path):
+  with _pathLocksLock:
+    return _pathLocks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+class JsonCache():
+  """ Dictionary that is stored as a JSON file.
+
+  The file is read when the cache is created and written by save(). save()
+  reads the file again and only applies the keys this cache changed, so
+  several caches of one file, e.g. of pool workers, keep each other's
+  entries. Caches of the same file share a lock and every save writes its
+  own temporary file. Errors while reading or writing only cost the cached
+  values, they are never fatal.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self._lock = _getPathLock(path)
+    self._changes = {}
+    with self._lock:
+      self._values = self._load()
+
+  def get(self, key, default = None):
+    with self._lock:
+      return self._values.get(key, default)
+
+  def set(self, key, value, save = True):
+    with self._lock:
+      self._values[key] = value
+      self._changes[key] = value
+    if save:
+      self.save()
+
+  def remove(self, key, save = True):
+    with self._lock:
+      self._values.pop(key, None)
+      self._changes[key] = _kRemoved
+    if save:
+      self.save()
+
+  def save(self):
+    """ Merge the changes into the file on disk
+    :return: True if the cache was written
+    :rtype: bool """
+    with self._lock:
+      values = self._load()
+      for key, value in self._changes.items():
+        if value is _kRemoved:
+          values.pop(key, None)
+        else:
+          values[key] = value
+      self._values = values
+
+      tmpPath = None
+      try:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmpPath = tempfile.mkstemp(prefix=os.path.basename(self.path) + '.',
+                                       suffix='.tmp', dir=directory)
+        with os.fdopen(fd, 'w') as f:
+          json.dump(values, f, indent=2, sort_keys=True)
+        os.replace(tmpPath, self.path)
+        self._changes = {}
+        return True
+      except (IOError, OSError):
+        if tmpPath is not None and os.path.exists(tmpPath):
+          os.remove(tmpPath)
+        return False
+
+  def _load(self):
+    """ :return: Values in the file, empty if it cannot be read
+    :rtype: dict """
+    try:
+      with open(self.path) as f:
+        values = json.load(f)
+      if isinstance(values, dict):
+        return values
+    except (IOError, OSError, ValueError):
+      pass
+    return {}
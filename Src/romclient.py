@@ -1,6 +1,21 @@
+from bankswitch import *
+from blocktune import *
+from delaytune import *
 from fwlink import *
 from fwpacket import *
+from fwretry import *
+from romcache import getCachePath
+from romdigest import RomDigest
+from romjournal import DumpJournal, fingerprint
+from romsink import *
 from subprocess import Popen
+import argparse
+import itertools
+import json
+import os
+import re
+import sys
+import time
 
 def _print(message):
     print(message)
@@ -10,7 +25,7 @@ def _debugPrint(message):
   self.print('___debug__ ' + message)
 
 
-def _nop():
+def _nop(*args):
   """ No operation. """
   pass
 
@@ -29,29 +44,6 @@ class _State():
   INIT = 7
   DUMP_TIMEOUT = 8
 
-class BankSwitchMethod():
-  """ Bankswitching types enum
-  Special thanks to Kevin "Kevtris" Horton for these descriptions
-
-  Attributes:
-    NONE  No bankswitching.
-    F6    FF6/FF7/FF8/FF9 bankswitching
-    F8    FF8/FF9 bankswitching
-    FA    FF8/FF9/FFA bankswitching (aka CBS' RAM Plus)
-    E0    FE0-FF7 bankswitching (aka Parker Bros.)
-    E7    FE0-FE7 bankswitching found on M-Network carts
-    FE    01FE/11FE bankswitching (aka Activision Robot Tank)
-    USER  User defined bankswitching
-  """
-  NONE = 0
-  F6 = 1
-  F8 = 2
-  FA = 3
-  E0 = 4
-  E7 = 5
-  FE = 6
-  USER = 7
-
 class _Rom():
   """ Storage class with random access """
   def __init__(self):
@@ -63,13 +55,18 @@ class RomClient():
   
   Attributes:
     _kTemporaryFilePath Path to temporary ROM dump file. After dumping a ROM this file is overwritten.
-    _kMaxReadSize       Maximum no. of bytes to read from firmware at a time.
-    _kDebugDataLength   Length of ROM dump. After receiving this many bytes, automatically stop reading.
+    _kMaxReadSize       Maximum no. of bytes to read from firmware at a time. Limited by the 16-bit length field.
+    _kMirrorProbes      No. of sample blocks compared per candidate ROM size when detecting mirrors.
+    _kBlockLength       Default length of a READ_BLOCK transfer in bytes, for readers that do not report their maximum.
+    _kFingerprintLength No. of bytes of the first block that identify a cartridge in the journal.
   """
 
   _kTemporaryFilePath = '.tmp.a26'
-  _kMaxReadSize = 9999
-  _kDebugDataLength = 4096
+  _kMaxReadSize = 0xFFFF
+  _kMirrorProbes = 4
+  _kBlockLength = 256
+  _kFingerprintLength = 256
+  _kCartridgeIdAddress = 0x1000
 
 
   def __init__(self, 
@@ -90,16 +87,40 @@ class RomClient():
     # Set up firmware link
     self.setSerialReadTimeout(1)
     self.fw = Fw_Link()
-    self.setSerialPort(port)
+    self.readerInfo = Fw_Info()
+    self.readerUsbKey = None
     self.setBankSwitchMethod(BankSwitchMethod.NONE)
+    self.detectedBankSwitchMethod = None
+    self.setBlockLength(None)
+    self.setBlockLengthAuto(False)
+    self.setPipelineDepth(None)
+    self.setReadDelay(None)
+    self.setReadDelayAuto(False)
+    self.setSizeDetectionEnabled(True)
+    self.setRetryPolicy(RetryPolicy())
+    self.setJournalEnabled(False)
+    self._journal = None
+
+    # Hashing and identification
+    self.digest = None
+    self.romEntry = None
+    self.setRomDatabase(None)
 
-    # Timeout ticks
-    self.setTimeoutTicks(10)
+    # Progress reporting
+    self.setProgressCallback(_nop)
 
     # Set up state machine
     self.dataValid = False
+    self.dataLength = 0
     self.state = _State.INIT
     
+    # Temporary dump file and streaming output
+    self.lastRomFileName = None
+    self._sink = None
+    self._sinkPath = None
+    self._verifying = False
+    self.setTemporaryFilePath(self._kTemporaryFilePath)
+
     # Auto launching emulator settings
     self.setLaunchEmulatorEnabled(False)
     self.setEmulatorPath('stella')
@@ -107,6 +128,9 @@ class RomClient():
     # Set up ROM data
     self._clearRom()
 
+    # Connect last, the capabilities of the reader adjust the settings above
+    self.setSerialPort(port)
+
 #///////////////////////////////////////////////////////////////////////////////
 # Public Methods
 #///////////////////////////////////////////////////////////////////////////////
@@ -127,20 +151,158 @@ class RomClient():
     return started
 
 
-  def dumpToFile(self, name):
-    if self.startDump():
-      self.log('Start ROM dump to file.')
-      while not self.dataValid:
-        abort = self.update()
-        if abort:
-          return
+  def runDump(self):
+    """
+    Run a complete ROM dump in the calling thread.
+    :return: True if the ROM was dumped succesfully
+    :rtype: bool
+    """
+    if self.state == _State.INIT:
+      self.update()
+
+    if not self.startDump():
+      return False
+
+    while self.isBusy():
+      if self.update():
+        return False
+
+    return self.dataValid
+
+  def runVerifiedDump(self, maxPasses = 3):
+    """
+    Dump the ROM several times and resolve differences between the passes.
+    Stops as soon as two passes are identical. Later passes only read the
+    ranges where earlier passes differ. Requires NumPy.
+    :param maxPasses: Maximum number of passes.
+    :return: Verification result or None if the first pass failed
+    :rtype: VerifyResult
+    """
+    from romverify import DumpVerifier
+
+    # Nothing is saved before the last pass, see _dumpDone
+    self._verifying = True
+    try:
+      if not self.runDump():
+        return None
+
+      # Later passes overwrite parts of the image, keep them out of a streamed file
+      self.romData = bytearray(self.romData)
+
+      verifier = DumpVerifier(maxPasses)
+      verifier.addPass(self.romData)
+
+      try:
+        while not verifier.done():
+          self.log('Verifying, pass ' + str(verifier.getPassCount() + 1))
+          self.fw.sync()
+          # The second pass reads everything again, into the image of the
+          # first pass, so the digest and the prefix checks are not started over
+          mask = verifier.getUnstableMask()
+          if mask is None:
+            mask = bytearray(b'\x01') * len(self.romData)
+          else:
+            mask = bytearray(mask.tobytes())
+          self._executePlan(self.plan, mask)
+          verifier.addPass(self.romData)
+      except IOError as e:
+        self.log(str(e))
+        self.log('Verification failed.')
+        self.dataValid = False
+        self._abortSink()
+        return None
+    finally:
+      self._verifying = False
+
+    result = verifier.getResult()
+    self.romData[:] = result.image
+    self.digest = RomDigest.fromData(self.romData)
+    self._identify()
+    if result.isStable():
+      self.log('Verified after ' + str(result.passes) + ' passes.')
     else:
-      self.log('Could not start ROM dump.')
+      self.log(str(len(result.getUnstableOffsets())) + ' unstable bytes resolved by majority vote.')
+
+    if self._sink is not None:
+      self._sink.data[:] = result.image
+      self._commitSink()
+    else:
+      self.saveDump(self.temporaryFilePath)
+
+    if self.launchEmulatorEnabled:
+      self.launchEmulator()
+    return result
+
+  def abortDump(self):
+    """
+    Abort the ROM dump in progress.
+    """
+    if self.isBusy():
+      self.state = _State.DUMP_ABORT
+      self.update()
+
+  def isBusy(self):
+    """
+    :return: True while a ROM dump is in progress
+    :rtype: bool
+    """
+    return self.state not in (_State.READY, _State.INIT)
+
+  def readCartridgeId(self):
+    """
+    Read a short fingerprint of the cartridge in the slot, without
+    switching banks. Used to notice cartridge swaps.
+    :return: Fingerprint, '' if the slot looks empty or None if the reader did not answer
+    :rtype: str
+    """
+    request = Fw_Packet(Fw_Command.READ_BLOCK, address=self._kCartridgeIdAddress,
+                        length=self._kFingerprintLength)
+    reply = self._tryRead(lambda: self.fw.transceive(request))
+    if reply is None:
+      return None
+    data = bytes(reply.getData())
+    # An empty slot reads the same open bus value everywhere
+    if len(set(data)) <= 1:
+      return ''
+    return fingerprint(data)
+
+  def setProgressCallback(self, progress):
+    """
+    Set the function that is called after every completed read step.
+    :param progress: Called as progress(bytesDone, bytesTotal).
+    """
+    self.progress = progress
+
+  def dumpToFile(self, name):
+    """
+    Dump the ROM straight into a file. Blocks are written into the file as
+    they arrive, see setOutputFile.
+    :return: True if the ROM was dumped and saved
+    :rtype: bool
+    """
+    self.log('Start ROM dump to file.')
+    self.setOutputFile(name)
+    if not self.runDump():
+      self.log('Could not dump ROM.')
+      return False
 
-    self.saveDump(name)
     if self.launchEmulatorEnabled:
       self.launchEmulator()
+    return self.getLastFileName() == name
+
+  def setOutputFile(self, path):
+    """
+    Stream the next dump into a file instead of keeping it in memory.
+    The file is preallocated and memory mapped, and only replaces path once
+    the dump is complete. No temporary dump is written for this dump.
+    :param path: Target file or None to dump to memory.
+    """
+    self._sinkPath = path
   
+  def setTemporaryFilePath(self, path):
+    """ Set the file that every succesful dump is written to. """
+    self.temporaryFilePath = path
+
   def setLaunchEmulatorEnabled(self, state):
     self.launchEmulatorEnabled = state
     self.debugLog('launchEmulatorEnabled = ' + str(self.launchEmulatorEnabled))
@@ -161,25 +323,240 @@ class RomClient():
 
 
   def setBankSwitchMethod(self, method = None):
+    """ :param method: BankSwitchMethod value. AUTO detects the method at
+      the start of every dump, which needs NumPy. Without NumPy the ROM is
+      dumped as NONE. """
     self.bankSwitchMethod = method
+
+  def detectBankSwitchMethod(self):
+    """
+    Detect the bankswitching method of the cartridge. Requires NumPy.
+    :rtype: int
+    """
+    from bankdetect import BankSwitchDetector
+
+    detector = BankSwitchDetector(self._readBlock,
+                                  lambda address: self._readHotspot(HotspotAccess(address)),
+                                  self.debugLog, self._sampleBanks)
+    method = detector.detect()
+    self.log('Detected bankswitching method ' + getBankSwitchMethodName(method) + '.')
+    return method
+
+  def getDetectedBankSwitchMethod(self):
+    """
+    :return: Bankswitching method the last dump was read with
+    :rtype: int
+    """
+    return self.detectedBankSwitchMethod
   
   def setSerialReadTimeout(self, timeout):
     self.serialReadTimeOut = timeout
 
-  def setSerialPort(self, port):
+  def setPipelineDepth(self, depth):
+    """ Set the number of READ_BLOCK requests kept in flight during a dump.
+    Limited to the depth the reader reports.
+    :param depth: Depth, or None for the depth the reader reports. """
+    self._pipelineDepth = depth
+    limit = self.readerInfo.pipelineDepth
+    if depth is None:
+      depth = limit or Fw_Link._kDefaultPipelineDepth
+    elif limit is not None:
+      depth = min(depth, limit)
+    self.fw.setPipelineDepth(depth)
+
+  def setSerialPort(self, port, info = None):
+    """
+    Open the serial port of a reader and select the fastest transfer
+    strategy it supports.
+    :param info: Info of the reader if it is known already. By default the
+      reader is asked, see negotiate.
+    :type info: Fw_Info
+    :return: True if the port was opened
+    :rtype: bool
+    """
     retv = False
 
     if port:
       if self.fw.open(port, self.serialReadTimeOut):
         self.log('Opened serial port ' + port)
+        if info is not None:
+          from fwdiscovery import ReaderDiscovery
+          self.readerUsbKey = ReaderDiscovery().getUsbKey(port)
+          self._selectTransfer(info)
+        else:
+          self.negotiate()
         retv = True
       else:
         self.log('Could not open serial port ' + port)
 
     return retv
 
-  def setTimeoutTicks(self, ticks):
-    self.timeoutTicks = ticks
+  def negotiate(self, force = False):
+    """
+    Ask the reader for its firmware version and capabilities with GET_INFO
+    and select the fastest transfer strategy it supports. Readers that do
+    not report capabilities get the defaults that every firmware supports.
+    The info is cached by the USB serial number of the reader.
+    :param force: Ask the reader even if it is cached, e.g. after a firmware update.
+    :return: Reader info
+    :rtype: Fw_Info
+    """
+    from fwdiscovery import ReaderDiscovery
+
+    reader = ReaderDiscovery(debugLog=self.debugLog).identify(self.fw, force)
+    info = reader.info if reader is not None else Fw_Info()
+    self.readerUsbKey = reader.usbKey if reader is not None else None
+    self._selectTransfer(info)
+    return info
+
+  def getReaderInfo(self):
+    """
+    :return: Info of the reader that was negotiated on connect
+    :rtype: Fw_Info
+    """
+    return self.readerInfo
+
+  def selectReader(self, ports = None):
+    """
+    Find a reader among the serial ports and open it.
+    :param ports: Ports to consider. By default every serial port of the system.
+    :return: The reader or None if no reader was found
+    :rtype: ReaderInfo
+    """
+    from fwdiscovery import ReaderDiscovery
+
+    reader = ReaderDiscovery(debugLog=self.debugLog).findReader(ports)
+    if reader is None:
+      self.log('No reader found.')
+    else:
+      self.log('Found reader on ' + reader.port + ', ' + str(reader.info) + '.')
+      if not self.setSerialPort(reader.port, reader.info):
+        reader = None
+    return reader
+
+  def setRetryPolicy(self, policy):
+    """ Set how failed blocks are read again.
+    :type policy: RetryPolicy """
+    self.retryPolicy = policy
+
+  def setRomDatabase(self, database):
+    """ Identify dumps with a database of known ROMs. While dumping, a
+    warning is logged as soon as the image differs from every known ROM.
+    :type database: RomDatabase """
+    self.romDatabase = database
+
+  def getDigest(self):
+    """
+    CRC32, MD5 and SHA-1 of the last dump, computed while it was read.
+    :rtype: RomDigest
+    """
+    return self.digest
+
+  def getRomEntry(self):
+    """
+    :return: The known ROM that matches the last dump or None
+    :rtype: RomEntry
+    """
+    return self.romEntry
+
+  def setJournalEnabled(self, enabled):
+    """ Keep a journal of the completed parts of a dump. If a dump fails, the
+    next dump of the same cartridge on the same reader only reads what is
+    missing. The journal is deleted once a dump is complete. """
+    self.journalEnabled = enabled
+
+  def setSizeDetectionEnabled(self, enabled):
+    """ Detect ROMs that are smaller than the cartridge window before
+    dumping. Only the unique part is read and saved, e.g. 2K instead of a
+    4K image that holds the same 2K twice. """
+    self.sizeDetectionEnabled = enabled
+
+  def setBlockLength(self, length):
+    """ Set the READ_BLOCK transfer length in bytes. Limited to the largest
+    length the reader reports.
+    :param length: Length, or None for the largest length the reader reports. """
+    self._blockLength = length
+    limit = min(self.readerInfo.maxBlockLength or self._kMaxReadSize, self._kMaxReadSize)
+    if length is None:
+      length = limit if self.readerInfo.maxBlockLength else self._kBlockLength
+    self.blockLength = max(1, min(int(length), limit))
+
+  def setBlockLengthAuto(self, enabled):
+    """ Pick the READ_BLOCK length automatically at the start of a dump.
+    Measured lengths are cached per reader, so only the first dump is slower. """
+    self.blockLengthAuto = enabled
+
+  def tuneBlockLength(self, force = False):
+    """
+    Select the READ_BLOCK length with the best throughput for the attached reader.
+    :param force: Measure again even if a length is cached.
+    :return: Selected block length
+    :rtype: int
+    """
+    tuner = BlockSizeTuner(self.fw, debugLog=self.debugLog)
+    key = self._readerKey()
+    length = None if force else tuner.getCachedLength(key)
+
+    if length is None:
+      self.log('Measuring the best block length.')
+      length = tuner.tune(key, maxLength=self.readerInfo.maxBlockLength)
+
+    if length is not None:
+      self.setBlockLength(length)
+    self.debugLog('Block length ' + str(self.blockLength))
+    return self.blockLength
+
+  def setReadDelay(self, delay):
+    """ Set the delay of the firmware between memory reads, selected at the
+    start of every dump.
+    :param delay: Delay in firmware units, or None to keep the firmware default. """
+    self.readDelay = delay
+
+  def setReadDelayAuto(self, enabled):
+    """ Calibrate the read delay at the start of a dump. Calibrated delays
+    are cached per reader and cartridge. """
+    self.readDelayAuto = enabled
+
+  def calibrateReadDelay(self, force = False):
+    """
+    Select the smallest read delay at which the cartridge reads reliably.
+    :param force: Calibrate again even if a delay is cached.
+    :return: Selected read delay or None if the reader does not support read delays
+    :rtype: int
+    """
+    if not (self.readerInfo.supports(Fw_Command.SET_READ_DELAY) and
+            self.readerInfo.supports(Fw_Command.GET_READ_DELAY)):
+      self.log('The reader does not support read delays.')
+      return None
+
+    tuner = ReadDelayTuner(self.fw, debugLog=self.debugLog)
+
+    try:
+      # A delay is only reused for the same cartridge, slower ROMs of the
+      # same bankswitching method may need a larger one
+      cartridge = tuner.readFingerprint()
+      key = None
+      delay = None
+      if cartridge is not None:
+        key = self._readerKey() + '/' + cartridge
+        if not force:
+          delay = tuner.getCachedDelay(key)
+
+      if delay is None:
+        self.log('Calibrating the read delay.')
+        delay = tuner.tune(key)
+        if delay is None:
+          self.log('Warning: reads are not stable at any read delay.')
+      elif not self.fw.setReadDelay(delay):
+        delay = None
+    except IOError as e:
+      self.debugLog('IOError: ' + str(e))
+      self.log('The reader does not support read delays.')
+      self.fw.flushInput()
+      delay = None
+
+    self.debugLog('Read delay ' + str(delay))
+    return delay
 
   def update(self):
     """
@@ -205,42 +582,45 @@ class RomClient():
       self.log('Starting ROM dump')
       self.state = _State.DUMP
       self.lockGui()
-      self.timeoutCount = self.timeoutTicks
 
       self.dataLength = 0
+      self.dataValid = False
+      self._dumpStart = time.perf_counter()
       self._clearRom()
 
-      # Synchronize with firmware (just in case)
-      self.fw.sync()
+      # Synchronize with firmware. An acknowledged sync also calibrates the
+      # read timeouts.
+      if not self._sync():
+        self.log('The reader does not respond.')
+        self.state = _State.DUMP_TIMEOUT
+      else:
+        if self.fw.rtt is not None:
+          self.debugLog('Round trip time {:.2f} ms'.format(self.fw.rtt * 1000))
+        if self.blockLengthAuto:
+          self.tuneBlockLength()
 
     ### Dumping the ROM
-    if self.state == _State.DUMP: #TODO redo state machine preferably with bankswitching address generator support
-      if self.timeoutCount:
-        self.timeoutCount -= 1
-        length = 256#TODO avoid magic numbers
-        request = Fw_Packet(Fw_Command.READ_BLOCK, address=0x1000, length=length)
-
-        for i in range(0,16): #TODO avoid magic numbers
-          reply = self.fw.transceive(request)
-          self.romData.extend(reply.getData())
-          self.dataLength += length
-          request.addressNextBlock()
-        
-        self.state = _State.DUMP_END
-      else:
-        self.state = _State.DUMP_TIMEOUT
+    if self.state == _State.DUMP:
+      try:
+        plan = self._createPlan()
+        if plan is None:
+          self.log('Bankswitch method not supported.')
+          self.state = _State.DUMP_FAIL
+        else:
+          self.plan = plan
+          self._selectReadDelay()
+          if self.journalEnabled:
+            self._executeJournaledPlan(plan)
+          else:
+            self._executePlan(plan)
+          self.state = _State.DUMP_END
+      except (IOError, OSError) as e:
+        self.log(str(e))
+        self.state = _State.DUMP_FAIL
 
     ### Dumped the ROM succesfully
     if self.state == _State.DUMP_END:
-      self.log('Done! Rom has been dumped succesfully.')
-      self.dataValid = True
-
-      # Always make a temporary dump
-      self.saveDump(self._kTemporaryFilePath)
-
-      if self.launchEmulatorEnabled:
-        self.launchEmulator()
-
+      self._dumpDone()
       self.state = _State.RESET
 
     if self.state == _State.DUMP_TIMEOUT:
@@ -257,6 +637,9 @@ class RomClient():
     ### ROM dump has failed
     if self.state == _State.DUMP_FAIL:
       self.log('ROM dump failed.')
+      self.fw.metrics.increment('dump_failures')
+      self._abortSink()
+      self._closeJournal()
       self.unlockGui()
       abort = True
       self.state = _State.RESET
@@ -266,6 +649,67 @@ class RomClient():
       self.unlockGui()
       self.state = _State.READY
 
+    return abort
+
+
+  async def dump(self, link):
+    """
+    Dump the ROM through an asyncio firmware link. Coroutine counterpart of
+    startDump and the update() state machine.
+    :type link: AsyncFwLink
+    :return: True if the ROM was dumped succesfully
+    :rtype: bool
+    """
+    if self.isBusy():
+      self.debugLog('Busy')
+      return False
+
+    self.log('Starting ROM dump')
+    self.state = _State.DUMP
+    self.lockGui()
+    self.dataLength = 0
+    self.dataValid = False
+    self._dumpStart = time.perf_counter()
+    self._clearRom()
+    self.detectedBankSwitchMethod = self.bankSwitchMethod
+
+    try:
+      if not await link.sync():
+        self.log('The reader does not respond.')
+      else:
+        plan = await self._createPlanAsync(link)
+        if plan is None:
+          self.log('Bankswitch method not supported.')
+        else:
+          await self._executePlanAsync(plan, link)
+          self._dumpDone()
+    except IOError as e:
+      self.debugLog('IOError: ' + str(e))
+    finally:
+      if not self.dataValid:
+        self.log('ROM dump failed.')
+        self.fw.metrics.increment('dump_failures')
+        self._abortSink()
+      self.state = _State.READY
+      self.unlockGui()
+
+    return self.dataValid
+
+  def getMetrics(self):
+    """
+    Transaction and dump metrics of the firmware link.
+    :rtype: Fw_Metrics
+    """
+    return self.fw.metrics
+
+  def writeMetrics(self, jsonPath = None, prometheusPath = None):
+    """
+    Export metrics as JSON and/or as a Prometheus textfile labeled with the port.
+    """
+    if jsonPath:
+      self.fw.metrics.writeJson(jsonPath)
+    if prometheusPath:
+      self.fw.metrics.writePrometheus(prometheusPath, {'port': str(self.fw.port)})
 
   def getLastFileName(self):
     return self.lastRomFileName
@@ -291,9 +735,829 @@ class RomClient():
 # Private Methods
 #///////////////////////////////////////////////////////////////////////////////
   def _clearRom(self):
+    if self._sink is not None:
+      self._sink.close()
+      self._sink = None
     self.romData = bytearray()
 
+  def _abortSink(self):
+    """ Remove the partial output file of a failed streamed dump """
+    if self._sink is not None:
+      self._sink.abort()
+      self._sink = None
+      self.romData = bytearray()
+    self._sinkPath = None
+
+  def _selectTransfer(self, info):
+    """ Select block length, pipeline depth and batch size for a reader.
+    Settings that were not chosen explicitly use what the reader reports. """
+    self.readerInfo = info
+    self.fw.setAcknowledgedSync(info.reports(Fw_Command.NOP))
+    self.setBlockLength(self._blockLength)
+    self.setPipelineDepth(self._pipelineDepth)
+    if info.maxBatch is not None:
+      self.fw.setMaxBatch(info.maxBatch)
+    else:
+      self.fw.setMaxBatch(Fw_Link._kDefaultMaxBatch)
+    self.debugLog('Reader ' + str(info) + ': block length ' + str(self.blockLength) +
+                  ', pipeline depth ' + str(self.fw.pipelineDepth) +
+                  ', batches of ' + str(self.fw.maxBatch))
+
+  def _selectReadDelay(self):
+    """ Calibrate or set the read delay before the ROM is read """
+    if self.readDelayAuto:
+      self.calibrateReadDelay()
+    elif self.readDelay is not None and not self.fw.setReadDelay(self.readDelay):
+      raise IOError('Read delay ' + str(self.readDelay) + ' was not acknowledged')
+
+  def _readerKey(self):
+    """ Key that identifies the attached reader and its firmware in caches,
+    e.g. '2341:0043:95530343/fw1.2'. Readers that are not USB devices are
+    identified by their port. """
+    key = self.readerUsbKey or str(self.fw.port)
+    if self.readerInfo.firmware is not None:
+      key += '/fw' + str(self.readerInfo.firmware)
+    return key
+
+  def _closeJournal(self):
+    """ Close the journal, keeping it for the next dump """
+    if self._journal is not None:
+      self._journal.close()
+      self._journal = None
+
+  def _journalPath(self):
+    """ Journal location, one per reader and bankswitching method """
+    name = re.sub(r'[^A-Za-z0-9_.-]', '_', self._readerKey())
+    return getCachePath(os.path.join('journal', name + '.' + str(self.detectedBankSwitchMethod)))
+
+  def _dumpDone(self):
+    self.log('Done! Rom has been dumped succesfully.')
+    self.dataValid = True
+    self.fw.metrics.increment('dumps')
+    self.fw.metrics.observe('dump_seconds', time.perf_counter() - self._dumpStart)
+
+    if self._journal is not None:
+      self._journal.remove()
+      self._journal = None
+
+    self.digest.finish(self.romData)
+    self.debugLog('CRC32 ' + self.digest.getCrc32() + ', SHA-1 ' + self.digest.getSha1())
+    if self._verifying:
+      # runVerifiedDump identifies and saves the image once every pass is done
+      return
+    self._identify()
+    if self._sink is not None:
+      self._commitSink()
+    else:
+      # Always make a temporary dump
+      self.saveDump(self.temporaryFilePath)
+
+    if self.launchEmulatorEnabled:
+      self.launchEmulator()
+
+  def _commitSink(self):
+    """ Keep a copy of the image in memory and move the streamed file to its target """
+    sink = self._sink
+    self._sink = None
+    self._sinkPath = None
+    self.romData = bytearray(self.romData)
+    try:
+      sink.commit()
+      self.lastRomFileName = sink.path
+      self.log('Saved ROM to ' + sink.path)
+    except (IOError, OSError) as e:
+      sink.abort()
+      self.log('Could not write to file.')
+      self.debugLog('IOError: ' + str(e))
+
+  def _beginPlan(self, plan):
+    """ Prepare the ROM image for a read plan """
+    if self._sinkPath is not None:
+      self._sink = RomFileSink(self._sinkPath, plan.size)
+      self.romData = self._sink.data
+    else:
+      self.romData = bytearray(plan.size)
+    self._planDone = 0
+    self._planTotal = sum(step.length for step in plan.steps if step.offset is not None)
+    self.digest = RomDigest(plan.size)
+    self.romEntry = None
+    self._romCandidates = None
+
+  def _storeHotspot(self, step, data):
+    """ Store the byte read by a hotspot access in the ROM image """
+    if step.offset is not None:
+      self.romData[step.offset] = data[0]
+      if self._journal is not None:
+        self._journal.record(step.offset, data[:1])
+      self._digestUpdate(step.offset, step.offset + 1)
+      self._blockDone(1)
+
+  def _digestUpdate(self, start, end):
+    """ Hash a completed range and check new prefixes against the database """
+    for length, crc in self.digest.update(self.romData, start, end):
+      self._checkPrefix(length, crc)
+
+  def _checkPrefix(self, length, crc):
+    """ Narrow down the known ROMs the image can still be. Stops once a
+    candidate is shorter than the prefix, its mirrors are not indexed. """
+    db = self.romDatabase
+    if db is None or not db.hasPrefixes() or self._romCandidates == []:
+      return
+    if self._romCandidates and min(entry.size for entry in self._romCandidates) < length:
+      return
+
+    self._romCandidates = db.matchPrefix(length, crc)
+    if self._romCandidates:
+      self.debugLog(str(len(self._romCandidates)) + ' known ROMs match the first ' + str(length) + ' bytes')
+    else:
+      self.log('Warning: the first ' + str(length) + ' bytes do not match any known ROM.')
+
+  def _identify(self):
+    """ Look up the completed dump in the ROM database """
+    self.romEntry = None
+    if self.romDatabase is not None:
+      self.romEntry = self.romDatabase.identify(self.digest)
+      if self.romEntry is not None:
+        self.log('Identified as ' + self.romEntry.name)
+      else:
+        self.log('Unknown ROM.')
+
+  def _blockDone(self, length):
+    self.dataLength += length
+    self._planDone += length
+    self.progress(self._planDone, self._planTotal)
+
+  def _blockStore(self, address, offset):
+    """ Callback that copies reply payloads straight into the ROM image.
+    :param address: Address of the first byte of the range.
+    :param offset: Image offset of the first byte of the range. """
+    def store(reply):
+      data = reply.getData()
+      start = offset + reply.address - address
+      self.romData[start:start + len(data)] = data
+      if self._journal is not None:
+        self._journal.record(start, data)
+      self._digestUpdate(start, start + len(data))
+      self._blockDone(len(data))
+    return store
+
+  def _executePlan(self, plan, mask = None):
+    """ Read a ROM image by executing the steps of a bankswitching read plan
+    :type plan: ReadPlan
+    :param mask: Optional bytearray with one byte per image offset. Only the
+      offsets set to 1 are read again, the rest of romData is kept. Gaps
+      shorter than a block are read along to save requests. Hotspot accesses
+      are always done so the bank state stays right. """
+    if mask is None:
+      self._beginPlan(plan)
+
+    # Runs of hotspot accesses, or of (address, length, offset) ranges to read
+    runs = []
+    for isHotspot, steps in itertools.groupby(plan.steps, lambda step: isinstance(step, HotspotAccess)):
+      if isHotspot:
+        runs.append((True, list(steps)))
+      elif mask is None:
+        runs.append((False, [(step.address, step.length, step.offset) for step in steps]))
+      else:
+        runs.append((False, [r for step in steps for r in self._maskedRanges(step, mask)]))
+
+    if mask is not None:
+      # Progress counts what is read again, including gaps that are read along
+      self._planDone = 0
+      self._planTotal = 0
+      for isHotspot, items in runs:
+        if isHotspot:
+          self._planTotal += sum(1 for step in items if step.offset is not None)
+        else:
+          self._planTotal += sum(length for _, length, _ in items)
+
+    for isHotspot, items in runs:
+      if isHotspot:
+        self._readHotspots(items)
+      else:
+        for address, length, offset in items:
+          self._readRange(address, length, offset)
+
+  def _maskedRanges(self, step, mask):
+    """ Ranges of a block read that cover the offsets set in a mask. Gaps
+    shorter than a block are read along.
+    :return: List of (address, length, offset) tuples
+    :rtype: list """
+    ranges = []
+    end = step.offset + step.length
+    first = mask.find(1, step.offset, end)
+    while first >= 0:
+      last = first
+      following = first
+      while following >= 0 and following - last < self.blockLength:
+        last = mask.find(0, following, end)
+        last = end if last < 0 else last
+        following = mask.find(1, last, end)
+      ranges.append((step.address + first - step.offset, last - first, first))
+      first = following
+    return ranges
+
+  def _executeJournaledPlan(self, plan):
+    """ Execute a read plan, resuming the journal of an earlier dump of the
+    same cartridge if there is one """
+    journal = DumpJournal(self._journalPath(), plan.size, fingerprint(self._readFingerprint(plan)))
+    self._journal = journal
+
+    if journal.isResumed():
+      self.log('Resuming dump, ' + str(journal.getCompletedLength()) + ' of ' +
+               str(plan.size) + ' bytes were read before.')
+      self._beginPlan(plan)
+      self.romData[:] = journal.readImage()
+      missing = journal.getMissingMask()
+      # Hash the resumed ranges, the digest only advances over a contiguous prefix
+      start = missing.find(0)
+      while start >= 0:
+        end = missing.find(1, start)
+        end = len(missing) if end < 0 else end
+        self._digestUpdate(start, end)
+        start = missing.find(0, end)
+      self._executePlan(plan, missing)
+    else:
+      self._executePlan(plan)
+
+  def _createPlan(self):
+    """ Create the read plan of the selected or detected bankswitching
+    method, for the detected ROM size if size detection is enabled
+    :return: Read plan or None if the method is not supported
+    :rtype: ReadPlan """
+    method = self.bankSwitchMethod
+    if method == BankSwitchMethod.AUTO:
+      try:
+        method = self.detectBankSwitchMethod()
+      except ImportError:
+        self.log('Bankswitch detection needs NumPy, dumping without bankswitching.')
+        method = BankSwitchMethod.NONE
+    self.detectedBankSwitchMethod = method
+
+    scheme = getBankScheme(method)
+    if scheme is None:
+      return None
+
+    size = None
+    if self.sizeDetectionEnabled:
+      size = self._detectMirrorSize(scheme)
+    return scheme.createPlan(size)
+
+  def _detectMirrorSize(self, scheme):
+    """ Compare sample blocks across the mirror boundaries of the scheme
+    :return: Smallest size the ROM is a mirror of, or None if it is not mirrored
+    :rtype: int """
+    size = None
+    for candidate in scheme.mirrorSizes:
+      probes = scheme.getMirrorProbes(candidate, self._kMirrorProbes)
+      blocks = [(address, n) for a, b, n in probes for address in (a, b)]
+      samples = self._readBlockBatch(blocks)
+      if samples[0::2] != samples[1::2]:
+        break
+      size = candidate
+
+    if size is not None:
+      self.log('Detected a ' + str(size) + ' byte ROM.')
+    return size
+
+  def _readBlock(self, address, length):
+    """ Read one block, retrying if it fails
+    :rtype: bytes """
+    request = Fw_Packet(Fw_Command.READ_BLOCK, address=address, length=length)
+    reply = self._tryRead(lambda: self.fw.transceive(request))
+    if reply is None:
+      reply = self._retryBlock(address, length)
+    return bytes(reply.getData())
+
+  def _readBlockBatch(self, blocks):
+    """ Read several blocks with one batch of requests. Blocks that fail
+    are read again one by one.
+    :param blocks: (address, length) of every block.
+    :return: Data of every block
+    :rtype: list """
+    requests = [Fw_Packet(Fw_Command.READ_BLOCK, address=a, length=n) for a, n in blocks]
+    replies = self._transceiveBatch(requests)
+    return [bytes(reply.getData()) if reply is not None else self._readBlock(a, n)
+            for (a, n), reply in zip(blocks, replies)]
+
+  def _transceiveBatch(self, requests):
+    """ Send a batch of requests
+    :return: Reply packets in request order, all None if the batch failed
+    :rtype: list """
+    replies = self._tryRead(lambda: self.fw.transceiveBatch(requests))
+    if replies is None:
+      # Drop late replies of the failed batch before anything is read again
+      self.fw.flushInput()
+      return [None] * len(requests)
+    return replies
+
+  def _readFingerprint(self, plan):
+    """ Read the start of the first block of a plan, selecting its bank first
+    :rtype: bytes """
+    for step in plan.steps:
+      if isinstance(step, HotspotAccess):
+        self._readHotspot(step)
+      else:
+        return self._readBlock(step.address, min(self._kFingerprintLength, step.length))
+    return b''
+
+  async def _createPlanAsync(self, link):
+    """ Coroutine version of _createPlan without size detection
+    :rtype: ReadPlan """
+    method = self.bankSwitchMethod
+    if method == BankSwitchMethod.AUTO:
+      try:
+        method = await self._detectBankSwitchMethodAsync(link)
+      except ImportError:
+        self.log('Bankswitch detection needs NumPy, dumping without bankswitching.')
+        method = BankSwitchMethod.NONE
+    self.detectedBankSwitchMethod = method
+    return createReadPlan(method)
+
+  async def _detectBankSwitchMethodAsync(self, link):
+    """ Detect the bankswitching method through an AsyncFwLink. The detector
+    runs in a worker thread and its reads are run on the event loop.
+    :rtype: int """
+    import asyncio
+    from bankdetect import BankSwitchDetector
+
+    loop = asyncio.get_running_loop()
+    def run(coroutine):
+      return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+    detector = BankSwitchDetector(lambda address, length: run(self._readBlockAsync(link, address, length)),
+                                  lambda address: run(self._readHotspotAsync(link, HotspotAccess(address))),
+                                  self.debugLog)
+    method = await loop.run_in_executor(None, detector.detect)
+    self.log('Detected bankswitching method ' + getBankSwitchMethodName(method) + '.')
+    return method
+
+  async def _executePlanAsync(self, plan, link):
+    """ Coroutine version of _executePlan that reads through an AsyncFwLink.
+    Failed blocks and hotspot accesses are retried like on the blocking link. """
+    self._beginPlan(plan)
+
+    for isHotspot, steps in itertools.groupby(plan.steps, lambda step: isinstance(step, HotspotAccess)):
+      steps = list(steps)
+      if isHotspot:
+        await self._readHotspotsAsync(link, steps)
+        continue
+
+      for step in steps:
+        store = self._blockStore(step.address, step.offset)
+        for address, length, count in self._rangeSegments(step.address, step.length):
+          replies = await link.readBlocks(address, length, count, callback=store, partial=True)
+          for i, reply in enumerate(replies):
+            if reply is None:
+              store(await self._retryBlockAsync(link, address + i * length, length))
+
+  async def _readBlockAsync(self, link, address, length):
+    """ Coroutine version of _readBlock
+    :rtype: bytes """
+    request = Fw_Packet(Fw_Command.READ_BLOCK, address=address, length=length)
+    reply = await self._tryReadAsync(link.transceive(request))
+    if reply is None:
+      reply = await self._retryBlockAsync(link, address, length)
+    return bytes(reply.getData())
+
+  async def _readSingleAsync(self, link, address):
+    """ Coroutine version of _readSingle """
+    reply = await link.transceive(self._readSingleRequest(address))
+    return reply.getData() if reply is not None else None
+
+  async def _readHotspotsAsync(self, link, steps):
+    """ Coroutine version of _readHotspots """
+    requests = [self._readSingleRequest(step.address) for step in steps]
+    replies = await self._tryReadAsync(link.transceiveBatch(requests))
+    if replies is None:
+      link.flushInput()
+      replies = [None] * len(steps)
+
+    for i, (step, reply) in enumerate(zip(steps, replies)):
+      if reply is None:
+        if step.reselect is not None:
+          await self._tryReadAsync(self._readSingleAsync(link, step.reselect))
+        for remaining in steps[i:]:
+          self._storeHotspot(remaining, await self._readHotspotAsync(link, remaining))
+        return
+      self._storeHotspot(step, reply.getData())
+
+  async def _readHotspotAsync(self, link, step):
+    """ Coroutine version of _readHotspot """
+    data = await self._tryReadAsync(self._readSingleAsync(link, step.address))
+    for delay in self.retryPolicy.delays():
+      if data is not None:
+        break
+      await self._recoverAsync(link, delay, step.address)
+      if step.reselect is not None:
+        await self._tryReadAsync(self._readSingleAsync(link, step.reselect))
+      data = await self._tryReadAsync(self._readSingleAsync(link, step.address))
+
+    if data is None:
+      raise IOError('Hotspot ' + hex(step.address) + ' failed after ' +
+                    str(self.retryPolicy.attempts) + ' retries')
+    return data
+
+  async def _retryBlockAsync(self, link, address, length):
+    """ Coroutine version of _retryBlock
+    :rtype: Fw_Packet """
+    request = Fw_Packet(Fw_Command.READ_BLOCK, address=address, length=length)
+    for delay in self.retryPolicy.delays():
+      await self._recoverAsync(link, delay, address)
+      reply = await self._tryReadAsync(link.transceive(request))
+      if reply is not None:
+        return reply
+
+    raise IOError('Block at ' + hex(address) + ' failed after ' +
+                  str(self.retryPolicy.attempts) + ' retries')
+
+  async def _recoverAsync(self, link, delay, address):
+    """ Coroutine version of _recover """
+    import asyncio
+
+    self.debugLog('Retrying ' + hex(address))
+    self.fw.metrics.increment('retries')
+    await asyncio.sleep(delay)
+    if self.retryPolicy.resync:
+      await link.sync()
+    link.flushInput()
+
+  async def _tryReadAsync(self, read):
+    """ :param read: Awaitable
+    :return: Result of read or None if it raised IOError """
+    try:
+      return await read
+    except IOError as e:
+      self.debugLog('IOError: ' + str(e))
+      return None
+
+  def _readSingleRequest(self, address):
+    return Fw_Packet(Fw_Command.READ_SINGLE, address=address, length=1)
+
+  def _readSingle(self, address):
+    """ Read one byte with a READ_SINGLE request
+    :return: Data or None if the reply failed the checksum """
+    reply = self.fw.transceive(self._readSingleRequest(address))
+    return reply.getData() if reply is not None else None
+
+  def _readHotspots(self, steps):
+    """ Touch consecutive hotspots with one batch of READ_SINGLE requests.
+    From the first access that failed on, the hotspots are touched again one
+    by one with retries, so the banks are still selected in plan order. """
+    replies = self._transceiveBatch([self._readSingleRequest(step.address) for step in steps])
+    for i, (step, reply) in enumerate(zip(steps, replies)):
+      if reply is None:
+        # The failed access or later ones may have switched the bank already
+        if step.reselect is not None:
+          self._tryRead(lambda: self._readSingle(step.reselect))
+        for remaining in steps[i:]:
+          self._storeHotspot(remaining, self._readHotspot(remaining))
+        return
+      self._storeHotspot(step, reply.getData())
+
+  def _sampleBanks(self, windows, length):
+    """ Touch hotspots and read samples of the banks they select, all in
+    one batch. From the first window with a failed reply on, the windows are
+    sampled again one by one.
+    :param windows: (hotspot, sample addresses) in access order.
+    :param length: Length of each sample block in bytes.
+    :return: Joined sample blocks of every window
+    :rtype: list """
+    requests = []
+    for hotspot, addresses in windows:
+      requests.append(self._readSingleRequest(hotspot))
+      requests.extend(Fw_Packet(Fw_Command.READ_BLOCK, address=a, length=length) for a in addresses)
+    replies = iter(self._transceiveBatch(requests))
+
+    samples = []
+    failed = False
+    for hotspot, addresses in windows:
+      touched = next(replies)
+      blocks = [next(replies) for _ in addresses]
+      failed = failed or touched is None or None in blocks
+      if failed:
+        self._readHotspot(HotspotAccess(hotspot))
+        samples.append(b''.join(self._readBlock(a, length) for a in addresses))
+      else:
+        samples.append(b''.join(bytes(block.getData()) for block in blocks))
+    return samples
+
+  def _readHotspot(self, step):
+    """ Touch a hotspot. Failed accesses are retried, reselecting the bank
+    the byte belongs to first. """
+    data = self._tryRead(lambda: self._readSingle(step.address))
+    for delay in self.retryPolicy.delays():
+      if data is not None:
+        break
+      self._recover(delay, step.address)
+      if step.reselect is not None:
+        self._tryRead(lambda: self._readSingle(step.reselect))
+      data = self._tryRead(lambda: self._readSingle(step.address))
+
+    if data is None:
+      raise IOError('Hotspot ' + hex(step.address) + ' failed after ' +
+                    str(self.retryPolicy.attempts) + ' retries')
+    return data
+
+  def _rangeSegments(self, address, length):
+    """ Split a range into runs of equally sized READ_BLOCK transfers
+    :return: List of (address, blockLength, count) tuples
+    :rtype: list """
+    segments = []
+    count, remainder = divmod(length, self.blockLength)
+    if count:
+      segments.append((address, self.blockLength, count))
+    if remainder:
+      segments.append((address + count * self.blockLength, remainder, 1))
+    return segments
+
+  def _readRange(self, address, length, offset):
+    """ Read a contiguous range that contains no hotspots with pipelined
+    READ_BLOCK requests, storing every block in the ROM image as it arrives.
+    Blocks that fail are read again one by one according to the retry policy.
+    :param offset: Image offset of the first byte. """
+    store = self._blockStore(address, offset)
+    stats = []
+    for segmentAddress, blockLength, count in self._rangeSegments(address, length):
+      replies = self.fw.readBlocks(segmentAddress, blockLength, count,
+                                   stats=stats, callback=store, partial=True)
+      for i, reply in enumerate(replies):
+        if reply is None:
+          store(self._retryBlock(segmentAddress + i * blockLength, blockLength))
+
+    for window in stats:
+      self.debugLog('Window of ' + str(window.depth) + ' requests: ' + 
+                    str(int(window.getThroughput())) + ' bytes/s')
+
+  def _retryBlock(self, address, length):
+    """ Read a single failed block again
+    :rtype: Fw_Packet """
+    request = Fw_Packet(Fw_Command.READ_BLOCK, address=address, length=length)
+    for delay in self.retryPolicy.delays():
+      self._recover(delay, address)
+      reply = self._tryRead(lambda: self.fw.transceive(request))
+      if reply is not None:
+        return reply
+
+    raise IOError('Block at ' + hex(address) + ' failed after ' +
+                  str(self.retryPolicy.attempts) + ' retries')
+
+  def _sync(self):
+    """ Synchronize with the firmware, retrying according to the retry policy
+    :return: False if the firmware did not acknowledge any sync
+    :rtype: bool """
+    success = self.fw.sync()
+    for delay in self.retryPolicy.delays():
+      if success:
+        break
+      self.debugLog('Sync was not acknowledged')
+      time.sleep(delay)
+      success = self.fw.sync()
+    return success
+
+  def _recover(self, delay, address):
+    """ Back off and optionally resynchronize before a retry """
+    self.debugLog('Retrying ' + hex(address))
+    self.fw.metrics.increment('retries')
+    time.sleep(delay)
+    if self.retryPolicy.resync:
+      self.fw.sync()
+    # Drop late replies of the failed transfer
+    self.fw.flushInput()
+
+  def _tryRead(self, read):
+    """ :return: Result of read or None if it raised IOError """
+    try:
+      return read()
+    except IOError as e:
+      self.debugLog('IOError: ' + str(e))
+      return None
+
+
+#///////////////////////////////////////////////////////////////////////////////
+# Command line
+#///////////////////////////////////////////////////////////////////////////////
+_kSwapPollInterval = 1.0 # s
+
+def _stderr(message):
+  print(message, file=sys.stderr)
+
+
+def _parseMethod(name):
+  method = getattr(BankSwitchMethod, name.upper(), None)
+  if not isinstance(method, int):
+    raise argparse.ArgumentTypeError('unknown bankswitching method ' + name)
+  return method
+
+
+def _parseReadDelay(value):
+  if value == 'auto':
+    return value
+  try:
+    return int(value, 0)
+  except ValueError:
+    raise argparse.ArgumentTypeError('read delay must be a number or auto')
+
+
+def _printJob(report):
+  """ Write one job report as a line of JSON to stdout """
+  print(json.dumps(report, sort_keys=True))
+  sys.stdout.flush()
+
+
+def _jobReport(rc, job, mode, path, success, start):
+  digest = rc.getDigest() if success else None
+  entry = rc.getRomEntry() if success else None
+  method = rc.getDetectedBankSwitchMethod()
+  return {
+    'job': job,
+    'mode': mode,
+    'port': rc.fw.port,
+    'path': path,
+    'success': bool(success),
+    'method': getBankSwitchMethodName(method) if method is not None else None,
+    'size': len(rc.romData) if success else None,
+    'digest': digest.toDict() if digest is not None else None,
+    'rom': entry.name if entry is not None else None,
+    'seconds': round(time.perf_counter() - start, 3),
+    'counters': dict(rc.getMetrics().counters),
+  }
+
+
+def _runJob(rc, args, job, path):
+  """ Dump or verify one cartridge
+  :return: Job report
+  :rtype: dict """
+  rc.getMetrics().reset()
+  start = time.perf_counter()
+  if path:
+    rc.setOutputFile(path)
+
+  if args.mode == 'verify':
+    result = rc.runVerifiedDump(args.passes)
+    report = _jobReport(rc, job, args.mode, path, result is not None, start)
+    if result is not None:
+      report['passes'] = result.passes
+      report['unstableBytes'] = len(result.getUnstableOffsets())
+  else:
+    report = _jobReport(rc, job, args.mode, path, rc.runDump(), start)
+  return report
+
+
+def _waitForSwap(rc, previous, interval):
+  """ Poll the slot until a cartridge other than previous is inserted.
+  A new cartridge must read the same twice in a row, so a cartridge that
+  is still being pushed in is not dumped.
+  :return: Fingerprint of the new cartridge
+  :rtype: str """
+  candidate = None
+  while True:
+    current = rc.readCartridgeId()
+    if current == '':
+      # The slot was emptied, the same title may be inserted again
+      previous = None
+    elif current is not None and current != previous and current == candidate:
+      return current
+    candidate = current
+    time.sleep(interval)
+
+
+def _identifyFile(path, database):
+  with open(path, 'rb') as f:
+    digest = RomDigest.fromData(f.read())
+  entry = database.identify(digest) if database is not None else None
+  return {
+    'job': 0,
+    'mode': 'identify',
+    'path': path,
+    'success': True,
+    'size': digest.size,
+    'digest': digest.toDict(),
+    'rom': entry.name if entry is not None else None,
+  }
+
+
+def _importFiles(database, datPaths, romPaths):
+  """ Add DAT and ROM files to the database and save it
+  :return: Job report
+  :rtype: dict """
+  report = {'job': 0, 'mode': 'import', 'path': database.path, 'success': True}
+  added = 0
+  try:
+    for path in datPaths:
+      added += database.addDatFile(path)
+    for path in romPaths:
+      count = len(database.entries)
+      database.addRomFile(path)
+      added += len(database.entries) - count
+    database.save()
+  except (IOError, OSError, ValueError, SyntaxError) as e:
+    # ElementTree.ParseError is a SyntaxError
+    report['success'] = False
+    report['error'] = str(e)
+  report['added'] = added
+  report['entries'] = len(database.entries)
+  return report
+
+
+def main(argv = None):
+  parser = argparse.ArgumentParser(
+    description='Dump Atari 2600 cartridges without the GUI. Every job is reported as one line of JSON on stdout, log messages go to stderr.')
+  parser.add_argument('mode', choices=('dump', 'verify', 'identify', 'batch', 'import'),
+                      help='dump: dump to --output. verify: dump several passes and resolve differences. '
+                           'identify: look up the cartridge, or --file, in the ROM database. '
+                           'batch: dump every cartridge that is inserted, until --count dumps or Ctrl+C. '
+                           'import: add --dat and --rom files to the ROM database.')
+  parser.add_argument('--port', help='Serial port of the reader. By default the reader is searched for.')
+  parser.add_argument('--output', help='ROM file. In batch mode a pattern, {n} is the job number, e.g. dump-{n:03}.a26')
+  parser.add_argument('--file', help='Identify this ROM file instead of a cartridge.')
+  parser.add_argument('--method', type=_parseMethod, default=BankSwitchMethod.AUTO,
+                      help='Bankswitching method, e.g. F8 (default AUTO).')
+  parser.add_argument('--passes', type=int, default=3, help='Maximum passes in verify mode (default 3).')
+  parser.add_argument('--batch-verify', action='store_true', help='Verify every dump in batch mode.')
+  parser.add_argument('--count', type=int, default=0, help='Stop batch mode after this many dumps (default no limit).')
+  parser.add_argument('--timeout', type=float, default=1, help='Serial read timeout in seconds (default 1).')
+  parser.add_argument('--block-length', type=int, help='READ_BLOCK length, or 0 to tune it.')
+  parser.add_argument('--read-delay', type=_parseReadDelay,
+                      help='Delay of the firmware between reads, or auto to calibrate it.')
+  parser.add_argument('--journal', action='store_true', help='Resume interrupted dumps.')
+  parser.add_argument('--database', help='ROM database (default romdb.json in the cache directory).')
+  parser.add_argument('--dat', action='append', default=[],
+                      help='Import mode: Logiqx XML DAT file to add, e.g. from No-Intro. Can be given more than once.')
+  parser.add_argument('--rom', action='append', default=[],
+                      help='Import mode: ROM file to add. ROM files also allow identification while dumping. '
+                           'Can be given more than once.')
+  parser.add_argument('--metrics', help='Write metrics of the last job to this JSON file.')
+  parser.add_argument('--verbose', action='store_true', help='Print debug messages.')
+  args = parser.parse_args(argv)
+
+  from romdb import RomDatabase
+  database = RomDatabase(args.database)
+
+  if args.mode == 'import':
+    if not args.dat and not args.rom:
+      parser.error('import needs --dat or --rom')
+    report = _importFiles(database, args.dat, args.rom)
+    _printJob(report)
+    return 0 if report['success'] else 1
+
+  if args.mode == 'identify' and args.file:
+    _printJob(_identifyFile(args.file, database))
+    return 0
+
+  if args.mode in ('dump', 'batch') and not args.output:
+    parser.error('--output is required for ' + args.mode)
+
+  rc = RomClient(None, _stderr, _stderr if args.verbose else _nop)
+  rc.setSerialReadTimeout(args.timeout)
+  if args.port:
+    if not rc.setSerialPort(args.port):
+      return 1
+  elif rc.selectReader() is None:
+    return 1
+  rc.setBankSwitchMethod(args.method)
+  rc.setRomDatabase(database)
+  rc.setJournalEnabled(args.journal)
+  if args.block_length == 0:
+    rc.setBlockLengthAuto(True)
+  elif args.block_length:
+    rc.setBlockLength(args.block_length)
+  if args.read_delay == 'auto':
+    rc.setReadDelayAuto(True)
+  else:
+    rc.setReadDelay(args.read_delay)
+
+  failures = 0
+  try:
+    if args.mode == 'batch':
+      if args.batch_verify:
+        args.mode = 'verify'
+      job = 0
+      previous = None
+      while not args.count or job < args.count:
+        _stderr('Waiting for a cartridge.')
+        _waitForSwap(rc, previous, _kSwapPollInterval)
+        report = _runJob(rc, args, job, args.output.format(n=job))
+        report['mode'] = 'batch'
+        _printJob(report)
+        failures += not report['success']
+        job += 1
+        # The dump leaves other banks selected, compare with the slot as it is now
+        previous = rc.readCartridgeId()
+    else:
+      report = _runJob(rc, args, 0, args.output if args.mode != 'identify' else None)
+      report['mode'] = args.mode
+      _printJob(report)
+      failures += not report['success']
+  except KeyboardInterrupt:
+    _stderr('Stopped.')
+  finally:
+    if args.metrics:
+      rc.getMetrics().writeJson(args.metrics)
+    rc.fw.close()
+
+  return 1 if failures else 0
+
 
 if __name__ == '__main__':
-  # TODO implement
-  pass
\ No newline at end of file
+  sys.exit(main())
\ No newline at end of file
@@ -1,25 +1,36 @@
-""" GUI wrapper for ROM dumping utility """
+""" GUI wrapper for ROM dumping utility
+
+Only Qt and the generated UI are imported at start up. The window is shown
+first, then the ROM client is imported and set up. The serial ports are
+listed and searched for a reader in a background thread.
+
+Run with --startup-time to print the time until the window was shown and
+the ROM client was ready, then quit. benchmark.py uses this.
+"""
 
-import serial.tools.list_ports
 import sys
+import time
+
+_startTime = time.perf_counter()
+
 from gui import *
-from romclient import *
+from portscanner import PortScanner
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtWidgets import QFileDialog
-from PyQt5.QtCore import QTimer
+from PyQt5.QtCore import QThread
 
-# Timeout time (in ms) is:
-#   kUpdateTimerInterval * kReadTimeoutTicks
-kUpdateTimerInterval = 1000 # ms
 kSerialTimeoutS = 3 # s
-kReadTimeoutTicks = 5
 debugLogEnabled = False
+rc = None
+# Port and Fw_Info of the reader the last scan found
+scannedReader = (None, None)
 
 #//////////////////////////////////////////////////////////////////////////////
 # Emulator
 #//////////////////////////////////////////////////////////////////////////////
 def handleAutoLaunch(checked):
-  rc.setLaunchEmulatorEnabled(checked)
+  if rc is not None:
+    rc.setLaunchEmulatorEnabled(checked)
     
 
 #//////////////////////////////////////////////////////////////////////////////
@@ -36,7 +47,7 @@ def fileSaveDialog():
 
 def fileSave():
   fileName = fileSaveDialog()
-  if fileName:
+  if fileName and rc is not None:
     debugLog('Saving to file')
     debugLog(fileName)
     rc.saveDump(fileName)
@@ -85,23 +96,50 @@ def handleDebugOption(checked):
 # Serial port selection
 #//////////////////////////////////////////////////////////////////////////////
 def serialPortScan():
-  ports = serial.tools.list_ports.comports()
-  
+  if portScanner.scan():
+    ui.buttonScan.setEnabled(False)
+    ui.statusbar.showMessage('Scanning serial ports')
+
+
+def serialPortScanDone(ports, readerPort, readerInfo):
+  global scannedReader
   ui.comboBoxSerial.clear()
   if ports:
     for port in ports:
-      ui.comboBoxSerial.addItem(port.device, port.device)
+      ui.comboBoxSerial.addItem(port, port)
   else:
     ui.comboBoxSerial.addItem('None')
 
+  ui.buttonScan.setEnabled(True)
+  ui.statusbar.clearMessage()
+
+  item = 0
+  scannedReader = (readerPort or None, readerInfo)
+  if readerPort:
+    log('Found reader on ' + readerPort + ', ' + str(readerInfo))
+    item = ui.comboBoxSerial.findData(readerPort)
+  ui.comboBoxSerial.setCurrentIndex(item)
+  serialPortSelect(item)
+
 
 def serialPortSelect(item):
+  # The scanner already asked the reader, other ports are asked by the worker
   port = ui.comboBoxSerial.itemData(item)
-  rc.setSerialPort(port)
+  info = scannedReader[1] if port == scannedReader[0] else None
+  worker.portRequested.emit(port, info)
 
-def update():
-  rc.update()
-  debugLog('tick')
+#//////////////////////////////////////////////////////////////////////////////
+# Dump progress
+#//////////////////////////////////////////////////////////////////////////////
+def dumpProgress(bytesDone, bytesTotal, throughput):
+  ui.statusbar.showMessage('{} / {} bytes ({:.1f} kB/s)'.format(
+    bytesDone, bytesTotal, throughput / 1000))
+
+
+def dumpFinished(success):
+  if not success:
+    ui.statusbar.showMessage('ROM dump failed')
+  unlockGui()
 
 #//////////////////////////////////////////////////////////////////////////////
 # GUI Lock
@@ -121,6 +159,52 @@ def lock(locked):
   ui.buttonDump.setEnabled(enabled)
   ui.groupBox.setEnabled(enabled)
 
+#//////////////////////////////////////////////////////////////////////////////
+# Start up
+#//////////////////////////////////////////////////////////////////////////////
+def setUpRomClient():
+  """ Import and set up the ROM client. Runs from the event loop, after the
+  window has been shown. """
+  global rc, worker, dumpThread
+  from dumpworker import DumpWorker
+  from romclient import RomClient, BankSwitchMethod
+
+  # Set up the dump worker. Signals emitted from the worker thread are
+  # queued to the GUI thread, so RomClient never touches widgets directly.
+  worker = DumpWorker()
+  worker.logMessage.connect(rcLog)
+  worker.debugMessage.connect(rcDebugLog)
+  worker.started.connect(lockGui)
+  worker.progress.connect(dumpProgress)
+  worker.finished.connect(dumpFinished)
+
+  # Set up romclient
+  rc = RomClient(None, worker.log, worker.debugLog)
+  worker.setRomClient(rc)
+  rc.setSerialReadTimeout(kSerialTimeoutS)
+  rc.setBankSwitchMethod(BankSwitchMethod.AUTO)
+  rc.setLaunchEmulatorEnabled(ui.actionAuto_Launch.isChecked())
+
+  dumpThread = QThread()
+  worker.moveToThread(dumpThread)
+  dumpThread.start()
+  app.aboutToQuit.connect(stopDumpThread)
+
+  ui.buttonDump.pressed.connect(worker.dump)
+  #TODO add stop dump button
+
+  unlockGui()
+  serialPortScan()
+
+  if '--startup-time' in sys.argv:
+    print('{:.6f}'.format(time.perf_counter() - _startTime))
+    app.quit()
+
+def stopDumpThread():
+  """ Let a dump in progress finish before the application exits """
+  dumpThread.quit()
+  dumpThread.wait()
+
 #//////////////////////////////////////////////////////////////////////////////
 # Main
 #//////////////////////////////////////////////////////////////////////////////
@@ -137,20 +221,13 @@ if __name__ == "__main__":
   ui.actionDebug.toggled.connect(handleDebugOption)
   ui.actionAuto_Launch.toggled.connect(handleAutoLaunch)
 
-  # Set up romclient
-  rc = RomClient(None, rcLog, rcDebugLog, lockGui, unlockGui)
-  serialPortScan()
-  serialPortSelect(0)
-  rc.setSerialReadTimeout(kSerialTimeoutS)
-  rc.setTimeoutTicks(kReadTimeoutTicks)
-
-  ui.buttonDump.pressed.connect(rc.startDump)
-  #TODO add stop dump button
+  portScanner = PortScanner()
+  portScanner.finished.connect(serialPortScanDone)
 
-  updateTimer = QTimer()
-  updateTimer.timeout.connect(update)
-  updateTimer.start(kUpdateTimerInterval)
+  # Show the window right away, the ROM client is set up once it is painted
+  lockGui()
+  MainWindow.show()
+  QtCore.QTimer.singleShot(0, setUpRomClient)
 
   # Start GUI application
-  MainWindow.show()
   sys.exit(app.exec_())
@@ -0,0 +1,160 @@
+""" Database of known ROM images
+
+Entries come from DAT files (Logiqx XML, as used by No-Intro and others)
+and from ROM files. DAT files only hold the hashes of complete images.
+Entries that were made from ROM files also hold the CRC32 of their
+prefixes, see RomDigest.checkpoints, so a dump can be matched while it is
+still being read. The database is stored as JSON.
+"""
+
+import json
+import os
+import tempfile
+import xml.etree.ElementTree as ElementTree
+
+from romcache import getCachePath
+from romdigest import RomDigest
+
+#///////////////////////////////////////////////////////////////////////////////
+# Classes
+#///////////////////////////////////////////////////////////////////////////////
+class RomEntry():
+  """ Known ROM image
+
+  Attributes:
+    name      Title of the ROM.
+    size      Size in bytes.
+    crc32     Hex digests, lower case. Any of them can be None.
+    md5
+    sha1
+    prefixes  Dictionary of prefix length to CRC32 of that prefix.
+  """
+  def __init__(self, name, size, crc32 = None, md5 = None, sha1 = None, prefixes = None):
+    self.name = name
+    self.size = size
+    self.crc32 = crc32.lower() if crc32 else None
+    self.md5 = md5.lower() if md5 else None
+    self.sha1 = sha1.lower() if sha1 else None
+    self.prefixes = dict(prefixes or {})
+
+  def toDict(self):
+    return {
+      'name': self.name, 'size': self.size,
+      'crc32': self.crc32, 'md5': self.md5, 'sha1': self.sha1,
+      'prefixes': dict((str(length), crc) for length, crc in self.prefixes.items()),
+    }
+
+  @classmethod
+  def fromDict(cls, values):
+    prefixes = dict((int(length), crc) for length, crc in values.get('prefixes', {}).items())
+    return cls(values['name'], values['size'], values.get('crc32'),
+               values.get('md5'), values.get('sha1'), prefixes)
+
+
+class RomDatabase():
+  """ Indexed collection of RomEntry objects """
+  _kDefaultName = 'romdb.json'
+
+  def __init__(self, path = None):
+    """
+    :param path: JSON file to load, if it exists. Defaults to romdb.json in the cache directory.
+    """
+    self.path = path or getCachePath(self._kDefaultName)
+    self.entries = []
+    self._bySha1 = {}
+    self._byMd5 = {}
+    self._byCrc = {}
+    self._byPrefix = {}
+    self._load()
+
+  def add(self, entry):
+    """ Add an entry. An entry with the SHA-1 of a known entry only adds its
+    prefixes to that entry, so importing a file twice does not duplicate it.
+    Entries without SHA-1 are matched by size and CRC32 instead.
+    :type entry: RomEntry
+    :return: The new entry or the known entry
+    :rtype: RomEntry """
+    if entry.sha1:
+      known = self._bySha1.get(entry.sha1)
+    else:
+      known = self._byCrc.get((entry.size, entry.crc32)) if entry.crc32 else None
+    if known is not None:
+      for length, crc in entry.prefixes.items():
+        if length not in known.prefixes:
+          known.prefixes[length] = crc
+          self._byPrefix.setdefault((length, crc), []).append(known)
+      return known
+
+    self.entries.append(entry)
+    if entry.sha1:
+      self._bySha1[entry.sha1] = entry
+    if entry.md5:
+      self._byMd5[entry.md5] = entry
+    if entry.crc32:
+      self._byCrc[(entry.size, entry.crc32)] = entry
+    for length, crc in entry.prefixes.items():
+      self._byPrefix.setdefault((length, crc), []).append(entry)
+    return entry
+
+  def addRom(self, name, data):
+    """ Add a ROM image, including its prefix checksums
+    :rtype: RomEntry """
+    digest = RomDigest.fromData(data)
+    entry = RomEntry(name, len(data), digest.getCrc32(), digest.getMd5(),
+                     digest.getSha1(), digest.checkpoints)
+    return self.add(entry)
+
+  def addRomFile(self, path):
+    with open(path, 'rb') as f:
+      return self.addRom(os.path.basename(path), f.read())
+
+  def addDatFile(self, path):
+    """ Add the ROMs of a Logiqx XML DAT file
+    :return: Number of new entries
+    :rtype: int """
+    count = 0
+    for game in ElementTree.parse(path).getroot().iter('game'):
+      for rom in game.iter('rom'):
+        entry = RomEntry(rom.get('name') or game.get('name'), int(rom.get('size', 0)),
+                         rom.get('crc'), rom.get('md5'), rom.get('sha1'))
+        count += self.add(entry) is entry
+    return count
+
+  def identify(self, digest):
+    """ Look up a complete image
+    :type digest: RomDigest
+    :return: Matching entry or None
+    :rtype: RomEntry """
+    entry = self._bySha1.get(digest.getSha1()) or self._byMd5.get(digest.getMd5())
+    return entry or self._byCrc.get((digest.size, digest.getCrc32()))
+
+  def hasPrefixes(self):
+    return bool(self._byPrefix)
+
+  def matchPrefix(self, length, crc):
+    """ :return: Entries whose first length bytes have the given CRC32
+    :rtype: list """
+    return list(self._byPrefix.get((length, crc), ()))
+
+  def save(self, path = None):
+    path = path or self.path
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmpPath = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+      with os.fdopen(fd, 'w') as f:
+        json.dump({'roms': [entry.toDict() for entry in self.entries]}, f, indent=1, sort_keys=True)
+      os.replace(tmpPath, path)
+    except Exception:
+      if os.path.exists(tmpPath):
+        os.remove(tmpPath)
+      raise
+
+  def _load(self):
+    try:
+      with open(self.path) as f:
+        values = json.load(f)
+    except (IOError, OSError, ValueError):
+      return
+    for entry in values.get('roms', []):
+      self.add(RomEntry.fromDict(entry))
@@ -0,0 +1,95 @@
+""" Incremental ROM image digests """
+
+import hashlib
+import zlib
+
+#-------------------------------------------------------------------------------
+class RomDigest():
+  """ CRC32, MD5 and SHA-1 of a ROM image that is hashed while it is read.
+
+  Blocks may complete in any order. The image is hashed up to the end of
+  the contiguous completed prefix, so every byte is hashed once as soon as
+  all bytes before it are known. The CRC32 of the prefix is recorded at
+  every power of two from _kFirstCheckpoint, for early identification.
+
+  Attributes:
+    size        Image size in bytes.
+    length      Length of the prefix that has been hashed.
+    checkpoints Dictionary of prefix length to CRC32 of that prefix.
+  """
+  _kFirstCheckpoint = 256
+
+  def __init__(self, size):
+    self.size = size
+    self.length = 0
+    self.checkpoints = {}
+    self._pending = {}      # start: end of completed ranges after the prefix
+    self._crc = 0
+    self._md5 = hashlib.md5()
+    self._sha1 = hashlib.sha1()
+    self._nextCheckpoint = self._kFirstCheckpoint
+
+  @classmethod
+  def fromData(cls, data):
+    """ Digest of a complete image
+    :rtype: RomDigest """
+    return cls(len(data)).finish(data)
+
+  def update(self, data, start, end):
+    """ Mark a range of the image as completed.
+    :param data: The complete image buffer, the range must already be stored.
+    :return: (length, crc) of every checkpoint the prefix passed
+    :rtype: list """
+    if end <= self.length:
+      return []
+    if start > self.length:
+      self._pending[start] = max(end, self._pending.get(start, end))
+      return []
+
+    reached = self._advance(data, end)
+    joined = True
+    while joined:
+      joined = [s for s in self._pending if s <= self.length]
+      for s in joined:
+        reached += self._advance(data, self._pending.pop(s))
+    return reached
+
+  def finish(self, data):
+    """ Hash the rest of the image, including ranges that were never completed """
+    self._pending = {}
+    self._advance(data, self.size)
+    return self
+
+  def isComplete(self):
+    return self.length >= self.size
+
+  def getCrc32(self):
+    """ :return: CRC32 as 8 hex digits
+    :rtype: str """
+    return '{:08x}'.format(self._crc)
+
+  def getMd5(self):
+    return self._md5.hexdigest()
+
+  def getSha1(self):
+    return self._sha1.hexdigest()
+
+  def toDict(self):
+    return {'size': self.size, 'crc32': self.getCrc32(), 'md5': self.getMd5(), 'sha1': self.getSha1()}
+
+  def _advance(self, data, end):
+    reached = []
+    with memoryview(data) as view:
+      while self.length < end:
+        stop = min(end, self._nextCheckpoint)
+        chunk = view[self.length:stop]
+        self._crc = zlib.crc32(chunk, self._crc)
+        self._md5.update(chunk)
+        self._sha1.update(chunk)
+        chunk.release()
+        self.length = stop
+        if stop == self._nextCheckpoint:
+          self.checkpoints[stop] = self._crc
+          reached.append((stop, self._crc))
+          self._nextCheckpoint *= 2
+    return reached
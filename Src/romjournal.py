@@ -0,0 +1,126 @@
+""" Block completion journal for resumable dumps """
+
+import hashlib
+import json
+import os
+
+#-------------------------------------------------------------------------------
+class DumpJournal():
+  """ On-disk record of the parts of a ROM image that have been read.
+
+  Two files are kept per reader and bankswitching method:
+    <path>.journal  A JSON header line, then one "offset length" line per
+                    completed range. Lines are only appended, so a dump that
+                    is cut off loses at most the range that was being written.
+    <path>.image    The image data of the completed ranges.
+
+  The header holds the image size and a fingerprint of the first block of
+  the cartridge. A journal with a different header belongs to another
+  cartridge and is discarded.
+  """
+
+  _kVersion = 1
+
+  def __init__(self, path, size, fingerprint):
+    """ Open the journal at path, resuming it if it matches size and fingerprint. """
+    self.path = path
+    self.size = size
+    self.fingerprint = fingerprint
+    self.completed = bytearray(size)
+    self._journalFile = None
+    self._imageFile = None
+
+    directory = os.path.dirname(path)
+    if directory:
+      os.makedirs(directory, exist_ok=True)
+
+    if not self._load():
+      self._create()
+
+  def isResumed(self):
+    """ :return: True if earlier progress was found
+    :rtype: bool """
+    return self.completed.count(1) > 0
+
+  def getCompletedLength(self):
+    return self.completed.count(1)
+
+  def getMissingMask(self):
+    """ :return: One byte per image offset, 1 where the data is still missing
+    :rtype: bytearray """
+    return self.completed.translate(_kInvert)
+
+  def readImage(self):
+    """ :return: Image data, zero where nothing has been read yet
+    :rtype: bytes """
+    self._imageFile.seek(0)
+    return self._imageFile.read(self.size)
+
+  def record(self, offset, data):
+    """ Store a completed range. The data is written before the journal line
+    so a journal line always refers to data that is on disk. """
+    length = len(data)
+    self._imageFile.seek(offset)
+    self._imageFile.write(data)
+    self._imageFile.flush()
+    self._journalFile.write('{} {}\n'.format(offset, length))
+    self._journalFile.flush()
+    self.completed[offset:offset + length] = b'\x01' * length
+
+  def close(self):
+    for f in (self._journalFile, self._imageFile):
+      if f is not None:
+        f.close()
+    self._journalFile = None
+    self._imageFile = None
+
+  def remove(self):
+    """ Close and delete the journal, e.g. after a complete dump """
+    self.close()
+    for name in (self.path + '.journal', self.path + '.image'):
+      if os.path.exists(name):
+        os.remove(name)
+
+  def _header(self):
+    return {'version': self._kVersion, 'size': self.size, 'fingerprint': self.fingerprint}
+
+  def _load(self):
+    journalPath = self.path + '.journal'
+    try:
+      with open(journalPath, 'rb') as f:
+        content = f.read()
+      lines = content.split(b'\n')
+      if json.loads(lines[0].decode('ascii')) != self._header():
+        return False
+
+      # The last element is empty, or a line cut off in the middle of a write
+      for line in lines[1:-1]:
+        offset, length = (int(field) for field in line.split())
+        self.completed[offset:offset + length] = b'\x01' * length
+
+      if lines[-1]:
+        with open(journalPath, 'r+b') as f:
+          f.truncate(len(content) - len(lines[-1]))
+      self._journalFile = open(journalPath, 'a')
+      self._imageFile = open(self.path + '.image', 'r+b')
+      return True
+    except (IOError, OSError, ValueError):
+      self.completed = bytearray(self.size)
+      return False
+
+  def _create(self):
+    self.close()
+    self._journalFile = open(self.path + '.journal', 'w')
+    self._journalFile.write(json.dumps(self._header(), sort_keys=True) + '\n')
+    self._journalFile.flush()
+    self._imageFile = open(self.path + '.image', 'w+b')
+    self._imageFile.truncate(self.size)
+
+
+def fingerprint(data):
+  """ Fingerprint of the first block of a cartridge
+  :rtype: str """
+  return hashlib.sha1(bytes(data)).hexdigest()
+
+
+_kInvert = bytes(1 if i == 0 else 0 for i in range(256))
@@ -0,0 +1,237 @@
+""" Concurrent ROM dumping on several readers """
+
+import os
+import queue
+import threading
+import time
+
+from romclient import *
+
+#///////////////////////////////////////////////////////////////////////////////
+# Classes
+#///////////////////////////////////////////////////////////////////////////////
+class DumpJob():
+  """ One ROM dump to be done by the pool
+
+  Attributes:
+    path              File to save the ROM to.
+    bankSwitchMethod  Bankswitching method of the cartridge.
+    port              Port of the reader that must do the dump, or None for any reader.
+  """
+  def __init__(self, path, bankSwitchMethod = BankSwitchMethod.AUTO, port = None):
+    self.path = path
+    self.bankSwitchMethod = bankSwitchMethod
+    self.port = port
+
+
+class DumpResult():
+  """ Outcome of a DumpJob
+
+  Attributes:
+    job       The job.
+    port      Port of the reader that did the dump.
+    success   True if the ROM was dumped and saved.
+    length    Number of bytes received.
+    elapsed   Dump time in seconds.
+    error     Error message if the dump failed.
+  """
+  def __init__(self, job, port, success, length, elapsed, error = ''):
+    self.job = job
+    self.port = port
+    self.success = success
+    self.length = length
+    self.elapsed = elapsed
+    self.error = error
+
+  def getThroughput(self):
+    """ :return: Throughput in bytes per second
+    :rtype: float """
+    if self.elapsed <= 0:
+      return 0.0
+    return self.length / self.elapsed
+
+
+class RomClientPool():
+  """ Dump cartridges on several readers at the same time.
+
+  Every reader gets its own RomClient and worker thread. Workers take jobs
+  for their own port first and then jobs from the shared queue, so a job
+  without a port goes to whichever reader is free.
+  """
+
+  _kPollInterval = 0.1 # s
+
+  def __init__(self, ports = None, log = print, readTimeout = 1):
+    """
+    :param ports: Serial ports to use. None to use every reader that is found.
+    :param log: Log callback, called from the worker threads.
+    :param readTimeout: Serial read timeout in seconds.
+    """
+    self.log = log
+    self.readTimeout = readTimeout
+    self.clients = {}
+    self.results = []
+
+    self._jobs = queue.Queue()
+    self._portJobs = {}
+    self._resultsLock = threading.Lock()
+    self._threads = []
+    self._stop = threading.Event()
+    self._startTime = None
+    self._endTime = None
+
+    if ports is None:
+      from fwdiscovery import ReaderDiscovery
+      ports = [reader.port for reader in ReaderDiscovery().discover()]
+    for port in ports:
+      self._openClient(port)
+
+  def getPorts(self):
+    return list(self.clients.keys())
+
+  def submit(self, job):
+    """ Queue a dump job
+    :type job: DumpJob """
+    if job.port is None:
+      self._jobs.put(job)
+    elif job.port in self._portJobs:
+      self._portJobs[job.port].put(job)
+    else:
+      raise ValueError('No reader on port ' + str(job.port))
+
+  def dumpAll(self, pathPattern, bankSwitchMethod = BankSwitchMethod.AUTO):
+    """ Queue one dump on every reader.
+    :param pathPattern: File name pattern. {port} is replaced by the port name.
+    :return: Results of all jobs
+    :rtype: list """
+    for port in self.getPorts():
+      name = os.path.basename(port)
+      self.submit(DumpJob(pathPattern.format(port=name), bankSwitchMethod, port))
+    return self.run()
+
+  def run(self):
+    """ Run queued jobs on all readers concurrently and wait until every job is done.
+    :return: Results of all jobs
+    :rtype: list """
+    self._stop.clear()
+    self._startTime = time.perf_counter()
+    self._threads = [threading.Thread(target=self._worker, args=(port,), daemon=True)
+                     for port in self.clients]
+    for t in self._threads:
+      t.start()
+
+    if not self._threads:
+      # No reader could be opened, nothing would ever take these jobs
+      self._failQueuedJobs(self._jobs, 'No reader')
+    self._jobs.join()
+    for q in self._portJobs.values():
+      q.join()
+    self._stop.set()
+    for t in self._threads:
+      t.join()
+    self._endTime = time.perf_counter()
+
+    return self.results
+
+  def getResults(self, port = None):
+    """ :param port: Only return results of this port.
+    :rtype: list """
+    with self._resultsLock:
+      return [r for r in self.results if port is None or r.port == port]
+
+  def getThroughput(self):
+    """ Aggregate throughput of all readers over the last run.
+    :return: Bytes per second
+    :rtype: float """
+    if self._startTime is None:
+      return 0.0
+    end = self._endTime if self._endTime is not None else time.perf_counter()
+    elapsed = end - self._startTime
+    if elapsed <= 0:
+      return 0.0
+    return sum(r.length for r in self.getResults()) / elapsed
+
+  def close(self):
+    for rc in self.clients.values():
+      rc.fw.close()
+
+#///////////////////////////////////////////////////////////////////////////////
+# Private Methods
+#///////////////////////////////////////////////////////////////////////////////
+  def _openClient(self, port):
+    def portLog(message):
+      self.log(port + ' : ' + message)
+
+    rc = RomClient(None, portLog, lambda message: None)
+    rc.setSerialReadTimeout(self.readTimeout)
+    if rc.setSerialPort(port):
+      self._addClient(port, rc)
+
+  def _addClient(self, port, rc):
+    # Readers must not share the temporary dump file
+    rc.setTemporaryFilePath('.tmp.' + os.path.basename(port) + '.a26')
+    self.clients[port] = rc
+    self._portJobs[port] = queue.Queue()
+
+  def _nextJob(self, port):
+    """ :return: job, queue it was taken from. None, None if no job is waiting. """
+    for q in (self._portJobs[port], self._jobs):
+      try:
+        return q.get_nowait(), q
+      except queue.Empty:
+        pass
+    return None, None
+
+  def _worker(self, port):
+    rc = self.clients[port]
+    while not self._stop.is_set():
+      job, q = self._nextJob(port)
+      if job is None:
+        time.sleep(self._kPollInterval)
+        continue
+
+      try:
+        self._addResult(self._runJob(rc, port, job))
+      except Exception as e:
+        self._addResult(DumpResult(job, port, False, 0, 0.0, str(e) or type(e).__name__))
+      finally:
+        q.task_done()
+
+  def _runJob(self, rc, port, job):
+    """ Run one job. Every error is recorded as a failed result, so the
+    worker keeps draining its queues and run() does not wait forever.
+    :rtype: DumpResult """
+    start = time.perf_counter()
+    error = ''
+    success = False
+    try:
+      rc.setBankSwitchMethod(job.bankSwitchMethod)
+      # The image is streamed into the file while it is read
+      rc.setOutputFile(job.path)
+      if rc.runDump():
+        success = rc.getLastFileName() == job.path
+        if not success:
+          error = 'Could not write to file'
+      else:
+        error = 'ROM dump failed'
+    except Exception as e:
+      rc.abortDump()
+      error = str(e) or type(e).__name__
+    finally:
+      rc.setOutputFile(None)
+
+    return DumpResult(job, port, success, rc.dataLength, time.perf_counter() - start, error)
+
+  def _failQueuedJobs(self, q, error):
+    """ Record every job that is waiting in a queue as failed """
+    while True:
+      try:
+        job = q.get_nowait()
+      except queue.Empty:
+        return
+      self._addResult(DumpResult(job, None, False, 0, 0.0, error))
+      q.task_done()
+
+  def _addResult(self, result):
+    with self._resultsLock:
+      self.results.append(result)
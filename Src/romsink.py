@@ -0,0 +1,81 @@
+""" Streaming ROM image output """
+
+import mmap
+import os
+
+#-------------------------------------------------------------------------------
+class RomFileSink():
+  """ ROM image file that is written while the dump is in progress.
+
+  The file is created next to the target as <path>.part, preallocated to
+  the image size and memory mapped. Block payloads are copied straight into
+  the mapping at their image offset. commit() flushes and fsyncs the file,
+  closes it and renames it over the target, so the target is either the old
+  file or the complete new image, never a partial dump.
+
+  Attributes:
+    path  Target file.
+    size  Image size in bytes.
+    data  Writable memory mapping of the image.
+  """
+
+  def __init__(self, path, size):
+    self.path = path
+    self.size = size
+    self.partPath = path + '.part'
+    self.data = None
+    self._fd = os.open(self.partPath, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+      os.ftruncate(self._fd, size)
+      if size:
+        self.data = mmap.mmap(self._fd, size)
+      else:
+        self.data = bytearray()
+    except (IOError, OSError):
+      os.close(self._fd)
+      os.remove(self.partPath)
+      raise
+
+  def flush(self):
+    """ Write changes in the mapping to disk """
+    if isinstance(self.data, mmap.mmap):
+      self.data.flush()
+    os.fsync(self._fd)
+
+  def commit(self):
+    """ Make the image durable and move it to the target path. The mapping
+    and the file are closed first, an open file cannot be renamed on
+    Windows. Copy data before if it is still needed. """
+    self.flush()
+    self.close()
+    os.replace(self.partPath, self.path)
+    _fsyncDirectory(os.path.dirname(os.path.abspath(self.path)))
+    self.partPath = None
+
+  def abort(self):
+    """ Discard the partial image """
+    self.close()
+    if self.partPath is not None and os.path.exists(self.partPath):
+      os.remove(self.partPath)
+    self.partPath = None
+
+  def close(self):
+    if isinstance(self.data, mmap.mmap) and not self.data.closed:
+      self.data.close()
+    if self._fd is not None:
+      os.close(self._fd)
+      self._fd = None
+
+
+def _fsyncDirectory(directory):
+  """ Persist a rename. Not supported on every platform, so errors are ignored. """
+  try:
+    fd = os.open(directory, os.O_RDONLY)
+  except OSError:
+    return
+  try:
+    os.fsync(fd)
+  except OSError:
+    pass
+  finally:
+    os.close(fd)
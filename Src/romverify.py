@@ -0,0 +1,101 @@
+""" Multi-pass verified dumping
+
+Passes are compared as NumPy arrays. Two identical passes end the
+verification early, otherwise every byte is resolved by majority vote.
+Requires NumPy.
+"""
+
+import numpy
+
+#///////////////////////////////////////////////////////////////////////////////
+# Classes
+#///////////////////////////////////////////////////////////////////////////////
+class VerifyResult():
+  """ Outcome of a verified dump
+
+  Attributes:
+    image       Resolved ROM image.
+    passes      Number of passes that were read.
+    agreed      True if two passes were identical.
+    instability Per image offset, the number of passes that disagree with the image.
+  """
+  def __init__(self, image, passes, agreed, instability):
+    self.image = image
+    self.passes = passes
+    self.agreed = agreed
+    self.instability = instability
+
+  def getUnstableOffsets(self):
+    """ :return: Image offsets where at least one pass disagreed
+    :rtype: numpy.ndarray """
+    return numpy.flatnonzero(self.instability)
+
+  def isStable(self):
+    return not self.instability.any()
+
+
+class DumpVerifier():
+  """ Collects passes of the same ROM and resolves them """
+
+  def __init__(self, maxPasses = 3):
+    """
+    :param maxPasses: Stop after this many passes even if no two passes agree.
+    """
+    self.maxPasses = max(2, maxPasses)
+    self._passes = []
+    self._agreed = None
+
+  def addPass(self, data):
+    """ Add a pass. Bytes that were not read again must be copied from an earlier pass.
+    :type data: bytes-like """
+    current = numpy.frombuffer(bytes(data), dtype=numpy.uint8)
+    for previous in self._passes:
+      if numpy.array_equal(previous, current):
+        self._agreed = current
+        break
+    self._passes.append(current)
+
+  def getPassCount(self):
+    return len(self._passes)
+
+  def done(self):
+    """ :return: True if two passes agree or the maximum number of passes is reached
+    :rtype: bool """
+    return self._agreed is not None or len(self._passes) >= self.maxPasses
+
+  def getUnstableMask(self):
+    """ Offsets where the passes so far differ. Only these need to be read again.
+    :return: Boolean array or None if fewer than two passes were read
+    :rtype: numpy.ndarray """
+    if len(self._passes) < 2:
+      return None
+    passes = numpy.stack(self._passes)
+    return (passes != passes[0]).any(axis=0)
+
+  def getResult(self):
+    """ Resolve the passes
+    :rtype: VerifyResult """
+    passes = numpy.stack(self._passes)
+
+    if self._agreed is not None:
+      image = self._agreed
+    else:
+      image = majorityVote(passes)
+
+    instability = (passes != image).sum(axis=0).astype(numpy.uint8)
+    return VerifyResult(image.tobytes(), len(self._passes), self._agreed is not None, instability)
+
+
+#///////////////////////////////////////////////////////////////////////////////
+# Functions
+#///////////////////////////////////////////////////////////////////////////////
+def majorityVote(passes):
+  """ Resolve every byte to the value that most passes agree on.
+  Ties are resolved in favour of the earliest pass.
+  :param passes: Array of shape (passes, size).
+  :type passes: numpy.ndarray
+  :rtype: numpy.ndarray """
+  # votes[i, x] is the number of passes that agree with pass i at offset x
+  votes = (passes[:, None, :] == passes[None, :, :]).sum(axis=1)
+  winner = votes.argmax(axis=0)
+  return passes[winner, numpy.arange(passes.shape[1])]
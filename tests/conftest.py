@@ -0,0 +1,53 @@
+""" Shared fixtures. The modules in Src import each other by name, so Src
+is put on the path. Every test gets its own cache directory. """
+
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Src'))
+
+from romclient import *
+from fwsim import *
+
+
+@pytest.fixture(autouse=True)
+def cacheDirectory(tmp_path, monkeypatch):
+  directory = tmp_path / 'cache'
+  monkeypatch.setenv('ROMCLIENT_CACHE_DIR', str(directory))
+  return directory
+
+
+@pytest.fixture
+def makeRom():
+  """ Random ROM image of a bankswitching method. Bytes that no plan can
+  read, like cartridge RAM, are zero as in a dump. """
+  def make(method, seed = 0, size = None):
+    scheme = getBankScheme(method)
+    rng = random.Random(seed)
+    rom = bytearray(rng.getrandbits(8) for _ in range(size or scheme.size))
+    covered = bytearray(len(rom))
+    for step in scheme.createPlan(size).steps:
+      if step.offset is not None:
+        covered[step.offset:step.offset + step.length] = b'\x01' * step.length
+    for offset in range(len(rom)):
+      if not covered[offset]:
+        rom[offset] = 0
+    return bytes(rom)
+  return make
+
+
+@pytest.fixture
+def makeClient(tmp_path):
+  """ RomClient on a simulated reader """
+  def make(rom, method, simulator = None, readTimeout = 0.5, **link):
+    simulator = simulator or FirmwareSimulator(SimCartridge(rom, method))
+    sim = SimSerial(simulator, **link)
+    rc = RomClient(None, lambda message: None, lambda message: None)
+    rc.fw.attach(sim, readTimeout)
+    rc.setBankSwitchMethod(method)
+    rc.setTemporaryFilePath(str(tmp_path / 'tmp.a26'))
+    return rc
+  return make
@@ -0,0 +1,90 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+from romclient import *
+from fwsim import *
+
+pytestmark = pytest.mark.skipif(sys.platform == 'win32', reason='needs a pseudo terminal')
+
+
+def _dump(rc, simulator, **serial):
+  from asyncfwlink import AsyncFwLink
+
+  async def run():
+    link = AsyncFwLink()
+    assert await link.open(server.getPort(), 0.5)
+    try:
+      return await rc.dump(link)
+    finally:
+      link.close()
+
+  server = PtySimulator(SimSerial(simulator, **serial))
+  try:
+    return asyncio.run(run())
+  finally:
+    server.close()
+
+
+@pytest.mark.parametrize('method', (BankSwitchMethod.NONE, BankSwitchMethod.F8, BankSwitchMethod.E0))
+def test_dump(method, makeRom, makeClient):
+  rom = makeRom(method)
+  rc = makeClient(rom, method)
+  assert _dump(rc, FirmwareSimulator(SimCartridge(rom, method)))
+  assert bytes(rc.romData) == rom
+
+
+def test_read_blocks_and_batches():
+  from asyncfwlink import AsyncFwLink
+  rom = os.urandom(4096)
+
+  async def run():
+    link = AsyncFwLink()
+    assert await link.open(server.getPort(), 0.5)
+    try:
+      link.setPipelineDepth(4)
+      replies = await link.readBlocks(0x1000, 256, 16)
+      assert b''.join(bytes(reply.getData()) for reply in replies) == rom
+      requests = [Fw_Packet(Fw_Command.READ_SINGLE, address=0x1000 + i) for i in range(8)]
+      replies = await link.transceiveBatch(requests)
+      assert bytes(reply.getData()[0] for reply in replies) == rom[:8]
+    finally:
+      link.close()
+
+  server = PtySimulator(SimSerial(FirmwareSimulator(SimCartridge(rom))))
+  try:
+    asyncio.run(run())
+  finally:
+    server.close()
+
+
+def test_dump_retries_on_noisy_link(makeRom, makeClient):
+  method = BankSwitchMethod.F8
+  rom = makeRom(method)
+  rc = makeClient(rom, method)
+  rc.setRetryPolicy(RetryPolicy(attempts=20, backoff=0))
+  assert _dump(rc, FirmwareSimulator(SimCartridge(rom, method)), corruptionRate=0.05, seed=3)
+  assert bytes(rc.romData) == rom
+  assert rc.getMetrics().counters['retries'] > 0
+
+
+def test_dump_detects_method(makeRom, makeClient):
+  pytest.importorskip('numpy')
+  from test_bankdetect import _addBankSwitchingCode
+  method = BankSwitchMethod.F8
+  rom = _addBankSwitchingCode(makeRom(method), (0x1FF8, 0x1FF9), (0x100, 0x1100))
+  rc = makeClient(rom, BankSwitchMethod.AUTO)
+  assert _dump(rc, FirmwareSimulator(SimCartridge(rom, method)))
+  assert rc.getDetectedBankSwitchMethod() == method
+  assert bytes(rc.romData) == rom
+
+
+def test_auto_without_numpy(makeRom, makeClient, monkeypatch):
+  monkeypatch.setitem(sys.modules, 'numpy', None)
+  rom = makeRom(BankSwitchMethod.NONE)
+  rc = makeClient(rom, BankSwitchMethod.AUTO)
+  assert _dump(rc, FirmwareSimulator(SimCartridge(rom)))
+  assert rc.getDetectedBankSwitchMethod() == BankSwitchMethod.NONE
+  assert bytes(rc.romData) == rom
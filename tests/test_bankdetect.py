@@ -0,0 +1,54 @@
+import sys
+
+import pytest
+
+from romclient import *
+from fwsim import *
+
+
+def _addBankSwitchingCode(rom, hotspots, offsets):
+  """ Put LDA/STA accesses to hotspots at offsets of a ROM image
+  :rtype: bytes """
+  rom = bytearray(rom)
+  for offset in offsets:
+    for i, hotspot in enumerate(hotspots):
+      start = offset + 0x40 * i
+      rom[start:start + 3] = bytes((0xAD if i % 2 else 0x8D, hotspot & 0xFF, hotspot >> 8))
+  return bytes(rom)
+
+
+def _simulator(rom, method):
+  return FirmwareSimulator(SimCartridge(rom, method))
+
+
+@pytest.mark.parametrize('method, hotspots, offsets', (
+  # Every bank switches, so the scan finds the code whatever bank is selected
+  (BankSwitchMethod.F8, (0x1FF8, 0x1FF9), (0x100, 0x1100)),
+  (BankSwitchMethod.F6, (0x1FF6, 0x1FF7, 0x1FF8, 0x1FF9), (0x100, 0x1100, 0x2100, 0x3100)),
+  # E0 code switches from the fixed bank 7
+  (BankSwitchMethod.E0, (0x1FE0, 0x1FE9, 0x1FF2), (0x1D00,)),
+))
+def test_detection(method, hotspots, offsets, makeRom, makeClient):
+  pytest.importorskip('numpy')
+  rom = _addBankSwitchingCode(makeRom(method), hotspots, offsets)
+  rc = makeClient(rom, BankSwitchMethod.AUTO, _simulator(rom, method))
+  assert rc.detectBankSwitchMethod() == method
+  assert rc.runDump()
+  assert rc.getDetectedBankSwitchMethod() == method
+  assert bytes(rc.romData) == rom
+
+
+def test_detection_without_hotspot_accesses(makeRom, makeClient):
+  pytest.importorskip('numpy')
+  rom = makeRom(BankSwitchMethod.NONE, seed=7)
+  rc = makeClient(rom, BankSwitchMethod.AUTO, _simulator(rom, BankSwitchMethod.NONE))
+  assert rc.detectBankSwitchMethod() == BankSwitchMethod.NONE
+
+
+def test_auto_without_numpy(makeRom, makeClient, monkeypatch):
+  monkeypatch.setitem(sys.modules, 'numpy', None)
+  rom = makeRom(BankSwitchMethod.NONE)
+  rc = makeClient(rom, BankSwitchMethod.AUTO, _simulator(rom, BankSwitchMethod.NONE))
+  assert rc.runDump()
+  assert rc.getDetectedBankSwitchMethod() == BankSwitchMethod.NONE
+  assert bytes(rc.romData) == rom
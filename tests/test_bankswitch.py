@@ -0,0 +1,80 @@
+import pytest
+
+from bankswitch import *
+from blocktune import BlockSizeTuner
+from delaytune import ReadDelayTuner
+from fwsim import SimCartridge
+
+_kMethods = (BankSwitchMethod.NONE, BankSwitchMethod.F8, BankSwitchMethod.F6,
+             BankSwitchMethod.FA, BankSwitchMethod.E0, BankSwitchMethod.E7)
+
+
+def _runPlan(plan, cartridge):
+  image = bytearray(plan.size)
+  for step in plan.steps:
+    if isinstance(step, HotspotAccess):
+      value = cartridge.read(step.address)
+      if step.offset is not None:
+        image[step.offset] = value
+    else:
+      image[step.offset:step.offset + step.length] = bytes(
+        cartridge.read(step.address + i) for i in range(step.length))
+  return bytes(image)
+
+
+@pytest.mark.parametrize('method', _kMethods)
+def test_plan_reads_every_byte(method, makeRom):
+  rom = makeRom(method)
+  plan = getBankScheme(method).createPlan()
+  assert plan.size == len(rom)
+  assert _runPlan(plan, SimCartridge(rom, method)) == rom
+
+
+@pytest.mark.parametrize('method', _kMethods)
+def test_block_reads_avoid_hotspots(method):
+  scheme = getBankScheme(method)
+  hotspots = set(scheme.hotspots if isinstance(scheme, FlatScheme) else
+                 list(scheme.hotspots.values()) + scheme.extraHotspots)
+  for block in scheme.createPlan().getBlockReads():
+    assert not hotspots & set(range(block.address, block.address + block.length))
+
+
+def test_mirrored_plan_reads_the_unique_part(makeRom):
+  rom = makeRom(BankSwitchMethod.NONE, size=0x800)
+  plan = createReadPlan(BankSwitchMethod.NONE, 0x800)
+  assert plan.size == 0x800
+  assert _runPlan(plan, SimCartridge(rom)) == rom
+
+
+@pytest.mark.parametrize('method', _kMethods)
+def test_mirror_probes(method):
+  scheme = getBankScheme(method)
+  for size in scheme.mirrorSizes:
+    assert len(scheme.getMirrorProbes(size, 4)) == 4
+  if isinstance(scheme, SlicedScheme):
+    assert scheme.getMirrorProbes(0x800, 4) == []
+
+
+@pytest.mark.parametrize('tuner', (BlockSizeTuner, ReadDelayTuner))
+def test_probe_range_is_rom_in_every_scheme(tuner):
+  first = tuner._kProbeAddress
+  last = first + tuner._kProbeLength
+  for method, scheme in getBankSchemes():
+    for start, end in scheme.unreadable:
+      assert last <= start or first >= end
+    if isinstance(scheme, SlicedScheme):
+      hotspots = list(scheme.hotspots.values()) + scheme.extraHotspots
+      if scheme.extraHotspots:
+        # E7 can map RAM into the first slice
+        assert first >= scheme.slices[0] + scheme.bankSize
+    else:
+      hotspots = scheme.hotspots
+    assert all(last <= hotspot for hotspot in hotspots)
+
+
+def test_scheme_needs_create_plan():
+  class IncompleteScheme(BankScheme):
+    pass
+
+  with pytest.raises(TypeError):
+    IncompleteScheme(0x1000)
@@ -0,0 +1,43 @@
+import pytest
+
+from romclient import *
+from fwsim import *
+from blocktune import BlockSizeTuner
+
+
+def test_long_blocks_win_on_a_slow_link(makeRom, makeClient):
+  rom = makeRom(BankSwitchMethod.NONE)
+  rc = makeClient(rom, BankSwitchMethod.NONE, latency=0.002)
+  tuner = BlockSizeTuner(rc.fw)
+  assert tuner.tune('reader') == 1024
+  assert [result.length for result in tuner.results] == list(BlockSizeTuner._kCandidates)
+  assert all(result.errors == 0 for result in tuner.results)
+  assert tuner.getCachedLength('reader') == 1024
+
+
+def test_lengths_are_limited_to_the_reader(makeRom, makeClient):
+  rom = makeRom(BankSwitchMethod.NONE)
+  rc = makeClient(rom, BankSwitchMethod.NONE, latency=0.002)
+  assert BlockSizeTuner(rc.fw).tune(maxLength=256) == 256
+  assert BlockSizeTuner(rc.fw).tune(candidates=(64, 128), maxLength=100) == 64
+
+
+def test_failing_lengths_are_rejected(makeRom, makeClient):
+  rom = makeRom(BankSwitchMethod.NONE)
+  rc = makeClient(rom, BankSwitchMethod.NONE, readTimeout=0.05, corruptionRate=1.0)
+  tuner = BlockSizeTuner(rc.fw)
+  assert tuner.tune('reader', candidates=(256, 1024)) is None
+  assert tuner.getCachedLength('reader') is None
+
+
+def test_client_uses_the_cached_length(makeRom, makeClient):
+  rom = makeRom(BankSwitchMethod.NONE)
+  rc = makeClient(rom, BankSwitchMethod.NONE, latency=0.002)
+  assert rc.tuneBlockLength() == 1024
+
+  messages = []
+  rc = makeClient(rom, BankSwitchMethod.NONE, latency=0.002)
+  rc.log = messages.append
+  rc.setBlockLength(64)
+  assert rc.tuneBlockLength() == 1024
+  assert 'Measuring the best block length.' not in messages
@@ -0,0 +1,63 @@
+import json
+import sys
+
+import pytest
+
+from romclient import *
+from fwsim import *
+from romdb import RomDatabase
+
+pytestmark = pytest.mark.skipif(sys.platform == 'win32', reason='needs a pseudo terminal')
+
+
+@pytest.fixture
+def reader(makeRom, tmp_path, monkeypatch):
+  """ Simulated reader with an F8 cartridge on a pseudo terminal. Runs in a
+  temporary directory, which gets the temporary ROM file. """
+  monkeypatch.chdir(tmp_path)
+  rom = makeRom(BankSwitchMethod.F8)
+  server = PtySimulator(SimSerial(FirmwareSimulator(SimCartridge(rom, BankSwitchMethod.F8))))
+  yield server.getPort(), rom
+  server.close()
+
+
+def _reports(capsys):
+  return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+
+@pytest.mark.parametrize('mode', ('dump', 'verify'))
+def test_dump(mode, reader, tmp_path, capsys):
+  port, rom = reader
+  output = tmp_path / 'game.a26'
+  metrics = tmp_path / 'metrics.json'
+  assert main([mode, '--port', port, '--method', 'F8', '--output', str(output),
+               '--timeout', '0.5', '--metrics', str(metrics)]) == 0
+  report, = _reports(capsys)
+  assert report['success'] and report['mode'] == mode
+  assert output.read_bytes() == rom
+  assert json.loads(metrics.read_text())['counters']['dumps'] >= 1
+
+
+def test_batch(reader, tmp_path, capsys):
+  port, rom = reader
+  assert main(['batch', '--port', port, '--method', 'F8', '--count', '1',
+               '--output', str(tmp_path / 'dump-{n:03}.a26'), '--timeout', '0.5']) == 0
+  report, = _reports(capsys)
+  assert report['success'] and report['mode'] == 'batch'
+  assert (tmp_path / 'dump-000.a26').read_bytes() == rom
+
+
+def test_identify_cartridge(reader, tmp_path, capsys):
+  port, rom = reader
+  database = RomDatabase(str(tmp_path / 'romdb.json'))
+  database.addRom('game', rom)
+  database.save()
+  assert main(['identify', '--port', port, '--method', 'F8', '--database', database.path,
+               '--timeout', '0.5']) == 0
+  assert _reports(capsys)[0]['rom'] == 'game'
+
+
+def test_errors(reader, tmp_path, capsys):
+  with pytest.raises(SystemExit):
+    main(['dump', '--port', reader[0]])
+  assert main(['dump', '--port', str(tmp_path / 'missing'), '--output', str(tmp_path / 'game.a26')]) == 1
@@ -0,0 +1,42 @@
+""" Read delay calibration against cartridges that need slow reads """
+
+from romclient import *
+from fwsim import *
+from delaytune import ReadDelayTuner
+
+
+def _client(makeClient, rom, minReadDelay):
+  cartridge = SimCartridge(rom, BankSwitchMethod.F8, minReadDelay=minReadDelay)
+  return makeClient(rom, BankSwitchMethod.F8, FirmwareSimulator(cartridge))
+
+
+def test_tune_finds_smallest_stable_delay(makeRom, makeClient):
+  rc = _client(makeClient, makeRom(BankSwitchMethod.F8), 13)
+  tuner = ReadDelayTuner(rc.fw)
+  assert tuner.tune('reader') == 13
+  assert rc.fw.getReadDelay() == 13
+  assert tuner.getCachedDelay('reader') == 13
+
+
+def test_tune_fails_when_never_stable(makeRom, makeClient):
+  rc = _client(makeClient, makeRom(BankSwitchMethod.F8), 100)
+  rc.fw.setReadDelay(5)
+  assert ReadDelayTuner(rc.fw).tune('reader') is None
+  assert rc.fw.getReadDelay() == 5
+
+
+def test_delay_is_cached_per_cartridge(makeRom, makeClient):
+  fast = _client(makeClient, makeRom(BankSwitchMethod.F8, seed=1), 2)
+  assert fast.calibrateReadDelay() == 2
+
+  # Same reader and bankswitching method, but a slower ROM
+  slow = _client(makeClient, makeRom(BankSwitchMethod.F8, seed=2), 20)
+  assert slow.calibrateReadDelay() == 20
+  assert slow.runDump()
+
+  # The fast cartridge gets its own delay back without calibrating
+  fast = _client(makeClient, makeRom(BankSwitchMethod.F8, seed=1), 2)
+  messages = []
+  fast.log = messages.append
+  assert fast.calibrateReadDelay() == 2
+  assert 'Calibrating the read delay.' not in messages
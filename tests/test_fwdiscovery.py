@@ -0,0 +1,59 @@
+import sys
+
+import pytest
+
+from fwdiscovery import ReaderDiscovery
+from fwlink import Fw_Link
+from fwsim import *
+from romcache import JsonCache
+
+pytestmark = pytest.mark.skipif(sys.platform == 'win32', reason='needs a pseudo terminal')
+
+_kInfo = b'fw=1.2;hw=3;block=512'
+
+
+@pytest.fixture
+def ports():
+  """ A reader and a device that never answers, on pseudo terminals """
+  cartridge = SimCartridge(bytes(4096))
+  servers = [PtySimulator(SimSerial(FirmwareSimulator(cartridge, _kInfo))),
+             PtySimulator(SimSerial(FirmwareSimulator(cartridge, commands=())))]
+  yield [server.getPort() for server in servers]
+  for server in servers:
+    server.close()
+
+
+def _discovery(tmp_path, monkeypatch, usbKeys):
+  discovery = ReaderDiscovery(JsonCache(str(tmp_path / 'readers.json')), timeout=0.1)
+  monkeypatch.setattr(discovery, '_listPorts',
+                      lambda ports: [(port, usbKeys.get(port)) for port in ports])
+  return discovery
+
+
+def test_discover(ports, tmp_path, monkeypatch):
+  reader, silent = ports
+  discovery = _discovery(tmp_path, monkeypatch, {reader: '2341:0043:1'})
+  readers = discovery.discover(ports)
+  assert [r.port for r in readers] == [reader]
+  assert readers[0].info.firmware == '1.2' and readers[0].info.maxBlockLength == 512
+  assert not readers[0].cached
+  assert discovery.findReader([silent]) is None
+
+
+def test_known_reader_is_not_probed(ports, tmp_path, monkeypatch):
+  reader, silent = ports
+  discovery = _discovery(tmp_path, monkeypatch, {reader: '2341:0043:1'})
+  discovery.discover([reader])
+  monkeypatch.setattr(discovery, 'probe', lambda port: pytest.fail('probed ' + port))
+  found = discovery.findReader([reader])
+  assert found.cached and found.info.firmware == '1.2'
+
+  link = Fw_Link()
+  assert link.open(reader, 0.1)
+  try:
+    assert discovery.identify(link).cached
+  finally:
+    link.close()
+
+  discovery.forget('2341:0043:1')
+  assert not _discovery(tmp_path, monkeypatch, {reader: '2341:0043:1'}).findReader([reader]).cached
@@ -0,0 +1,91 @@
+import os
+import random
+
+from fwframer import Fw_Framer
+from fwlink import Fw_Link
+from fwpacket import *
+from fwsim import *
+
+
+class _Serial():
+  """ Serial port that returns queued bytes in random chunks """
+  def __init__(self, data, seed = 0):
+    self.data = bytearray(data)
+    self._random = random.Random(seed)
+
+  @property
+  def in_waiting(self):
+    return self._random.randint(0, min(len(self.data), 50))
+
+  def readinto(self, buffer):
+    length = min(len(buffer), len(self.data))
+    buffer[:length] = self.data[:length]
+    del self.data[:length]
+    return length
+
+
+def _encodeReply(address, data):
+  reply = Fw_Packet(Fw_Command.READ_BLOCK, address=address, data=data)
+  reply.replyLength = len(data)
+  return bytes(reply._encode())
+
+
+def _frames(framer, ser, count, length):
+  frames = []
+  while len(frames) < count:
+    frame = framer.nextFrame(Fw_Command.READ_BLOCK, length)
+    if frame is None:
+      if not framer.fill(ser, framer.getMissing()):
+        break
+      continue
+    frames.append(bytes(frame))
+  return frames
+
+
+def test_frames_survive_compaction():
+  replies = [_encodeReply(0x1000 + 40 * i, os.urandom(40)) for i in range(200)]
+  framer = Fw_Framer(128)
+  assert _frames(framer, _Serial(b''.join(replies)), len(replies), 40) == replies
+  assert framer.discarded == 0
+
+
+def test_resync_skips_garbage():
+  replies = [_encodeReply(0x1000 + 16 * i, os.urandom(16)) for i in range(50)]
+  garbage = bytes([Fw_Command.READ_BLOCK, 0x00, 0xFF, 0x13, Fw_Command.READ_BLOCK])
+  framer = Fw_Framer(256)
+  frames = _frames(framer, _Serial(garbage.join(replies)), len(replies), 16)
+  assert [decodeFwPacket(frame).address for frame in frames] == [0x1000 + 16 * i for i in range(50)]
+  assert framer.discarded == len(garbage) * 49
+
+
+class _GarbageSerial(SimSerial):
+  """ Puts stray bytes in front of every reply """
+  def write(self, data):
+    length = SimSerial.write(self, data)
+    with self._lock:
+      self._pending = [(t, b'\x00R\x01' + reply) for t, reply in self._pending]
+    return length
+
+
+def test_link_resynchronizes():
+  rom = os.urandom(4096)
+  link = Fw_Link()
+  link.attach(_GarbageSerial(FirmwareSimulator(SimCartridge(rom))), 0.5)
+  replies = link.readBlocks(0x1000, 256, 16)
+  assert b''.join(bytes(reply.getData()) for reply in replies) == rom
+  assert link.metrics.counters['checksum_failures'] == 0
+  assert link.metrics.counters['bytes_discarded'] > 0
+
+
+def test_callback_payload_is_not_copied():
+  rom = os.urandom(4096)
+  link = Fw_Link()
+  link.attach(SimSerial(FirmwareSimulator(SimCartridge(rom))), 0.5)
+  data = bytearray(len(rom))
+  def store(reply):
+    assert isinstance(reply.getData(), memoryview)
+    start = reply.address - 0x1000
+    data[start:start + 256] = reply.getData()
+  replies = link.readBlocks(0x1000, 256, 16, callback=store)
+  assert data == rom
+  assert all(reply.getData() is None for reply in replies)
@@ -0,0 +1,37 @@
+from romclient import *
+from fwinfo import Fw_Info
+from fwsim import FirmwareSimulator, SimCartridge
+
+
+def test_capabilities():
+  info = Fw_Info.fromPayload(b'fw=1.2;hw=3\nblock=1024;depth=8;cmds=rRIn;batch=16\x00')
+  assert (info.firmware, info.hardware) == ('1.2', '3')
+  assert (info.maxBlockLength, info.pipelineDepth, info.maxBatch) == (1024, 8, 16)
+  assert info.supports(Fw_Command.NOP) and info.reports(Fw_Command.NOP)
+  assert not info.supports(Fw_Command.SET_READ_DELAY)
+  assert Fw_Info(info.toDict()).values == info.values
+
+
+def test_version_only():
+  info = Fw_Info.fromPayload(b'v0.9\r\n')
+  assert info.firmware == 'v0.9'
+  assert info.maxBlockLength is None and info.commands is None
+  # Commands that are not reported are assumed to exist, but not NOP
+  assert info.supports(Fw_Command.SET_READ_DELAY)
+  assert not info.reports(Fw_Command.NOP)
+
+
+def test_invalid_numbers_are_unknown():
+  info = Fw_Info.fromPayload(b'block=0;depth=x;batch=-1')
+  assert (info.maxBlockLength, info.pipelineDepth, info.maxBatch) == (None, None, None)
+
+
+def test_negotiated_block_length(makeRom, makeClient):
+  rom = makeRom(BankSwitchMethod.NONE)
+  rc = makeClient(rom, BankSwitchMethod.NONE, FirmwareSimulator(SimCartridge(rom), b'block=512'))
+  rc.negotiate()
+  assert rc.blockLength == 512
+  rc.setBlockLength(2048)
+  assert rc.blockLength == 512
+  assert rc.runDump()
+  assert bytes(rc.romData) == rom
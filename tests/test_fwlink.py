@@ -0,0 +1,90 @@
+import os
+
+import pytest
+
+from fwlink import Fw_Link
+from fwpacket import *
+from fwsim import *
+
+
+class _RecordingSerial(SimSerial):
+  """ Remembers the number of requests in every write """
+  def __init__(self, simulator, **link):
+    SimSerial.__init__(self, simulator, **link)
+    self.writes = []
+
+  def write(self, data):
+    self.writes.append(len(data) // Fw_Packet._HEADER_LENGTH)
+    return SimSerial.write(self, data)
+
+
+class _DroppingSimulator(FirmwareSimulator):
+  """ Does not answer READ_BLOCK requests of some addresses """
+  def __init__(self, cartridge, addresses):
+    FirmwareSimulator.__init__(self, cartridge)
+    self.addresses = set(addresses)
+
+  def execute(self, request):
+    if request.cmd == Fw_Command.READ_BLOCK and request.address in self.addresses:
+      return None
+    return FirmwareSimulator.execute(self, request)
+
+
+def _link(simulator, readTimeout = 0.5):
+  link = Fw_Link()
+  link.attach(_RecordingSerial(simulator), readTimeout)
+  return link
+
+
+@pytest.mark.parametrize('window', (1, 4, 16))
+def test_read_blocks(window):
+  rom = os.urandom(4096)
+  link = _link(FirmwareSimulator(SimCartridge(rom)))
+  stats = []
+  replies = link.readBlocks(0x1000, 256, 16, window=window, stats=stats)
+  assert b''.join(reply.getData() for reply in replies) == rom
+
+  # The window is filled first, then topped up with one request per reply
+  assert link.ser.writes[0] == window
+  assert all(count == 1 for count in link.ser.writes[1:])
+  assert len(stats) == 16 // window
+  assert all(window_.depth == window and window_.length == window * 256 for window_ in stats)
+
+
+def test_window_defaults_to_pipeline_depth():
+  link = _link(FirmwareSimulator(SimCartridge(os.urandom(4096))))
+  link.setPipelineDepth(8)
+  link.readBlocks(0x1000, 256, 16)
+  assert link.ser.writes[0] == 8
+
+
+def test_partial_read_returns_missing_blocks():
+  rom = os.urandom(4096)
+  link = _link(_DroppingSimulator(SimCartridge(rom), (0x1300,)), 0.1)
+  replies = link.readBlocks(0x1000, 256, 16, window=4, partial=True)
+  assert replies[3] is None
+  assert all(reply is not None for i, reply in enumerate(replies) if i < 3)
+
+  with pytest.raises(IOError):
+    link.flushInput()
+    link.readBlocks(0x1000, 256, 16, window=4)
+
+
+def test_batch_is_one_write():
+  rom = os.urandom(4096)
+  link = _link(FirmwareSimulator(SimCartridge(rom)))
+  link.setMaxBatch(16)
+  requests = [Fw_Packet(Fw_Command.READ_SINGLE, address=0x1000 + i) for i in range(10)]
+  requests.append(Fw_Packet(Fw_Command.READ_BLOCK, address=0x1100, length=64))
+  replies = link.transceiveBatch(requests)
+  assert link.ser.writes == [11]
+  assert bytes(reply.getData()[0] for reply in replies[:10]) == rom[:10]
+  assert replies[10].getData() == rom[0x100:0x140]
+
+
+def test_batch_is_split():
+  link = _link(FirmwareSimulator(SimCartridge(os.urandom(4096))))
+  link.setMaxBatch(4)
+  replies = link.transceiveBatch([Fw_Packet(Fw_Command.READ_SINGLE, address=0x1000 + i) for i in range(10)])
+  assert link.ser.writes == [4, 4, 2]
+  assert None not in replies
@@ -0,0 +1,62 @@
+import json
+import os
+import threading
+
+from romclient import *
+from fwmetrics import Fw_Histogram, Fw_Metrics
+
+
+def test_histogram():
+  histogram = Fw_Histogram((0.001, 0.01, 0.1))
+  for value in (0.0005, 0.005, 0.005, 0.05, 1.0):
+    histogram.observe(value)
+  assert histogram.counts == [1, 2, 1]
+  assert histogram.count == 5
+  assert (histogram.min, histogram.max) == (0.0005, 1.0)
+  assert histogram.getQuantile(0.5) == 0.01
+  assert histogram.getQuantile(1.0) == 1.0
+
+
+def test_prometheus_buckets_are_cumulative():
+  metrics = Fw_Metrics()
+  metrics.increment('retries', 3)
+  for value in (0.00001, 0.001, 20.0):
+    metrics.observe('rtt_seconds', value)
+  lines = metrics.toPrometheus({'port': 'sim://'}).splitlines()
+  assert 'romclient_retries_total{port="sim://"} 3' in lines
+  assert 'romclient_rtt_seconds_bucket{le="1e-05",port="sim://"} 1' in lines
+  assert 'romclient_rtt_seconds_bucket{le="10",port="sim://"} 2' in lines
+  assert 'romclient_rtt_seconds_bucket{le="+Inf",port="sim://"} 3' in lines
+  assert 'romclient_rtt_seconds_count{port="sim://"} 3' in lines
+
+
+def test_dump_metrics(makeRom, makeClient, tmp_path):
+  rom = makeRom(BankSwitchMethod.F8)
+  rc = makeClient(rom, BankSwitchMethod.F8)
+  assert rc.runDump()
+
+  path = str(tmp_path / 'metrics.json')
+  rc.getMetrics().writeJson(path)
+  with open(path) as f:
+    values = json.load(f)
+  assert values['counters']['dumps'] == 1
+  assert values['counters']['bytes_read'] >= len(rom)
+  assert values['counters']['transactions'] > 0
+  assert values['histograms']['dump_seconds']['count'] == 1
+  assert values['histograms']['read_seconds']['count'] > 0
+
+
+def test_concurrent_writers(tmp_path):
+  metrics = Fw_Metrics()
+  metrics.increment('dumps')
+  path = str(tmp_path / 'metrics.prom')
+  threads = [threading.Thread(target=lambda: [metrics.writePrometheus(path) for _ in range(20)])
+             for _ in range(4)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+
+  assert os.listdir(str(tmp_path)) == ['metrics.prom']
+  with open(path) as f:
+    assert 'romclient_dumps_total 1' in f.read()
@@ -0,0 +1,39 @@
+import os
+
+from fwpacket import *
+
+
+def test_request_round_trip():
+  request = Fw_Packet(Fw_Command.READ_BLOCK, address=0x1234, length=256)
+  decoded = decodeFwPacket(bytes(request._encode()))
+  assert decoded is not None
+  assert (decoded.cmd, decoded.address, decoded.replyLength) == (Fw_Command.READ_BLOCK, 0x1234, 256)
+  assert len(decoded.getData()) == 0
+
+
+def test_reply_round_trip():
+  data = os.urandom(300)
+  reply = Fw_Packet(Fw_Command.READ_BLOCK, address=0x1F00, data=data)
+  reply.replyLength = len(data)
+  decoded = decodeFwPacket(bytes(reply._encode()))
+  assert decoded.address == 0x1F00
+  assert bytes(decoded.getData()) == data
+
+
+def test_corrupted_packet_is_rejected():
+  reply = Fw_Packet(Fw_Command.READ_SINGLE, address=0x1000, data=b'\x42')
+  encoded = bytearray(reply._encode())
+  encoded[-1] ^= 0x10
+  assert decodeFwPacket(encoded) is None
+  assert decodeFwPacket(encoded[:5]) is None
+
+
+def test_batch_round_trip():
+  packets = []
+  for i in range(8):
+    packet = Fw_Packet(Fw_Command.READ_BLOCK, address=0x1000 + 64 * i, data=os.urandom(64))
+    packet.replyLength = 64
+    packets.append(packet)
+  decoded = decodeFwPackets(encodeFwPackets(packets))
+  assert [p.address for p in decoded] == [p.address for p in packets]
+  assert [bytes(p.getData()) for p in decoded] == [p.data for p in packets]
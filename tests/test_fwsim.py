@@ -0,0 +1,55 @@
+import os
+import sys
+import time
+
+import pytest
+
+from fwlink import Fw_Link
+from fwpacket import *
+from fwsim import *
+
+
+def test_hotspots_switch_banks():
+  rom = b'\xA0' * 0x1000 + b'\xB1' * 0x1000
+  cartridge = SimCartridge(rom, BankSwitchMethod.F8)
+  assert cartridge.read(0x1000) == 0xA0
+  # The hotspot returns the byte of the old bank, then switches
+  assert cartridge.read(0x1FF9) == 0xA0
+  assert cartridge.read(0x1000) == 0xB1
+  cartridge.reset()
+  assert cartridge.read(0x1000) == 0xA0
+
+
+def test_replies_arrive_after_the_modelled_delay():
+  sim = SimSerial(FirmwareSimulator(SimCartridge(os.urandom(4096))), latency=0.01, bandwidth=100000)
+  sim.timeout = 1
+  request = Fw_Packet(Fw_Command.READ_BLOCK, address=0x1000, length=990)
+  start = time.monotonic()
+  sim.write(request._encode())
+  assert sim.in_waiting == 0
+  reply = decodeFwPacket(sim.read(request.getReplyPacketLength()))
+  # Latency plus 1010 bytes at 100 kB/s
+  assert time.monotonic() - start >= 0.02
+  assert reply is not None and len(reply.getData()) == 990
+
+
+def test_corrupted_replies_fail_the_checksum():
+  sim = SimSerial(FirmwareSimulator(SimCartridge(os.urandom(4096))), corruptionRate=1.0, seed=0)
+  sim.timeout = 1
+  request = Fw_Packet(Fw_Command.READ_BLOCK, address=0x1000, length=64)
+  sim.write(request._encode())
+  assert decodeFwPacket(sim.read(request.getReplyPacketLength())) is None
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='needs a pseudo terminal')
+def test_pseudo_terminal():
+  rom = os.urandom(4096)
+  server = PtySimulator(SimSerial(FirmwareSimulator(SimCartridge(rom))))
+  link = Fw_Link()
+  try:
+    assert link.open(server.getPort(), 0.5)
+    replies = link.readBlocks(0x1000, 256, 16)
+    assert b''.join(reply.getData() for reply in replies) == rom
+  finally:
+    link.close()
+    server.close()
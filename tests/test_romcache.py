@@ -0,0 +1,32 @@
+import os
+import threading
+
+from romcache import JsonCache
+
+
+def test_caches_of_one_file_keep_each_others_entries(tmp_path):
+  path = str(tmp_path / 'cache.json')
+  first = JsonCache(path)
+  second = JsonCache(path)
+  first.set('a', 1)
+  second.set('b', 2)
+  first.remove('a')
+  assert JsonCache(path).get('b') == 2
+  assert JsonCache(path).get('a') is None
+
+
+def test_concurrent_saves(tmp_path):
+  path = str(tmp_path / 'cache.json')
+  def work(worker):
+    cache = JsonCache(path)
+    for i in range(20):
+      cache.set(str(worker) + '/' + str(i), i)
+  threads = [threading.Thread(target=work, args=(worker,)) for worker in range(8)]
+  for t in threads:
+    t.start()
+  for t in threads:
+    t.join()
+
+  cache = JsonCache(path)
+  assert all(cache.get(str(worker) + '/19') == 19 for worker in range(8))
+  assert os.listdir(str(tmp_path)) == ['cache.json']
@@ -0,0 +1,113 @@
+import pytest
+
+from romclient import *
+from fwsim import *
+
+
+class _CorruptingSimulator(FirmwareSimulator):
+  """ Corrupts the first replies to READ_SINGLE requests of some addresses """
+  def __init__(self, cartridge, addresses):
+    FirmwareSimulator.__init__(self, cartridge)
+    self.addresses = dict(addresses)
+
+  def feed(self, data):
+    replies = []
+    for reply in FirmwareSimulator.feed(self, data):
+      packet = decodeFwPacket(reply)
+      if packet.cmd == Fw_Command.READ_SINGLE and self.addresses.get(packet.address):
+        self.addresses[packet.address] -= 1
+        reply = reply[:-1] + bytes([reply[-1] ^ 0x40])
+      replies.append(reply)
+    return replies
+
+
+@pytest.mark.parametrize('method', (BankSwitchMethod.NONE, BankSwitchMethod.F8, BankSwitchMethod.F6,
+                                    BankSwitchMethod.FA, BankSwitchMethod.E0, BankSwitchMethod.E7))
+def test_dump(method, makeRom, makeClient):
+  rom = makeRom(method)
+  rc = makeClient(rom, method)
+  assert rc.runDump()
+  assert bytes(rc.romData) == rom
+
+
+@pytest.mark.parametrize('link', ({'corruptionRate': 0.1}, {'dropRate': 0.05}))
+def test_retries(link, makeRom, makeClient):
+  rom = makeRom(BankSwitchMethod.F6)
+  rc = makeClient(rom, BankSwitchMethod.F6, seed=1, **link)
+  rc.setBlockLength(128)
+  assert rc.runDump()
+  assert bytes(rc.romData) == rom
+  assert rc.getMetrics().counters['retries'] > 0
+
+
+def test_failure_after_retries(makeRom, makeClient):
+  rom = makeRom(BankSwitchMethod.NONE)
+  rc = makeClient(rom, BankSwitchMethod.NONE, readTimeout=0.05, corruptionRate=1.0)
+  rc.setRetryPolicy(RetryPolicy(attempts=1, backoff=0))
+  assert not rc.runDump()
+  assert not rc.dataValid
+
+
+@pytest.mark.parametrize('address', (0x1FF8, 0x1FF9))
+def test_failed_hotspot_access_reselects_the_bank(address, makeClient):
+  rom = b'\xA0' * 0x1000 + b'\xB1' * 0x1000
+  simulator = _CorruptingSimulator(SimCartridge(rom, BankSwitchMethod.F8), {address: 1})
+  rc = makeClient(rom, BankSwitchMethod.F8, simulator)
+  assert rc.runDump()
+  assert bytes(rc.romData) == rom
+
+
+@pytest.mark.parametrize('size', (0x800, 0x1000))
+def test_rom_size_is_detected(size, makeRom, makeClient):
+  rom = makeRom(BankSwitchMethod.NONE, size=size)
+  rc = makeClient(rom, BankSwitchMethod.NONE)
+  assert rc.runDump()
+  assert bytes(rc.romData) == rom
+
+
+def test_progress_stays_within_total(makeRom, makeClient):
+  rom = makeRom(BankSwitchMethod.F8)
+  rc = makeClient(rom, BankSwitchMethod.F8, corruptionRate=0.05, seed=3)
+  progress = []
+  rc.setProgressCallback(lambda done, total: progress.append((done, total)))
+  assert rc.runVerifiedDump(3) is not None
+  assert all(done <= total for done, total in progress)
+  assert progress[-1][0] == progress[-1][1]
+
+
+def test_reader_without_acknowledged_sync(makeRom, makeClient):
+  # Older firmware answers neither NOP nor GET_INFO
+  rom = makeRom(BankSwitchMethod.F8)
+  simulator = FirmwareSimulator(SimCartridge(rom, BankSwitchMethod.F8),
+                                commands=(Fw_Command.READ_SINGLE, Fw_Command.READ_BLOCK))
+  rc = makeClient(rom, BankSwitchMethod.F8, simulator, readTimeout=0.1)
+  assert rc.negotiate().firmware is None
+  assert not rc.fw.acknowledgedSync
+  assert rc.runDump()
+  assert rc.fw.rtt is None
+  assert bytes(rc.romData) == rom
+
+
+def test_reader_with_acknowledged_sync(makeRom, makeClient):
+  rom = makeRom(BankSwitchMethod.F8)
+  simulator = FirmwareSimulator(SimCartridge(rom, BankSwitchMethod.F8), info=b'fw=1.0;cmds=rRIn')
+  rc = makeClient(rom, BankSwitchMethod.F8, simulator)
+  assert rc.negotiate().firmware == '1.0'
+  assert rc.fw.acknowledgedSync
+  assert rc.runDump()
+  assert rc.fw.rtt is not None
+  assert bytes(rc.romData) == rom
+
+
+def test_transfer_defaults_follow_reader_info(makeRom, makeClient):
+  rom = makeRom(BankSwitchMethod.NONE)
+  rc = makeClient(rom, BankSwitchMethod.NONE, readTimeout=0.1)
+  rc.negotiate()
+  assert (rc.fw.pipelineDepth, rc.fw.maxBatch) == (1, 1)
+
+  simulator = FirmwareSimulator(SimCartridge(rom), info=b'fw=1.0;depth=8;batch=16')
+  rc = makeClient(rom, BankSwitchMethod.NONE, simulator)
+  rc.negotiate()
+  assert (rc.fw.pipelineDepth, rc.fw.maxBatch) == (8, 16)
+  assert rc.runDump()
+  assert bytes(rc.romData) == rom
@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+
+from romclient import *
+from romdb import RomDatabase
+from romdigest import RomDigest
+
+_kDat = '''<?xml version="1.0"?>
+<datafile>
+  <game name="Known"><rom name="Known.a26" size="4096" crc="{crc}" sha1="{sha1}"/></game>
+</datafile>
+'''
+
+
+def test_identify_and_prefixes(tmp_path):
+  rom = os.urandom(4096)
+  database = RomDatabase(str(tmp_path / 'romdb.json'))
+  database.addRom('game', rom)
+  database.addRom('game again', rom)
+  assert len(database.entries) == 1
+
+  digest = RomDigest.fromData(rom)
+  assert database.identify(digest).name == 'game'
+  assert [entry.name for entry in database.matchPrefix(256, digest.checkpoints[256])] == ['game']
+
+
+def test_reimport_dat_without_sha1(tmp_path):
+  datPath = tmp_path / 'roms.dat'
+  datPath.write_text('<datafile><game name="Old"><rom name="Old.a26" size="2048" crc="1234ABCD"/></game></datafile>')
+  path = str(tmp_path / 'romdb.json')
+  database = RomDatabase(path)
+  assert database.addDatFile(str(datPath)) == 1
+  assert database.addDatFile(str(datPath)) == 0
+  database.save()
+
+  database = RomDatabase(path)
+  assert database.addDatFile(str(datPath)) == 0
+  assert len(database.entries) == 1
+  assert sorted(os.listdir(str(tmp_path))) == ['romdb.json', 'roms.dat']
+
+
+def test_import_command(tmp_path, capsys):
+  rom = os.urandom(4096)
+  digest = RomDigest.fromData(rom)
+  datPath = tmp_path / 'roms.dat'
+  datPath.write_text(_kDat.format(crc=digest.getCrc32(), sha1=digest.getSha1()))
+  romPath = tmp_path / 'other.a26'
+  romPath.write_bytes(os.urandom(2048))
+  databasePath = str(tmp_path / 'romdb.json')
+
+  assert main(['import', '--database', databasePath, '--dat', str(datPath), '--rom', str(romPath)]) == 0
+  report = json.loads(capsys.readouterr().out)
+  assert report['success'] and report['added'] == 2
+
+  dumpPath = tmp_path / 'dump.a26'
+  dumpPath.write_bytes(rom)
+  assert main(['identify', '--database', databasePath, '--file', str(dumpPath)]) == 0
+  assert json.loads(capsys.readouterr().out)['rom'] == 'Known.a26'
+
+  assert main(['import', '--database', databasePath, '--dat', str(tmp_path / 'missing.dat')]) == 1
+  assert not json.loads(capsys.readouterr().out)['success']
+
+
+def test_digest_of_dump(makeRom, makeClient):
+  rom = makeRom(BankSwitchMethod.E0)
+  rc = makeClient(rom, BankSwitchMethod.E0)
+  assert rc.runDump()
+  digest = rc.getDigest()
+  assert digest.getSha1() == hashlib.sha1(rom).hexdigest()
+  assert digest.getCrc32() == RomDigest.fromData(rom).getCrc32()
+
+
+def test_known_rom_is_identified(makeRom, makeClient, tmp_path):
+  rom = makeRom(BankSwitchMethod.F8)
+  database = RomDatabase(str(tmp_path / 'romdb.json'))
+  database.addRom('game', rom)
+  messages = []
+  rc = makeClient(rom, BankSwitchMethod.F8)
+  rc.log = messages.append
+  rc.setRomDatabase(database)
+  assert rc.runDump()
+  assert 'Identified as game' in messages
+  assert rc.romEntry.name == 'game'
+
+
+def test_prefix_warning_once(makeRom, makeClient, tmp_path):
+  rom = makeRom(BankSwitchMethod.F8)
+  database = RomDatabase(str(tmp_path / 'romdb.json'))
+  database.addRom('other', makeRom(BankSwitchMethod.F8, seed=1))
+  messages = []
+  rc = makeClient(rom, BankSwitchMethod.F8, corruptionRate=0.05, seed=3)
+  rc.log = messages.append
+  rc.setRomDatabase(database)
+  assert rc.runVerifiedDump(3) is not None
+  assert sum('Warning' in message for message in messages) == 1
+  assert sum('Unknown ROM' in message for message in messages) == 1
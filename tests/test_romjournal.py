@@ -0,0 +1,57 @@
+import hashlib
+
+from romclient import *
+from fwsim import *
+from romjournal import DumpJournal
+
+
+def test_resume_after_cut_off_line(tmp_path):
+  path = str(tmp_path / 'journal')
+  journal = DumpJournal(path, 16, 'abc')
+  journal.record(0, b'\x01' * 4)
+  journal.record(8, b'\x02' * 4)
+  journal.close()
+  with open(path + '.journal', 'a') as f:
+    f.write('12 ')
+
+  journal = DumpJournal(path, 16, 'abc')
+  assert journal.getCompletedLength() == 8
+  assert journal.getMissingMask() == b'\x00' * 4 + b'\x01' * 4 + b'\x00' * 4 + b'\x01' * 4
+  assert journal.readImage() == b'\x01' * 4 + bytes(4) + b'\x02' * 4 + bytes(4)
+  journal.remove()
+
+
+def test_other_cartridge_starts_over(tmp_path):
+  path = str(tmp_path / 'journal')
+  journal = DumpJournal(path, 16, 'abc')
+  journal.record(0, b'\x01' * 4)
+  journal.close()
+  journal = DumpJournal(path, 16, 'def')
+  assert not journal.isResumed()
+  journal.remove()
+
+
+def test_journal_resume(makeRom, makeClient):
+  rom = makeRom(BankSwitchMethod.F8)
+  rc = makeClient(rom, BankSwitchMethod.F8, readTimeout=0.1)
+  rc.setJournalEnabled(True)
+  rc.setRetryPolicy(RetryPolicy(attempts=0))
+  simulator = rc.fw.ser.simulator
+  feed = simulator.feed
+  replies = [0]
+  def cutOff(data):
+    encoded = feed(data)
+    replies[0] += len(encoded)
+    return encoded if replies[0] < 12 else []
+  simulator.feed = cutOff
+  assert not rc.runDump()
+
+  simulator.feed = feed
+  checkpoints = []
+  checkPrefix = rc._checkPrefix
+  rc._checkPrefix = lambda length, crc: checkpoints.append(length) or checkPrefix(length, crc)
+  assert rc.runDump()
+  assert bytes(rc.romData) == rom
+  assert rc.getDigest().getSha1() == hashlib.sha1(rom).hexdigest()
+  # The resumed prefix is hashed before the rest is read
+  assert checkpoints[0] == 256
@@ -0,0 +1,59 @@
+import os
+import threading
+
+import pytest
+
+from rompool import *
+
+
+def _pool(tmp_path, monkeypatch, clients):
+  monkeypatch.chdir(tmp_path)
+  pool = RomClientPool(ports=[], log=lambda message: None)
+  for port, rc in clients.items():
+    pool._addClient(port, rc)
+  return pool
+
+
+def test_jobs_on_several_readers(makeRom, makeClient, tmp_path, monkeypatch):
+  roms = dict((port, makeRom(BankSwitchMethod.F8, seed=i)) for i, port in enumerate(('a', 'b')))
+  pool = _pool(tmp_path, monkeypatch,
+               dict((port, makeClient(rom, BankSwitchMethod.F8)) for port, rom in roms.items()))
+  results = pool.dumpAll(str(tmp_path / 'dump-{port}.a26'), BankSwitchMethod.F8)
+
+  assert len(results) == 2 and all(result.success for result in results)
+  for port, rom in roms.items():
+    with open(str(tmp_path / ('dump-' + port + '.a26')), 'rb') as f:
+      assert f.read() == rom
+  # The images are streamed to their files, not saved from memory
+  assert sorted(os.listdir(str(tmp_path))) == ['dump-a.a26', 'dump-b.a26']
+
+
+def test_jobs_without_readers(tmp_path, monkeypatch):
+  pool = _pool(tmp_path, monkeypatch, {})
+  pool.submit(DumpJob(str(tmp_path / 'one.a26')))
+  runner = threading.Thread(target=pool.run, daemon=True)
+  runner.start()
+  runner.join(10)
+  assert not runner.is_alive()
+  result, = pool.getResults()
+  assert not result.success and result.error == 'No reader'
+
+
+@pytest.mark.parametrize('error', (ValueError('bad value'), OSError('disk full'), ImportError('numpy')))
+def test_job_errors_are_results(error, makeRom, makeClient, tmp_path, monkeypatch):
+  rc = makeClient(makeRom(BankSwitchMethod.NONE), BankSwitchMethod.NONE)
+  def fail():
+    raise error
+  rc.runDump = fail
+  pool = _pool(tmp_path, monkeypatch, {'a': rc})
+  pool.submit(DumpJob(str(tmp_path / 'one.a26')))
+  pool.submit(DumpJob(str(tmp_path / 'two.a26'), port='a'))
+
+  # A worker that dies on the error leaves run() waiting forever
+  runner = threading.Thread(target=pool.run, daemon=True)
+  runner.start()
+  runner.join(10)
+  assert not runner.is_alive()
+  results = pool.getResults()
+  assert len(results) == 2
+  assert all(not result.success and result.error == str(error) for result in results)
@@ -0,0 +1,65 @@
+import os
+
+from romclient import *
+from fwsim import *
+from romsink import RomFileSink
+
+
+def _write(path, data):
+  with open(path, 'wb') as f:
+    f.write(data)
+
+
+def _read(path):
+  with open(path, 'rb') as f:
+    return f.read()
+
+
+def test_commit_replaces_the_target(tmp_path):
+  path = str(tmp_path / 'game.a26')
+  _write(path, b'old')
+  sink = RomFileSink(path, 4)
+  sink.data[0:4] = b'\x01\x02\x03\x04'
+  assert _read(path) == b'old'
+  sink.commit()
+  assert _read(path) == b'\x01\x02\x03\x04'
+  assert os.listdir(str(tmp_path)) == ['game.a26']
+
+
+def test_abort_keeps_the_target(tmp_path):
+  path = str(tmp_path / 'game.a26')
+  _write(path, b'old')
+  sink = RomFileSink(path, 4)
+  sink.data[0:2] = b'\x01\x02'
+  sink.abort()
+  assert _read(path) == b'old'
+  assert os.listdir(str(tmp_path)) == ['game.a26']
+
+
+def test_verified_dump_to_file(makeRom, makeClient, tmp_path):
+  rom = makeRom(BankSwitchMethod.F8)
+  rc = makeClient(rom, BankSwitchMethod.F8, corruptionRate=0.05, seed=2)
+  path = str(tmp_path / 'game.a26')
+  executePlan = rc._executePlan
+  def checkNotCommitted(plan, mask = None):
+    assert not os.path.exists(path)
+    executePlan(plan, mask)
+  rc._executePlan = checkNotCommitted
+
+  rc.setOutputFile(path)
+  result = rc.runVerifiedDump(4)
+  assert result is not None and result.passes >= 2
+  assert _read(path) == rom
+  assert not os.path.exists(path + '.part')
+
+
+def test_failed_dump_keeps_the_target(makeRom, makeClient, tmp_path):
+  rom = makeRom(BankSwitchMethod.F8)
+  rc = makeClient(rom, BankSwitchMethod.F8, readTimeout=0.05, corruptionRate=1.0)
+  rc.setRetryPolicy(RetryPolicy(attempts=0))
+  path = str(tmp_path / 'game.a26')
+  _write(path, b'old')
+  rc.setOutputFile(path)
+  assert not rc.runDump()
+  assert _read(path) == b'old'
+  assert not os.path.exists(path + '.part')
@@ -0,0 +1,36 @@
+import numpy
+
+from romclient import BankSwitchMethod
+from romverify import DumpVerifier
+
+
+def test_two_equal_passes_stop_early():
+  verifier = DumpVerifier(5)
+  verifier.addPass(b'\x01\x02\x03')
+  assert not verifier.done()
+  verifier.addPass(b'\x01\x02\x03')
+  assert verifier.done()
+  result = verifier.getResult()
+  assert result.agreed and result.isStable() and result.passes == 2
+
+
+def test_majority_vote():
+  verifier = DumpVerifier(3)
+  verifier.addPass(b'\x10\x20\x30\x40')
+  verifier.addPass(b'\x10\x21\x30\x41')
+  assert list(numpy.flatnonzero(verifier.getUnstableMask())) == [1, 3]
+  verifier.addPass(b'\x11\x20\x30\x41')
+  assert verifier.done()
+
+  result = verifier.getResult()
+  assert bytes(result.image) == b'\x10\x20\x30\x41'
+  assert not result.agreed
+  assert list(result.getUnstableOffsets()) == [0, 1, 3]
+
+
+def test_verified_dump(makeRom, makeClient):
+  rom = makeRom(BankSwitchMethod.F8)
+  rc = makeClient(rom, BankSwitchMethod.F8)
+  result = rc.runVerifiedDump(3)
+  assert result.agreed and result.passes == 2
+  assert bytes(rc.romData) == rom